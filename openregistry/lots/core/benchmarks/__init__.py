@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks of lots core hot paths
+
+Run ``python -m openregistry.lots.core.benchmarks --help`` for options.
+"""
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from openregistry.lots.core.benchmarks.cases import lots_benchmarks
+from openregistry.lots.core.benchmarks.runner import main
+
+sys.exit(main(lots_benchmarks))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from copy import deepcopy
+from datetime import datetime
+from threading import Thread
+
+from openregistry.lots.core.benchmarks.fixtures import (
+    PATCH,
+    SIZES,
+    BenchRequest,
+    InMemoryDB,
+    lot_data,
+    lots_registry
+)
+from openregistry.lots.core.benchmarks.runner import Benchmark
+from openregistry.lots.core.lot_id import (
+    BlockLotIDSequence,
+    CounterLotIDSequence,
+    RetryPolicy,
+    SnowflakeLotIDSequence
+)
+from openregistry.lots.core.utils import (
+    apply_patch,
+    generate_lot_id,
+    get_lot_changes,
+    lot_serialize,
+    store_lot
+)
+
+LISTING_MODEL_FIELDS = ['id', 'title', 'status', 'lotCustodian', 'documents']
+
+# lotID generation contention: workers, lotIDs per worker, database latency
+LOT_ID_WORKERS = 8
+LOT_ID_COUNT = 25
+LOT_ID_LATENCY = 0.001
+
+
+class BenchmarkError(Exception):
+    """ The benchmarked code did not do what is measured """
+
+
+def lot_benchmarks(size):
+    """ Benchmarks of a lot with documents and revisions of ``size`` """
+    registry = lots_registry()
+    data = lot_data(size)
+    model = registry.lot_type_index.models[data['lotType']]
+
+    def build(tracked=False):
+        lot = BenchRequest(registry).lot_from_data(deepcopy(data))
+        if tracked:
+            lot.track_changes()
+        return lot
+
+    def lot_from_data_setup():
+        return BenchRequest(registry), deepcopy(data)
+
+    def lot_from_data_run(request, data):
+        request.lot_from_data(data)
+
+    yield Benchmark('lot_from_data.{}'.format(size), lot_from_data_run, lot_from_data_setup)
+
+    for role in sorted(model._options.roles):
+        def serialize_run(lot, role=role):
+            lot.serialize(role)
+        yield Benchmark('serialize.{}.{}'.format(role, size), serialize_run, lambda: (build(), ))
+
+    for tracked in (False, True):
+        def apply_patch_setup(tracked=tracked):
+            return (BenchRequest(registry, build(tracked), deepcopy(PATCH)), )
+
+        def apply_patch_run(request):
+            apply_patch(request, save=False)
+        yield Benchmark('apply_patch{}.{}'.format('.tracked' if tracked else '', size),
+                        apply_patch_run, apply_patch_setup)
+
+    for tracked in (False, True):
+        def store_lot_setup(tracked=tracked):
+            # the stored lot is put back for every round to keep its revision
+            registry.db.put(data)
+            lot = build(tracked)
+            src = None if tracked else lot.serialize('plain')
+            lot.import_data(PATCH)
+            return BenchRequest(registry, lot), lot, src
+
+        def store_lot_run(request, lot, src):
+            patch = get_lot_changes(lot, src, request)
+            if not patch or not store_lot(lot, patch, request):
+                raise BenchmarkError('Lot is not stored: {}'.format(request.errors))
+        yield Benchmark('store_lot{}.{}'.format('.tracked' if tracked else '', size),
+                        store_lot_run, store_lot_setup)
+
+    def listing_setup():
+        return BenchRequest(registry), deepcopy(data)
+
+    def listing_model_run(request, row):
+        lot_serialize(request, row, LISTING_MODEL_FIELDS)
+
+    yield Benchmark('lot_serialize.model.{}'.format(size), listing_model_run, listing_setup)
+
+
+def lot_id_benchmarks(workers=LOT_ID_WORKERS, count=LOT_ID_COUNT, latency=LOT_ID_LATENCY):
+    """ lotID generation by ``workers`` processes sharing the counter document
+
+    Workers are threads with sequences of their own. Each round generates
+    ``count`` lotIDs per worker, conflicts and retries of the counter
+    document updates are reported as counters.
+    """
+    sequences = [
+        ('counter', lambda worker, policy: CounterLotIDSequence(policy)),
+        ('block', lambda worker, policy: BlockLotIDSequence(retry_policy=policy)),
+        ('snowflake', lambda worker, policy: SnowflakeLotIDSequence()),
+    ]
+    for mode, sequence_factory in sequences:
+        def setup(sequence_factory=sequence_factory):
+            policy = RetryPolicy(max_attempts=1000, deadline=60.0, base_delay=latency, max_delay=latency * 50)
+            return InMemoryDB(latency), policy, [sequence_factory(i, policy) for i in range(workers)]
+
+        def run(db, policy, sequences):
+            ctime = datetime.now()
+            lot_ids = [[] for _ in sequences]
+
+            def generate(sequence, generated):
+                for _ in range(count):
+                    generated.append(generate_lot_id(ctime, db, sequence=sequence))
+
+            threads = [Thread(target=generate, args=i) for i in zip(sequences, lot_ids)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            lot_ids = sum(lot_ids, [])
+            if len(set(lot_ids)) != workers * count:
+                raise BenchmarkError('{} of {} lotIDs are unique'.format(len(set(lot_ids)), workers * count))
+            return {'lot_ids': len(lot_ids), 'conflicts': policy.stats['conflicts'],
+                    'retries': policy.stats['retries']}
+        yield Benchmark('generate_lot_id.{}.{}x{}'.format(mode, workers, count), run, setup)
+
+
+def lots_benchmarks(sizes=SIZES):
+    """ All benchmarks, of the lots of ``sizes`` """
+    for size in sizes:
+        for benchmark in lot_benchmarks(size):
+            yield benchmark
+    for benchmark in lot_id_benchmarks():
+        yield benchmark
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import json
+from collections import OrderedDict
+from hashlib import md5
+from threading import Lock
+from time import sleep
+from uuid import uuid4
+
+from couchdb.http import ResourceConflict
+from cornice.errors import Errors
+from pyramid.config import Configurator
+from pyramid.registry import Registry
+
+from openregistry.lots.core.constants import DEFAULT_LOT_TYPE
+from openregistry.lots.core.metrics import Metrics
+from openregistry.lots.core.models import Lot
+from openregistry.lots.core.utils import lot_from_data, register_lotType
+
+# documents and revisions of the lot fixtures
+SIZES = OrderedDict([
+    ('small', (1, 1)),
+    ('medium', (20, 50)),
+    ('huge', (300, 1000)),
+])
+
+DATE = '2018-01-01T00:00:00+02:00'
+
+ORGANIZATION = {
+    'name': u'Державне управління справами',
+    'identifier': {
+        'scheme': u'UA-EDR',
+        'id': u'00037256',
+        'uri': u'http://www.dus.gov.ua/'
+    },
+    'address': {
+        'countryName': u'Україна',
+        'postalCode': u'01220',
+        'region': u'м. Київ',
+        'locality': u'м. Київ',
+        'streetAddress': u'вул. Банкова, 11, корпус 1'
+    },
+    'contactPoint': {
+        'name': u'Державне управління справами',
+        'telephone': u'0440000000'
+    }
+}
+
+PATCH = {
+    'title': u'Лот (змінено)',
+    'description': u'Опис лоту (змінено)',
+}
+
+
+def fixed_id(*parts):
+    """ Id which stays the same between runs """
+    return md5('-'.join([str(i) for i in parts])).hexdigest()
+
+
+def document_data(index):
+    return {
+        'id': fixed_id('document', index),
+        'title': u'Документ {}.pdf'.format(index),
+        'description': u'Опис документа {}'.format(index),
+        'format': 'application/pdf',
+        'url': 'http://localhost/get/{}?KeyID=a8968c46&Signature=x'.format(fixed_id('url', index)),
+        'hash': 'md5:' + fixed_id('hash', index),
+        'documentType': 'notice',
+        'datePublished': DATE,
+        'dateModified': DATE,
+    }
+
+
+def revision_data(index):
+    return {
+        'author': 'broker',
+        'date': DATE,
+        'rev': '{}-{}'.format(index + 1, fixed_id('rev', index)),
+        'changes': [{'op': 'replace', 'path': '/title', 'value': u'Лот {}'.format(index)}],
+    }
+
+
+def lot_data(size, status='pending'):
+    """ Stored lot document with documents and revisions of ``size`` """
+    documents, revisions = SIZES[size]
+    return {
+        '_id': fixed_id('lot', size),
+        '_rev': '{}-{}'.format(revisions + 1, fixed_id('lot_rev', size)),
+        'doc_type': 'Lot',
+        'lotType': DEFAULT_LOT_TYPE,
+        'lotID': 'UA-LR-DGF-2018-01-01-000001',
+        'date': DATE,
+        'dateModified': DATE,
+        'status': status,
+        'title': u'Лот',
+        'description': u'Опис лоту',
+        'lotCustodian': ORGANIZATION,
+        'assets': [fixed_id('asset', size)],
+        'owner': 'broker',
+        'owner_token': fixed_id('token', size),
+        'documents': [document_data(i) for i in range(documents)],
+        'revisions': [revision_data(i) for i in range(revisions)],
+    }
+
+
+def next_rev(rev):
+    return '{}-{}'.format(int(rev.split('-')[0]) + 1 if rev else 1, uuid4().hex)
+
+
+class InMemoryDB(object):
+    """ CouchDB database stand-in keeping JSON encoded documents in memory
+
+    Every request waits ``latency`` seconds first, so concurrent writers of
+    a document conflict as they would with CouchDB.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.docs = {}
+        self.lock = Lock()
+
+    def wait(self):
+        if self.latency:
+            sleep(self.latency)
+
+    def put(self, doc):
+        """ Store ``doc`` as it is, without the revision check """
+        self.docs[doc['_id']] = json.dumps(doc)
+
+    def get(self, doc_id, default=None):
+        self.wait()
+        doc = self.docs.get(doc_id)
+        return json.loads(doc) if doc is not None else default
+
+    def _save(self, doc):
+        doc_id = doc.setdefault('_id', uuid4().hex)
+        with self.lock:
+            stored = self.docs.get(doc_id)
+            if (stored and json.loads(stored).get('_rev')) != doc.get('_rev'):
+                raise ResourceConflict(('conflict', 'Document update conflict.'))
+            doc['_rev'] = next_rev(doc.get('_rev'))
+            self.docs[doc_id] = json.dumps(doc)
+        return doc_id, doc['_rev']
+
+    def save(self, doc):
+        self.wait()
+        return self._save(doc)
+
+    def update(self, docs):
+        self.wait()
+        results = []
+        for doc in docs:
+            try:
+                results.append((True, ) + self._save(doc))
+            except ResourceConflict, e:
+                results.append((False, doc.get('_id'), e))
+        return results
+
+
+class BenchRequest(object):
+    """ Request stand-in with the attributes lots core functions use """
+
+    authenticated_userid = 'broker'
+    authenticated_role = 'broker'
+    application_url = 'http://localhost'
+    matched_route = None
+
+    def __init__(self, registry, context=None, data=None):
+        self.registry = registry
+        self.context = context
+        self.validated = {'data': data} if data is not None else {}
+        self.errors = Errors(status=400)
+        self.environ = {}
+        self.logging_context = {}
+        self.lot_stage_timings = []
+
+    def lot_from_data(self, data, raise_error=True, create=True):
+        return lot_from_data(self, data, raise_error, create)
+
+
+def lots_registry(db=None, model=Lot, lot_type=DEFAULT_LOT_TYPE):
+    """ Registry with ``model`` registered and the optional features off """
+    config = Configurator(registry=Registry('lots_benchmarks'))
+    registry = config.registry
+    registry.db = db if db is not None else InMemoryDB()
+    registry.lotTypes = {}
+    registry.lot_type_configurator = {}
+    registry.lot_metrics = Metrics()
+    registry.lot_doc_cache = None
+    registry.lot_serialization_cache = None
+    registry.lot_history = None
+    registry.view_warmer = None
+    registry.lot_change_tracking = False
+    register_lotType(config, model, lot_type)
+    return registry
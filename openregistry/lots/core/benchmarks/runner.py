@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import argparse
+import gc
+import json
+import platform
+import re
+import sys
+from datetime import datetime
+from timeit import default_timer
+
+from pkg_resources import get_distribution
+
+RESULTS_VERSION = 1
+DEFAULT_THRESHOLD = 0.1
+
+
+class Benchmark(object):
+    """ ``run`` timed with the arguments returned by untimed ``setup``
+
+    ``run`` may return a dict of counters, they are summed over the rounds.
+    """
+
+    def __init__(self, name, run, setup=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def summary(timings):
+    """ Statistics of round ``timings``, in seconds """
+    mean = sum(timings) / len(timings)
+    return {
+        'rounds': len(timings),
+        'min': min(timings),
+        'max': max(timings),
+        'mean': mean,
+        'median': median(timings),
+        'stdev': (sum([(i - mean) ** 2 for i in timings]) / len(timings)) ** 0.5,
+    }
+
+
+def measure(benchmark, min_time=0.5, min_rounds=5, max_rounds=1000):
+    """ Time ``benchmark`` rounds until ``min_time`` is spent in them
+
+    Garbage collection is disabled in timed code, as timeit does.
+    """
+    timings, extra = [], {}
+    while len(timings) < min_rounds or (sum(timings) < min_time and len(timings) < max_rounds):
+        args = benchmark.setup() if benchmark.setup is not None else ()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = default_timer()
+            counters = benchmark.run(*args)
+            timings.append(default_timer() - start)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        for name, value in (counters or {}).items():
+            extra[name] = extra.get(name, 0) + value
+    result = summary(timings)
+    if extra:
+        result['extra'] = extra
+    return result
+
+
+def run_benchmarks(benchmarks, pattern=None, log=None, **options):
+    """ Results of ``benchmarks`` with names matching ``pattern``
+
+    Failed benchmarks are recorded with the ``error`` instead of timings.
+    """
+    results = {}
+    for benchmark in benchmarks:
+        if pattern and not re.search(pattern, benchmark.name):
+            continue
+        try:
+            results[benchmark.name] = measure(benchmark, **options)
+        except Exception, e:
+            results[benchmark.name] = {'error': '{}: {}'.format(type(e).__name__, e)}
+        if log is not None:
+            log(format_result(benchmark.name, results[benchmark.name]))
+    return {
+        'version': RESULTS_VERSION,
+        'date': datetime.utcnow().isoformat(),
+        'machine': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3)):
+        if seconds >= 1 / scale:
+            return '{:.3f}{}'.format(seconds * scale, unit)
+    return '{:.1f}us'.format(seconds * 1e6)
+
+
+def format_result(name, result):
+    if 'error' in result:
+        return '{:<48} ERROR {}'.format(name, result['error'])
+    return '{:<48} {:>12} median {:>12} min {:>6} rounds'.format(
+        name, format_seconds(result['median']), format_seconds(result['min']), result['rounds'])
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, statistic='median'):
+    """ ``(name, status, ratio)`` of ``results`` against ``baseline`` results
+
+    Status is ``regression`` when ``statistic`` grew by more than
+    ``threshold`` share, ``improvement`` when it got as much faster,
+    ``same`` otherwise, and ``new``, ``missing`` or ``error`` for the
+    benchmarks which can't be compared.
+    """
+    current, previous = results['results'], baseline['results']
+    comparison = []
+    for name in sorted(set(current) | set(previous)):
+        if name not in previous:
+            comparison.append((name, 'new', None))
+        elif name not in current:
+            comparison.append((name, 'missing', None))
+        elif 'error' in current[name] or 'error' in previous[name]:
+            comparison.append((name, 'error', None))
+        else:
+            ratio = current[name][statistic] / previous[name][statistic]
+            if ratio > 1 + threshold:
+                status = 'regression'
+            elif ratio < 1 / (1 + threshold):
+                status = 'improvement'
+            else:
+                status = 'same'
+            comparison.append((name, status, ratio))
+    return comparison
+
+
+def format_comparison(comparison):
+    return '\n'.join([
+        '{:<48} {:<12} {}'.format(name, status, 'x{:.2f}'.format(ratio) if ratio is not None else '')
+        for name, status, ratio in comparison
+    ])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m openregistry.lots.core.benchmarks',
+                                     description='Benchmarks of lots core hot paths.')
+    parser.add_argument('-o', '--output', help='write results as JSON to the file')
+    parser.add_argument('-b', '--baseline', help='compare results with JSON results of the file')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='slowdown share reported as regression (default: %(default)s)')
+    parser.add_argument('-k', '--pattern', help='run benchmarks with names matching the regular expression')
+    parser.add_argument('--sizes', default='small,medium,huge',
+                        help='comma separated lot fixture sizes (default: %(default)s)')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='seconds to spend in each benchmark (default: %(default)s)')
+    parser.add_argument('--min-rounds', type=int, default=5,
+                        help='least rounds of each benchmark (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def main(benchmarks_factory, argv=None):
+    """ Run benchmarks of ``benchmarks_factory(sizes)``
+
+    Returns exit status, 1 on errors or regressions.
+    """
+    args = parse_args(argv)
+
+    def log(line):
+        sys.stderr.write(line + '\n')
+
+    results = run_benchmarks(benchmarks_factory(args.sizes.split(',')), args.pattern, log,
+                             min_time=args.min_time, min_rounds=args.min_rounds)
+    results['package'] = get_distribution('openregistry.lots.core').version
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    failed = any(['error' in i for i in results['results'].values()])
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            comparison = compare(results, json.load(baseline), args.threshold)
+        log(format_comparison(comparison))
+        failed = failed or any([status in ('regression', 'error') for _, status, _ in comparison])
+    return 1 if failed else 0
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import os
+from collections import OrderedDict
+from copy import deepcopy
+from decimal import Decimal
+from hashlib import sha1
+from json import dumps, loads
+from logging import getLogger
+from tempfile import NamedTemporaryFile
+from threading import Lock, Thread
+from time import time, sleep
+
+LOGGER = getLogger(__name__)
+
+
+class LotDocumentCache(object):
+    """ Process-level LRU cache of raw lot documents
+
+    Entries are keyed by document id and keep the revision they were read
+    at, so invalidation coming from the ``_changes`` feed can skip entries
+    which are already up to date. Entries older than ``ttl`` seconds are
+    dropped on access.
+
+    Documents read from the database are cached with the ``generation``
+    taken before the read, they are skipped when their id was invalidated
+    in the meantime. The last ``size`` invalidated ids are remembered,
+    documents read before older invalidations are skipped.
+    """
+
+    def __init__(self, size=1000, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.docs = OrderedDict()
+        self.invalidated = OrderedDict()
+        self.invalidations = 0
+        self.forgotten = 0
+        self.lock = Lock()
+
+    def generation(self):
+        with self.lock:
+            return self.invalidations
+
+    def get(self, doc_id):
+        with self.lock:
+            entry = self.docs.pop(doc_id, None)
+            if entry is None:
+                return
+            if self.ttl and entry[1] + self.ttl < time():
+                return
+            self.docs[doc_id] = entry
+        return deepcopy(entry[2])
+
+    def set(self, doc, generation=None):
+        entry = (doc['_rev'], time(), deepcopy(doc))
+        with self.lock:
+            if generation is not None and (generation < self.forgotten or
+                                           self.invalidated.get(doc['_id'], 0) > generation):
+                return
+            self.docs.pop(doc['_id'], None)
+            self.docs[doc['_id']] = entry
+            while len(self.docs) > self.size:
+                self.docs.popitem(last=False)
+
+    def invalidate(self, doc_id, rev=None):
+        with self.lock:
+            self.invalidations += 1
+            self.invalidated.pop(doc_id, None)
+            self.invalidated[doc_id] = self.invalidations
+            while len(self.invalidated) > self.size:
+                self.forgotten = self.invalidated.popitem(last=False)[1]
+            entry = self.docs.get(doc_id)
+            if entry is not None and (rev is None or entry[0] != rev):
+                del self.docs[doc_id]
+
+    def clear(self):
+        with self.lock:
+            self.docs.clear()
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return unicode(value)
+
+
+class SerializationCache(object):
+    """ Bounded cache of lot serializations keyed by (id, rev, role, ...)
+
+    Serializations must depend on the key only, so it's used for the lot
+    types declaring ``cacheable_serialization`` (see ``serialize_lot``).
+
+    Memory use is capped by the JSON size of the cached values. With
+    ``directory`` set, serializations are also written there (point it to
+    tmpfs to share them between the workers of a host) and looked up on
+    memory misses; the oldest files above ``max_files`` are pruned.
+
+    Hits, file hits, misses and evictions are kept in ``stats`` and counted
+    by ``lot_serialization_cache_<event>_total`` counters of ``metrics``.
+    """
+
+    prune_every = 100
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_files=10000, metrics=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_files = max_files
+        self.writes = 0
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.lock = Lock()
+        self.stats = {'hits': 0, 'file_hits': 0, 'misses': 0, 'evictions': 0}
+        self.metrics = metrics
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.pop(key, None)
+            if entry is not None:
+                self.items[key] = entry
+                self._count('hits')
+        if entry is not None:
+            return deepcopy(entry[0])
+        if self.directory:
+            try:
+                with open(self._path(key)) as f:
+                    dumped = f.read()
+            except IOError:
+                pass
+            else:
+                value = loads(dumped)
+                self._store(key, value, len(dumped))
+                with self.lock:
+                    self._count('file_hits')
+                return deepcopy(value)
+        with self.lock:
+            self._count('misses')
+
+    def _count(self, name):
+        """ Count ``name`` event, called under the lock """
+        self.stats[name] += 1
+        if self.metrics is not None:
+            self.metrics.counter('lot_serialization_cache_{}_total'.format(name)).inc()
+
+    def set(self, key, value):
+        dumped = dumps(value, default=_json_default)
+        self._store(key, deepcopy(value), len(dumped))
+        if self.directory:
+            self._write(key, dumped)
+
+    def _store(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.items[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.items.popitem(last=False)[1][1]
+                self._count('evictions')
+
+    def _path(self, key):
+        return os.path.join(self.directory, sha1(repr(key)).hexdigest() + '.json')
+
+    def _write(self, key, dumped):
+        try:
+            with NamedTemporaryFile(dir=self.directory, delete=False) as f:
+                f.write(dumped)
+            os.rename(f.name, self._path(key))
+            self.writes += 1
+            if self.writes % self.prune_every == 0:
+                self._prune()
+        except (IOError, OSError), e:
+            LOGGER.warning('Failed to write lot serialization cache file: {!r}'.format(e),
+                           extra={'MESSAGE_ID': 'lot_serialization_cache_error'})
+
+    def _prune(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        if len(paths) <= self.max_files:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_files]:
+            os.remove(path)
+
+
+def changes_heartbeat(db, default=30000):
+    """ ``_changes`` feed heartbeat in milliseconds, within the socket timeout of ``db`` """
+    timeout = getattr(db.resource.session.connection_pool, 'timeout', None)
+    if not timeout:
+        return default
+    return min(default, int(timeout * 1000 / 2))
+
+
+def follow_changes(db, cache, retry_delay=5):
+    """ Invalidate cached documents changed by other processes
+
+    The feed is resumed from the last seen sequence after failures, so the
+    cache is only cleared when no sequence was seen yet.
+    """
+    since = 'now'
+    heartbeat = changes_heartbeat(db)
+    while True:
+        try:
+            for change in db.changes(feed='continuous', since=since, heartbeat=heartbeat):
+                if 'id' in change:
+                    cache.invalidate(change['id'], change['changes'][-1]['rev'])
+                since = change.get('seq', change.get('last_seq', since))
+        except Exception, e:
+            LOGGER.warning('Lot cache changes feed failed: {!r}'.format(e),
+                           extra={'MESSAGE_ID': 'lot_cache_changes_error'})
+        if since == 'now':
+            # entries could miss changes while the feed was down
+            cache.clear()
+        sleep(retry_delay)
+
+
+def lot_cache_factory(settings):
+    """ Build lot document cache from ``lot_cache`` plugin settings """
+    if not settings:
+        return
+    return LotDocumentCache(size=int(settings.get('size', 1000)),
+                            ttl=float(settings.get('ttl', 60)))
+
+
+def serialization_cache_factory(settings, metrics=None):
+    """ Build lot serialization cache from ``serialization_cache`` plugin settings """
+    if not settings:
+        return
+    directory = settings.get('directory')
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    return SerializationCache(max_bytes=int(settings.get('max_bytes', 64 * 1024 * 1024)),
+                              directory=directory,
+                              max_files=int(settings.get('max_files', 10000)),
+                              metrics=metrics)
+
+
+def start_changes_follower(event):
+    """ ApplicationCreated subscriber starting the ``_changes`` feed follower """
+    registry = event.app.registry
+    thread = Thread(target=follow_changes, args=(registry.db, registry.lot_doc_cache))
+    thread.daemon = True
+    thread.start()
+    LOGGER.info('Started lot cache changes feed follower', extra={'MESSAGE_ID': 'lot_cache_changes'})
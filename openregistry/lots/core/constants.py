@@ -11,6 +11,8 @@ from openprocurement.api.constants import (  # noqa: F401
 
 DEFAULT_LOT_TYPE = 'basic'
 
+BATCH_SIZE_LIMIT = 1000
+
 LOT_STATUSES = ["draft", "pending", "deleted", "pending.deleted", "verification", "recomposed",
                 "active.salable", "pending.dissolution", "dissolved", "active.awaiting",
                 "active.auction", "pending.sold", "sold"]
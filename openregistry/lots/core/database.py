@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from time import time
+from urlparse import urlsplit
+
+from couchdb.client import Database
+from couchdb.http import ConnectionPool, Resource, Session
+from pyramid.settings import asbool
+
+LOGGER = getLogger(__name__)
+
+
+def db_operation(method, url):
+    """ Kind of CouchDB request: get, save, view, bulk or changes """
+    path = urlsplit(url).path
+    if path.endswith('/_bulk_docs'):
+        return 'bulk'
+    if '/_view/' in path or path.endswith('/_all_docs'):
+        return 'view'
+    if path.endswith('/_changes'):
+        return 'changes'
+    return 'get' if method in ('GET', 'HEAD') else 'save'
+
+
+class IdleConnectionPool(ConnectionPool):
+    """ Connection pool keeping at most ``max_idle`` idle connections per host
+
+    Only the connections returned to the pool are limited, each concurrent
+    request still opens a connection when none is idle. Connections over
+    the limit are closed once released, as all of them are without
+    ``keepalive``.
+    """
+
+    def __init__(self, timeout, max_idle=10, keepalive=True, **kwargs):
+        super(IdleConnectionPool, self).__init__(timeout, **kwargs)
+        self.max_idle = max_idle
+        self.keepalive = keepalive
+
+    def release(self, url, conn):
+        if self.keepalive:
+            scheme, host = urlsplit(url)[:2]
+            with self.lock:
+                conns = self.conns.setdefault((scheme, host), [])
+                if len(conns) < self.max_idle:
+                    conns.append(conn)
+                    return
+        conn.close()
+
+
+class LotsSession(Session):
+    """ CouchDB session measuring requests by ``db_operation``
+
+    Latency of the requests is observed by ``couchdb_request_seconds``
+    histograms and failed requests are counted by ``couchdb_errors_total``.
+    """
+
+    def __init__(self, metrics, max_idle=10, keepalive=True, timeout=None, retry_delays=None):
+        super(LotsSession, self).__init__(timeout=timeout, retry_delays=retry_delays or [0])
+        # retries of the replaced session are kept unless configured
+        self.inherit_retries = retry_delays is None
+        self.metrics = metrics
+        self.connection_pool = IdleConnectionPool(timeout, max_idle, keepalive)
+
+    def request(self, method, url, *args, **kwargs):
+        operation = db_operation(method, url)
+        start = time()
+        try:
+            return super(LotsSession, self).request(method, url, *args, **kwargs)
+        except Exception, e:
+            self.metrics.counter('couchdb_errors_total', operation=operation, error=type(e).__name__).inc()
+            raise
+        finally:
+            self.metrics.histogram('couchdb_request_seconds', operation=operation).observe(time() - start)
+
+
+def lots_session_factory(settings, metrics):
+    """ Build session from ``db_session`` plugin settings """
+    if not settings:
+        return
+    timeout = settings.get('timeout')
+    retry_delays = settings.get('retry_delays')
+    return LotsSession(
+        metrics,
+        max_idle=int(settings.get('max_idle_connections', 10)),
+        keepalive=asbool(settings.get('keepalive', True)),
+        timeout=float(timeout) if timeout else None,
+        retry_delays=[float(i) for i in retry_delays] if retry_delays is not None else None,
+    )
+
+
+def lots_database(db, session):
+    """ ``db`` accessed through ``session`` """
+    if session.inherit_retries:
+        session.retry_delays = list(db.resource.session.retry_delays)
+    resource = Resource(db.resource.url, session)
+    resource.credentials = db.resource.credentials
+    resource.headers = db.resource.headers.copy()
+    return Database(resource, db.name)
+
+
+def install_lots_session(event):
+    """ Serve ``registry.db`` through the lots session """
+    registry = event.app.registry
+    registry.db = lots_database(registry.db, registry.lots_db_session)
+    LOGGER.info('Serving lots database through pooled session',
+                extra={'MESSAGE_ID': 'lots_db_session'})
@@ -1,116 +1,363 @@
 # -*- coding: utf-8 -*-
+import re
+from hashlib import sha1
+from json import dumps, loads
+from logging import getLogger
+from threading import Thread
+
+from couchdb import ResourceConflict, ResourceNotFound
+from couchdb.client import Row
 from couchdb.design import ViewDefinition
 from openprocurement.api import design
 
+from openregistry.lots.core.models import view_role
+
+LOGGER = getLogger(__name__)
 
-FIELDS = [
+DEFAULT_FIELDS = [
     'status',
     'lotID',
     'lotType'
 ]
 
+FIELDS = list(DEFAULT_FIELDS)
+
 CHANGES_FIELDS = FIELDS + [
     'dateModified',
 ]
 
+# fields which can be served straight from the feed views
+LISTING_FIELDS = set(CHANGES_FIELDS + ['id'])
 
-def add_design():
-    for i, j in globals().items():
-        if "_view" in i:
-            setattr(design, i, j)
-
-
-lots_all_view = ViewDefinition('lot', 'all', '''function(doc) {
-    if(doc.doc_type == 'Lot') {
-        emit(doc.lotID, null);
-    }
-}''')
-
+FEED_DESIGN = 'lots'
 
-lots_by_dateModified_view = ViewDefinition('lots', 'by_dateModified', '''function(doc) {
+FEED_MAP = '''function(doc) {
     if(doc.doc_type == 'Lot' && doc.status != 'draft') {
-        var fields=%s, data={};
+        var fields=%(fields)s, data={};
         for (var i in fields) {
             if (doc[fields[i]]) {
                 data[fields[i]] = doc[fields[i]]
             }
         }
-        emit(doc.dateModified, data);
+        emit([doc.mode || '', doc.%(key)s], data);
     }
-}''' % FIELDS)
+}'''
 
-lots_real_by_dateModified_view = ViewDefinition('lots', 'real_by_dateModified', '''function(doc) {
-    if(doc.doc_type == 'Lot' && doc.status != 'draft' && !doc.mode) {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc.dateModified, data);
-    }
-}''' % FIELDS)
+# views replaced by the composite key ones
+OBSOLETE_VIEWS = [
+    'by_dateModified', 'real_by_dateModified', 'test_by_dateModified',
+    'by_local_seq', 'real_by_local_seq', 'test_by_local_seq',
+]
 
-lots_test_by_dateModified_view = ViewDefinition('lots', 'test_by_dateModified', '''function(doc) {
-    if(doc.doc_type == 'Lot' && doc.status != 'draft' && doc.mode == 'test') {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc.dateModified, data);
-    }
-}''' % FIELDS)
 
-lots_by_local_seq_view = ViewDefinition('lots', 'by_local_seq', '''function(doc) {
-    if(doc.doc_type == 'Lot' && doc.status != 'draft') {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc._local_seq, data);
-    }
-}''' % CHANGES_FIELDS)
+def feed_map(key, fields):
+    return FEED_MAP % {'key': key, 'fields': [str(i) for i in fields]}
 
-lots_real_by_local_seq_view = ViewDefinition('lots', 'real_by_local_seq', '''function(doc) {
-    if(doc.doc_type == 'Lot' && doc.status != 'draft' && !doc.mode) {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc._local_seq, data);
-    }
-}''' % CHANGES_FIELDS)
 
-lots_test_by_local_seq_view = ViewDefinition('lots', 'test_by_local_seq', '''function(doc) {
-    if(doc.doc_type == 'Lot' && doc.status != 'draft' && doc.mode == 'test') {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc._local_seq, data);
+VIEWS_HASH = 'views_hash'
+STAGING_SUFFIX = '_staging'
+
+# feed design documents of any feed fields: lots, lots_<fields hash> and their staging
+FEED_DESIGN_ID = re.compile(r'^_design/{}(_[0-9a-f]{{8}})?({})?$'.format(FEED_DESIGN, STAGING_SUFFIX))
+# fields list of a feed map function
+FEED_MAP_FIELDS = re.compile(r"var fields=(\[[^\]]*\])")
+
+
+def lots_views():
+    return [j for i, j in globals().items() if "_view" in i and isinstance(j, ViewDefinition)]
+
+
+def add_design():
+    for i, j in globals().items():
+        if "_view" in i and isinstance(j, ViewDefinition):
+            setattr(design, i, j)
+
+
+def design_docs(views):
+    """ Group view definitions into design documents stamped with a hash
+    of the views source
+    """
+    docs = {}
+    for view in views:
+        doc = docs.setdefault('_design/' + view.design, {'language': view.language, 'views': {}})
+        funcs = {'map': view.map_fun}
+        if view.reduce_fun:
+            funcs['reduce'] = view.reduce_fun
+        if view.options:
+            funcs['options'] = view.options
+        doc['views'][view.name] = funcs
+    for doc in docs.values():
+        doc[VIEWS_HASH] = sha1(dumps(doc['views'], sort_keys=True)).hexdigest()
+    return docs
+
+
+def build_staging(db, doc_id, doc):
+    """ Build indexes of ``doc`` views under a staging design document
+
+    CouchDB shares indexes between design documents with the same views,
+    so once built the views can be copied to the live document for free.
+    """
+    staging_id = doc_id + STAGING_SUFFIX
+    staging = dict(doc, _id=staging_id)
+    old = db.get(staging_id)
+    if old:
+        staging['_rev'] = old['_rev']
+    db.save(staging)
+    view = sorted(doc['views'])[0]
+    list(db.view('{}/{}'.format(staging_id[len('_design/'):], view), limit=0))
+    return staging
+
+
+def sync_views(db, views):
+    """ Update design documents whose views hash changed
+
+    Changed views of an existing design document are built in a staging
+    document first, so listings keep being served by the old indexes
+    until the new ones are ready.
+    """
+    for doc_id, doc in sorted(design_docs(views).items()):
+        try:
+            live = db.get(doc_id) or {'_id': doc_id}
+            if live.get(VIEWS_HASH) == doc[VIEWS_HASH]:
+                continue
+            staging = None
+            if live.get('views'):
+                LOGGER.info('Building {} views in staging design document'.format(doc_id),
+                            extra={'MESSAGE_ID': 'design_sync_staging'})
+                staging = build_staging(db, doc_id, doc)
+            live.update(doc)
+            db.save(live)
+            if staging is not None:
+                db.delete(staging)
+        except (ResourceConflict, ResourceNotFound):
+            # another worker got there first
+            continue
+        except Exception:
+            LOGGER.exception('Failed to update {} views'.format(doc_id),
+                             extra={'MESSAGE_ID': 'design_sync_error'})
+            remove_staging(db, doc_id)
+            continue
+        LOGGER.info('Updated {} views'.format(doc_id), extra={'MESSAGE_ID': 'design_sync'})
+
+
+def remove_staging(db, doc_id):
+    """ Delete staging design document of ``doc_id`` left by a failed build """
+    try:
+        staging = db.get(doc_id + STAGING_SUFFIX)
+        if staging:
+            db.delete(staging)
+    except Exception, e:
+        LOGGER.warning('Failed to delete {} staging design document: {!r}'.format(doc_id, e),
+                       extra={'MESSAGE_ID': 'design_sync_error'})
+
+
+def feed_design_rows(db, **options):
+    return db.view('_all_docs', startkey='_design/' + FEED_DESIGN,
+                   endkey=u'_design/{}_\ufff0'.format(FEED_DESIGN), **options)
+
+
+def remove_stale_feed_designs(db):
+    """ Delete feed design documents of other feed fields
+
+    CouchDB keeps indexing every design document, so the ones left behind
+    by earlier ``feed_fields`` (and their staging documents) are deleted.
+    """
+    current = '_design/' + lots_by_mode_dateModified_view.design
+    for row in feed_design_rows(db):
+        if not FEED_DESIGN_ID.match(row.id) or row.id in (current, current + STAGING_SUFFIX):
+            continue
+        try:
+            db.delete({'_id': row.id, '_rev': row.value['rev']})
+        except (ResourceConflict, ResourceNotFound):
+            # another worker got there first
+            continue
+        LOGGER.info('Deleted stale feed design document {}'.format(row.id),
+                    extra={'MESSAGE_ID': 'design_stale_deleted'})
+
+
+def previous_feed_design(db):
+    """ Feed design document of other feed fields having the feed views, if any """
+    current = '_design/' + lots_by_mode_dateModified_view.design
+    names = set([lots_by_mode_dateModified_view.name, lots_by_mode_local_seq_view.name])
+    for row in feed_design_rows(db, include_docs=True):
+        if (FEED_DESIGN_ID.match(row.id) and not row.id.endswith(STAGING_SUFFIX) and row.id != current and
+                row.doc and names.issubset(row.doc.get('views', {}))):
+            return row.doc
+
+
+def feed_map_fields(map_fun):
+    """ Fields emitted by ``map_fun`` built by ``feed_map`` """
+    match = FEED_MAP_FIELDS.search(map_fun)
+    if match is None:
+        return DEFAULT_FIELDS + ['dateModified']
+    return [str(i) for i in loads(match.group(1).replace("'", '"'))]
+
+
+def serve_feed_design(doc=None):
+    """ Serve the feed views of ``doc`` design document, the configured ones if None
+
+    LISTING_FIELDS follow the fields emitted by the served views.
+    """
+    fields = CHANGES_FIELDS
+    if doc is not None:
+        name = doc['_id'][len('_design/'):]
+        fields = feed_map_fields(doc['views'][lots_by_mode_local_seq_view.name]['map'])
+    for view_map in FEED.values():
+        for feed_view in view_map.values():
+            feed_view.fallback = None if doc is None else ViewDefinition(
+                name, feed_view.view.name, doc['views'][feed_view.view.name]['map'])
+    LISTING_FIELDS.clear()
+    LISTING_FIELDS.update(fields + ['id'])
+
+
+def build_views(db, views):
+    """ Wait for the indexes of ``views`` design documents to be built """
+    built = set()
+    for view in views:
+        if view.design not in built:
+            # views of a design document share the index
+            list(view(db, limit=0))
+            built.add(view.design)
+
+
+def sync_lots_design(db):
+    """ Background sync of lots views, failures are logged
+
+    When the feed views moved to a design document of other feed fields,
+    the previous design document is served until the new views are built.
+    """
+    try:
+        previous = previous_feed_design(db)
+        if previous is not None:
+            LOGGER.info('Serving {} feed views until {} ones are built'.format(
+                previous['_id'], lots_by_mode_dateModified_view.design),
+                extra={'MESSAGE_ID': 'design_sync_previous_feed'})
+            serve_feed_design(previous)
+        sync_views(db, lots_views())
+        if previous is not None:
+            build_views(db, [lots_by_mode_dateModified_view, lots_by_mode_local_seq_view])
+            serve_feed_design()
+        remove_stale_feed_designs(db)
+    except Exception:
+        LOGGER.exception('Failed to sync lots design documents', extra={'MESSAGE_ID': 'design_sync_error'})
+
+
+def sync_design(event):
+    """ ApplicationCreated subscriber syncing lots views in the background """
+    thread = Thread(target=sync_lots_design, args=(event.app.registry.db, ))
+    thread.daemon = True
+    thread.start()
+
+
+def remove_obsolete_feeds(event):
+    """ ApplicationCreated subscriber dropping the per mode feed views
+    and the feed design documents of other feed fields
+
+    Views left in the design documents would still be indexed.
+    """
+    db = event.app.registry.db
+    remove_stale_feed_designs(db)
+    if lots_by_mode_dateModified_view.design != FEED_DESIGN:
+        return
+    doc = db.get('_design/' + FEED_DESIGN)
+    if doc and set(OBSOLETE_VIEWS) & set(doc.get('views', {})):
+        for name in OBSOLETE_VIEWS:
+            doc['views'].pop(name, None)
+        db.save(doc)
+
+
+class FeedView(object):
+    """ Range of [mode, key] feed view acting as a view keyed by ``key``
+
+    With several modes every mode range is read with the same options and
+    the rows are merged by key. ``stale`` is set by the view warmer while
+    the view index lags behind and overrides ``stale`` of the listing.
+    ``fallback`` view of the previous feed design document is read instead
+    of ``view`` while its index is built (see ``sync_lots_design``).
+    """
+
+    stale = None
+    fallback = None
+
+    def __init__(self, view, modes):
+        self.view = view
+        self.modes = modes
+
+    def __call__(self, db, **options):
+        if len(self.modes) == 1:
+            return self.rows(db, self.modes[0], options)
+        rows = []
+        for mode in self.modes:
+            rows.extend(self.rows(db, mode, options))
+        rows.sort(key=lambda row: (row.key, row.id), reverse=bool(options.get('descending')))
+        if 'limit' in options:
+            rows = rows[:options['limit']]
+        return rows
+
+    def rows(self, db, mode, options):
+        options = dict(options)
+        if self.stale:
+            options['stale'] = self.stale
+        low, high = [mode], [mode, {}]
+        if options.get('descending'):
+            low, high = high, low
+        startkey = options.pop('startkey', None)
+        endkey = options.pop('endkey', None)
+        options['startkey'] = low if startkey is None else [mode, startkey]
+        options['endkey'] = high if endkey is None else [mode, endkey]
+        view = self.fallback or self.view
+        return [Row(row, key=row['key'][1]) for row in view(db, **options)]
+
+
+lots_all_view = ViewDefinition('lot', 'all', '''function(doc) {
+    if(doc.doc_type == 'Lot') {
+        emit(doc.lotID, null);
     }
-}''' % CHANGES_FIELDS)
+}''')
+
+
+lots_by_mode_dateModified_view = ViewDefinition(
+    FEED_DESIGN, 'by_mode_dateModified', feed_map('dateModified', FIELDS))
+
+lots_by_mode_local_seq_view = ViewDefinition(
+    FEED_DESIGN, 'by_mode_local_seq', feed_map('_local_seq', CHANGES_FIELDS))
 
 
 VIEW_MAP = {
-    u'': lots_real_by_dateModified_view,
-    u'test': lots_test_by_dateModified_view,
-    u'_all_': lots_by_dateModified_view,
+    u'': FeedView(lots_by_mode_dateModified_view, [u'']),
+    u'test': FeedView(lots_by_mode_dateModified_view, [u'test']),
+    u'_all_': FeedView(lots_by_mode_dateModified_view, [u'', u'test']),
 }
 CHANGES_VIEW_MAP = {
-    u'': lots_real_by_local_seq_view,
-    u'test': lots_test_by_local_seq_view,
-    u'_all_': lots_by_local_seq_view,
+    u'': FeedView(lots_by_mode_local_seq_view, [u'']),
+    u'test': FeedView(lots_by_mode_local_seq_view, [u'test']),
+    u'_all_': FeedView(lots_by_mode_local_seq_view, [u'', u'test']),
 }
 FEED = {
     u'dateModified': VIEW_MAP,
     u'changes': CHANGES_VIEW_MAP,
 }
+
+
+def configure_fields(fields):
+    """ Extend the fields emitted by the feed views
+
+    The views are rebuilt in place and moved to a design document named
+    after the fields, so deployments with different fields never rebuild
+    each other's indexes.
+    """
+    for field in fields:
+        if view_role(field, None):
+            raise ValueError('Field {} can\'t be emitted by the lots views'.format(field))
+    FIELDS[:] = DEFAULT_FIELDS + [str(i) for i in fields if i not in DEFAULT_FIELDS]
+    CHANGES_FIELDS[:] = FIELDS + [i for i in ['dateModified'] if i not in FIELDS]
+    LISTING_FIELDS.clear()
+    LISTING_FIELDS.update(CHANGES_FIELDS + ['id'])
+
+    design_name = FEED_DESIGN
+    if FIELDS != DEFAULT_FIELDS:
+        design_name = '{}_{}'.format(FEED_DESIGN, sha1(','.join(FIELDS)).hexdigest()[:8])
+    for view, key, view_fields in ((lots_by_mode_dateModified_view, 'dateModified', FIELDS),
+                                   (lots_by_mode_local_seq_view, '_local_seq', CHANGES_FIELDS)):
+        view.design = design_name
+        view.map_fun = feed_map(key, view_fields)
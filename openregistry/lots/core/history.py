@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+
+from couchdb.http import ResourceConflict
+from jsonpatch import apply_patch
+from pyramid.settings import asbool
+
+LOGGER = getLogger(__name__)
+
+REVISION_DOC_TYPE = 'LotRevision'
+SNAPSHOT_DOC_TYPE = 'LotSnapshot'
+MAX_INDEX = 999999
+
+# raw lot document fields which revision patches never touch
+NOT_PATCHED_FIELDS = ('_rev', '_attachments', 'revisions', 'revisionsCount')
+
+
+def revision_doc_id(lot_id, index):
+    return '{}-r{:06}'.format(lot_id, index)
+
+
+def snapshot_doc_id(lot_id, index):
+    return '{}-s{:06}'.format(lot_id, index)
+
+
+def revisions_count(doc):
+    """ Number of revisions of raw lot document
+
+    Lots stored before the counter have all their revisions embedded.
+    """
+    return doc.get('revisionsCount') or len(doc.get('revisions') or [])
+
+
+def indexed_revisions(doc):
+    """ (index, revision) pairs of revisions embedded in raw lot document
+
+    Embedded revisions are the latest ones, the counter is the index of
+    the last of them.
+    """
+    embedded = doc.get('revisions') or []
+    return list(enumerate(embedded, revisions_count(doc) - len(embedded) + 1))
+
+
+def revision_doc(lot_id, index, revision):
+    return {
+        '_id': revision_doc_id(lot_id, index),
+        'doc_type': REVISION_DOC_TYPE,
+        'lot_id': lot_id,
+        'index': index,
+        'revision': revision,
+    }
+
+
+class LotHistory(object):
+    """ Keeps lot revisions in append-only history documents
+
+    Revisions are indexed by the ``revisionsCount`` counter of the lot.
+    The lot document keeps its latest revision embedded, and revisions
+    embedded in a lot are written to history documents right before the
+    next store of the lot, so a revision is never lost or written after
+    a lot store which failed. Every ``snapshot_every`` indices the stored
+    lot state is written as well, to bound the number of patches needed to
+    rebuild past states.
+    """
+
+    def __init__(self, snapshot_every=50):
+        self.snapshot_every = snapshot_every
+
+    def detach(self, doc):
+        """ Strip embedded revisions from raw lot document
+
+        Returns them with their indices, the counter is left in ``doc``.
+        """
+        revisions = indexed_revisions(doc)
+        doc.pop('revisions', None)
+        if revisions:
+            doc['revisionsCount'] = revisions[-1][0]
+        return revisions
+
+    def add(self, lot, revision):
+        """ Embed revision of ``lot`` to be stored, counting it """
+        lot.revisions.append(revision)
+        lot.revisionsCount = (lot.revisionsCount or 0) + 1
+
+    def migrate(self, db, lot):
+        """ Write revisions detached from ``lot``
+
+        Called before the lot is stored without them. Document ids are
+        stable and documents are written from the stored lot only, so
+        revisions written by a concurrent request or a failed store only
+        conflict. Other errors fail the lot store.
+        """
+        detached = getattr(lot, '__detached_revisions__', None)
+        if not detached:
+            return
+        docs = [revision_doc(lot.id, index, revision) for index, revision in detached]
+        for success, doc_id, error in db.update(docs):
+            if not success and not isinstance(error, ResourceConflict):
+                raise error
+        lot.__detached_revisions__ = []
+
+    def commit(self, db, lot):
+        """ Write snapshot of stored ``lot`` every ``snapshot_every`` revisions """
+        index = lot.revisionsCount
+        if not self.snapshot_every or not index or index % self.snapshot_every:
+            return
+        try:
+            db.save({
+                '_id': snapshot_doc_id(lot.id, index),
+                'doc_type': SNAPSHOT_DOC_TYPE,
+                'lot_id': lot.id,
+                'index': index,
+                'data': lot.serialize('plain'),
+            })
+        except Exception, e:
+            # snapshots only speed up rebuilding, the revisions are kept
+            LOGGER.warning('Failed to store snapshot {} of lot {}: {!r}'.format(index, lot.id, e),
+                           extra={'MESSAGE_ID': 'lot_history_error'})
+
+    def revisions(self, db, lot_id, start=1, stop=MAX_INDEX):
+        """ (index, revision) pairs of lot with indices in [start, stop] """
+        rows = db.view('_all_docs', startkey=revision_doc_id(lot_id, start),
+                       endkey=revision_doc_id(lot_id, stop), include_docs=True)
+        return [(row.doc['index'], row.doc['revision']) for row in rows if row.doc]
+
+    def snapshot(self, db, lot_id, index):
+        """ The first snapshot of lot made at ``index`` or later """
+        rows = db.view('_all_docs', startkey=snapshot_doc_id(lot_id, index),
+                       endkey=snapshot_doc_id(lot_id, MAX_INDEX), include_docs=True, limit=1)
+        for row in rows:
+            if row.doc:
+                return row.doc
+
+
+def lot_revisions_range(db, doc, start, stop, history=None):
+    """ {index: revision} of raw lot document with indices in [start, stop] """
+    revisions = dict([(i, j) for i, j in indexed_revisions(doc) if start <= i <= stop])
+    first = min(revisions) if revisions else stop + 1
+    if history is not None and start < first:
+        revisions.update(history.revisions(db, doc['_id'], start=start, stop=first - 1))
+    return revisions
+
+
+def lot_revisions(db, doc, history=None, skip=0, limit=None):
+    """ (index, revision) pairs of raw lot document """
+    stop = revisions_count(doc) if limit is None else min(revisions_count(doc), skip + limit)
+    return sorted(lot_revisions_range(db, doc, skip + 1, stop, history).items())
+
+
+def lot_snapshot(db, doc, index, history=None):
+    """ Lot state as of revision ``index`` rebuilt from the revision patches
+
+    Returns ``None`` if the lot has no such revision, or if any revision
+    between it and the current or snapshot state is missing.
+    """
+    data, stop = doc, revisions_count(doc)
+    if not 0 < index <= stop:
+        return
+    if history is not None:
+        snapshot = history.snapshot(db, doc['_id'], index)
+        if snapshot is not None and snapshot['index'] <= stop:
+            data, stop = snapshot['data'], snapshot['index']
+    revisions = lot_revisions_range(db, doc, index, stop, history)
+    if sorted(revisions) != range(index, stop + 1):
+        LOGGER.warning('Revisions {}-{} of lot {} are incomplete'.format(index, stop, doc['_id']),
+                       extra={'MESSAGE_ID': 'lot_history_gap'})
+        return
+    data = dict([(i, j) for i, j in data.items() if i not in NOT_PATCHED_FIELDS])
+    for i in range(stop, index, -1):
+        # revision changes revert the lot to its previous state
+        data = apply_patch(data, revisions[i]['changes'])
+    return data
+
+
+def lot_history_factory(settings):
+    """ Build lot history storage from ``lot_history`` plugin settings """
+    if not settings or not asbool(settings.get('separate', True)):
+        return
+    return LotHistory(snapshot_every=int(settings.get('snapshot_every', 50)))
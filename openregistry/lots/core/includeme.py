@@ -1,21 +1,40 @@
 # -*- coding: utf-8 -*-
 import logging
+from pyramid.events import ApplicationCreated
 from pyramid.interfaces import IRequest
+from pyramid.settings import asbool
 from openregistry.lots.core.utils import (
     extract_lot, isLot, register_lotType,
-    lot_from_data, SubscribersPicker
+    lot_from_data, lot_internal_type, lot_stage_timings, SubscribersPicker,
+    LotTypeIndex
 )
 from openprocurement.api.app import get_evenly_plugins
 from openprocurement.api.interfaces import IContentConfigurator
 from openregistry.lots.core.adapters import LotConfigurator
+from openregistry.lots.core.database import install_lots_session, lots_session_factory
+from openregistry.lots.core.cache import (
+    lot_cache_factory, serialization_cache_factory, start_changes_follower
+)
+from openregistry.lots.core.history import lot_history_factory
+from openregistry.lots.core.lot_id import lot_id_sequence_factory
+from openregistry.lots.core.metrics import Metrics
+from openregistry.lots.core.profiling import lots_profiler_factory
 from openregistry.lots.core.models import ILot
+from openregistry.lots.core.warmer import start_view_warmer, view_warmer_factory
 
 LOGGER = logging.getLogger(__name__)
 
 
 def includeme(config, plugin_map):
-    from openregistry.lots.core.design import add_design
-    add_design()
+    from openregistry.lots.core.design import (
+        add_design, configure_fields, remove_obsolete_feeds, sync_design
+    )
+    configure_fields(plugin_map.get('feed_fields') or [])
+    if plugin_map.get('design_sync') == 'staged':
+        config.add_subscriber(sync_design, ApplicationCreated)
+    else:
+        add_design()
+        config.add_subscriber(remove_obsolete_feeds, ApplicationCreated)
     config.add_request_method(extract_lot, 'lot', reify=True)
 
     # lotType plugins support
@@ -23,6 +42,8 @@ def includeme(config, plugin_map):
     config.add_route_predicate('_internal_type', isLot)
     config.add_subscriber_predicate('_internal_type', SubscribersPicker)
     config.add_request_method(lot_from_data)
+    config.add_request_method(lot_internal_type, reify=True)
+    config.add_request_method(lot_stage_timings, reify=True)
     config.add_directive('add_lotType',
                          register_lotType)
     config.scan("openregistry.lots.core.views")
@@ -31,6 +52,48 @@ def includeme(config, plugin_map):
                                     IContentConfigurator)
 
     config.registry.lot_type_configurator = {}
+    config.registry.lot_type_index = LotTypeIndex({}, {})
+
+    # database session, installed before the subscribers reading the database
+    config.registry.lot_metrics = Metrics()
+    config.registry.lots_db_session = lots_session_factory(plugin_map.get('db_session') or {},
+                                                           config.registry.lot_metrics)
+    if config.registry.lots_db_session is not None:
+        config.add_subscriber(install_lots_session, ApplicationCreated)
+
+    # lotID generation
+    config.registry.lot_id_sequence = lot_id_sequence_factory(plugin_map.get('lot_id') or {},
+                                                              config.registry.lot_metrics)
+
+    # lot documents cache
+    cache_settings = plugin_map.get('lot_cache') or {}
+    config.registry.lot_doc_cache = lot_cache_factory(cache_settings)
+    if config.registry.lot_doc_cache is not None and asbool(cache_settings.get('changes_feed', True)):
+        config.add_subscriber(start_changes_follower, ApplicationCreated)
+    config.registry.lot_serialization_cache = serialization_cache_factory(
+        plugin_map.get('serialization_cache') or {}, config.registry.lot_metrics
+    )
+
+    # revision patches of the changed fields only
+    config.registry.lot_change_tracking = asbool(plugin_map.get('change_tracking'))
+
+    # lot revisions history
+    config.registry.lot_history = lot_history_factory(plugin_map.get('lot_history') or {})
+
+    # feed views warming
+    config.registry.view_warmer = view_warmer_factory(plugin_map.get('view_warmer') or {},
+                                                      config.registry.lot_metrics)
+    if config.registry.view_warmer is not None:
+        config.add_subscriber(start_view_warmer, ApplicationCreated)
+
+    # streamed listings
+    stream_settings = plugin_map.get('stream_listing') or {}
+    config.registry.listing_stream_batch = int(stream_settings.get('batch_size', 100)) if stream_settings else None
+
+    # on-demand requests profiling
+    config.registry.lots_profiler = lots_profiler_factory(plugin_map.get('profiling') or {})
+    if config.registry.lots_profiler is not None:
+        config.add_tween('openregistry.lots.core.profiling.profiling_tween_factory')
 
     LOGGER.info("Included openprocurement.lots.core plugin", extra={'MESSAGE_ID': 'included_plugin'})
 
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+
+from simplejson import dumps
+from pyramid.response import Response
+
+from openprocurement.api.utils import decrypt, encrypt, error_handler
+
+
+def iter_view_rows(view, startkey, limit, batch_size):
+    """ Read up to ``limit`` rows of ``view`` in batches of ``batch_size``
+
+    Batches continue from the key and id of the last read row, so only one
+    batch is held in memory at a time.
+    """
+    docid = None
+    while limit > 0:
+        size = min(batch_size, limit)
+        options = {'startkey_docid': docid} if docid else {}
+        rows = view(limit=size + bool(docid), startkey=startkey, **options)
+        read = 0
+        for row in rows:
+            if docid and row.id == docid and row.key == startkey:
+                continue
+            if read == size:
+                break
+            read += 1
+            last = row
+            yield row
+        if read < size:
+            return
+        limit -= read
+        startkey, docid = last.key, last.id
+
+
+class ListingStream(object):
+    """ Listing of ``APIResourceListing`` rendered incrementally
+
+    Accepts the same query parameters as the listing of
+    ``openprocurement.api`` and produces the same document.
+    """
+
+    def __init__(self, resource, batch_size=100):
+        self.resource = resource
+        self.request = resource.request
+        self.batch_size = batch_size
+        self.params = {}
+        self.pparams = {}
+        self.parse()
+
+    def parse(self):
+        request, resource = self.request, self.resource
+        fields = request.params.get('opt_fields', '')
+        if fields:
+            self.params['opt_fields'] = self.pparams['opt_fields'] = fields
+            fields = fields.split(',')
+        self.fields = fields
+        self.view_fields = fields + ['dateModified', 'id'] if fields else None
+        limit = request.params.get('limit', '')
+        if limit:
+            self.params['limit'] = self.pparams['limit'] = limit
+        self.limit = int(limit) if limit.isdigit() and (100 if fields else 1000) >= int(limit) > 0 else 100
+        self.descending = bool(request.params.get('descending'))
+        if self.descending:
+            self.params['descending'] = 1
+        else:
+            self.pparams['descending'] = 1
+        feed = request.params.get('feed', '')
+        view_map = resource.FEED.get(feed, resource.VIEW_MAP)
+        self.changes = view_map is resource.CHANGES_VIEW_MAP
+        if feed and feed in resource.FEED:
+            self.params['feed'] = self.pparams['feed'] = feed
+        mode = request.params.get('mode', '')
+        if mode and mode in view_map:
+            self.params['mode'] = self.pparams['mode'] = mode
+        self.offset = request.params.get('offset', '')
+        if self.changes and self.offset:
+            view_offset = decrypt(resource.server.uuid, resource.db.name, self.offset)
+            if not view_offset or not view_offset.isdigit():
+                request.errors.add('params', 'offset', 'Offset expired/invalid')
+                request.errors.status = 404
+                raise error_handler(request.errors)
+            self.view_offset = int(view_offset)
+        elif self.changes:
+            self.view_offset = 'now' if self.descending else 0
+        else:
+            self.view_offset = self.offset or ('9' if self.descending else '')
+        options = {'descending': self.descending}
+        if resource.update_after:
+            options['stale'] = 'update_after'
+        self.view = partial(view_map.get(mode, view_map[u'']), resource.db, **options)
+
+    def serialize(self, row):
+        fields = self.fields
+        if not fields:
+            return {'id': row.id, 'dateModified': row.value['dateModified'] if self.changes else row.key}
+        if set(fields).issubset(set(self.resource.FIELDS)):
+            extra = [('id', row.id)] if self.changes else [('id', row.id), ('dateModified', row.key)]
+            return dict([(i, j) for i, j in row.value.items() + extra if i in self.view_fields])
+        return self.resource.serialize_func(self.request, row['doc'], self.view_fields)
+
+    def rows(self):
+        view = self.view
+        if self.fields and not set(self.fields).issubset(set(self.resource.FIELDS)):
+            view = partial(view, include_docs=True)
+        limit = self.limit + 1 if self.offset else self.limit
+        rows = iter_view_rows(view, self.view_offset, limit, self.batch_size)
+        for index, row in enumerate(rows):
+            if index == 0 and self.offset and row.key == self.view_offset:
+                # the last row of the previous page
+                continue
+            if index == self.limit:
+                return
+            yield row
+
+    def page(self, params, offset):
+        if self.changes and offset != self.offset:
+            offset = encrypt(self.resource.server.uuid, self.resource.db.name, offset)
+        params = dict(params, offset=offset)
+        name = self.resource.object_name_for_listing
+        return {
+            'offset': offset,
+            'path': self.request.route_path(name, _query=params),
+            'uri': self.request.route_url(name, _query=params),
+        }
+
+    def __iter__(self):
+        yield '{"data": ['
+        first = last = None
+        for row in self.rows():
+            if first is None:
+                first = row.key
+            else:
+                yield ', '
+            last = row.key
+            yield dumps(self.serialize(row))
+        next_offset = self.offset if last is None else last
+        prev_offset = self.offset if self.offset or first is None else first
+        yield '], "next_page": ' + dumps(self.page(self.params, next_offset))
+        if self.descending or self.offset:
+            yield ', "prev_page": ' + dumps(self.page(self.pparams, prev_offset))
+        yield '}'
+
+    def response(self):
+        return Response(content_type='application/json', charset='utf-8', app_iter=self)
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+import atexit
+from logging import getLogger
+from os import getpid
+from random import uniform
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from couchdb.http import ResourceConflict
+from pyramid.exceptions import ConfigurationError
+
+try:
+    from gevent import sleep
+except ImportError:  # pragma: no cover
+    from time import sleep
+
+LOGGER = getLogger(__name__)
+
+LOT_ID_TEMPLATE = 'UA-LR-DGF-{:04}-{:02}-{:02}-{:06}{}'
+DEFAULT_BLOCK_SIZE = 50
+DEFAULT_WORKER_BITS = 4
+DEFAULT_MAX_INDEX = 999999
+# indices of the day from it up are issued by snowflake sequences only
+SNOWFLAKE_MIN_INDEX = 500000
+# ticks reserved by a snowflake high-water mark write
+SNOWFLAKE_MARK_AHEAD = 64
+# seconds a snowflake worker id stays leased without renewal
+DEFAULT_LEASE_TTL = 600
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class LotIDGenerationError(Exception):
+    """ The lotID counter could not be updated within the retry policy limits. """
+
+
+class RetryPolicy(object):
+    """ Jittered exponential backoff bounded by attempts count and deadline
+
+    Sleeps are cooperative when gevent is available. Totals of calls,
+    conflicts, errors, retries and failures over all calls are kept in
+    ``stats`` and counted by ``lot_id_counter_<name>_total`` counters of
+    ``metrics``.
+    """
+
+    def __init__(self, max_attempts=10, deadline=10.0, base_delay=0.05, max_delay=2.0, jitter=0.5,
+                 metrics=None):
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.stats = {'calls': 0, 'conflicts': 0, 'errors': 0, 'retries': 0, 'failures': 0}
+        self.metrics = metrics
+
+    @classmethod
+    def from_settings(cls, settings, metrics=None):
+        return cls(
+            max_attempts=int(settings.get('max_attempts', 10)),
+            deadline=float(settings.get('deadline', 10.0)),
+            base_delay=float(settings.get('base_delay', 0.05)),
+            max_delay=float(settings.get('max_delay', 2.0)),
+            jitter=float(settings.get('jitter', 0.5)),
+            metrics=metrics,
+        )
+
+    def count(self, name, amount=1):
+        self.stats[name] += amount
+        if self.metrics is not None and amount:
+            self.metrics.counter('lot_id_counter_{}_total'.format(name)).inc(amount)
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return uniform(delay * (1 - self.jitter), delay)
+
+    def sleep(self, attempt):
+        sleep(self.delay(attempt))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def get_lot_id_doc(server_id=''):
+    return 'lotID_' + server_id if server_id else 'lotID'
+
+
+def format_lot_id(ctime, index, server_id=''):
+    return LOT_ID_TEMPLATE.format(
+        ctime.year,
+        ctime.month,
+        ctime.day,
+        index,
+        server_id and '-' + server_id
+    )
+
+
+def update_counter_doc(db, lotIDdoc, update, retry_policy=None):
+    """ Read-modify-write loop over the lotID counter document.
+
+    ``update`` is called with a fresh copy of the document on every attempt
+    and its return value is returned once the document is saved. Conflicts
+    and errors are retried according to ``retry_policy``,
+    LotIDGenerationError is raised when it gives up.
+    """
+    policy = retry_policy or DEFAULT_RETRY_POLICY
+    stats = {'conflicts': 0, 'errors': 0, 'retries': 0}
+    deadline = time() + policy.deadline
+    attempt = 0
+    policy.count('calls')
+    while True:
+        attempt += 1
+        try:
+            lotID = db.get(lotIDdoc, {'_id': lotIDdoc})
+            result = update(lotID)
+            db.save(lotID)
+        except ResourceConflict, e:
+            stats['conflicts'] += 1
+            error = e
+        except LotIDGenerationError:
+            _account(policy, stats)
+            raise
+        except Exception, e:
+            stats['errors'] += 1
+            error = e
+        else:
+            break
+        if attempt >= policy.max_attempts or time() >= deadline:
+            policy.count('failures')
+            _account(policy, stats)
+            LOGGER.error('Failed to update {} after {} attempts: {!r}'.format(lotIDdoc, attempt, error),
+                         extra=dict({'MESSAGE_ID': 'lot_id_counter_failed'}, **stats))
+            raise LotIDGenerationError('Unable to generate lotID, try again later')
+        stats['retries'] += 1
+        policy.sleep(attempt)
+    _account(policy, stats)
+    if stats['retries']:
+        LOGGER.info('Updated {} after {} retries'.format(lotIDdoc, stats['retries']),
+                    extra=dict({'MESSAGE_ID': 'lot_id_counter_retries'}, **stats))
+    return result
+
+
+def _account(policy, stats):
+    for name, value in stats.items():
+        policy.count(name, value)
+
+
+def reserve_lot_index(db, lotIDdoc, key, count=1, retry_policy=None):
+    """ Reserve ``count`` consecutive indices for ``key`` and return the first one.
+
+    Indices of snowflake sequences are never reserved, LotIDGenerationError
+    is raised when the counter reaches them.
+    """
+    def reserve(lotID):
+        index = lotID.get(key, 1)
+        if index + count > SNOWFLAKE_MIN_INDEX:
+            raise LotIDGenerationError('lotID counter of the day is exhausted')
+        lotID[key] = index + count
+        return index
+    return update_counter_doc(db, lotIDdoc, reserve, retry_policy)
+
+
+def release_lot_indices(db, lotIDdoc, key, start, stop, retry_policy=None):
+    """ Give back the unused indices [start, stop) of ``key``.
+
+    If nobody reserved anything after the block the counter is rolled back,
+    otherwise the block is recorded in the ``gaps`` of the counter document.
+    """
+    def release(lotID):
+        if lotID.get(key) == stop:
+            lotID[key] = start
+        else:
+            lotID.setdefault('gaps', {}).setdefault(key, []).append([start, stop])
+    return update_counter_doc(db, lotIDdoc, release, retry_policy)
+
+
+class CounterLotIDSequence(object):
+    """ Default lotID index sequence, one counter document write per lotID """
+
+    def __init__(self, retry_policy=None):
+        self.retry_policy = retry_policy
+
+    def next_index(self, db, lotIDdoc, ctime):
+        return reserve_lot_index(db, lotIDdoc, ctime.date().isoformat(), retry_policy=self.retry_policy)
+
+    def next_indices(self, db, lotIDdoc, ctime, count):
+        start = reserve_lot_index(db, lotIDdoc, ctime.date().isoformat(), count, self.retry_policy)
+        return range(start, start + count)
+
+
+class BlockLotIDSequence(object):
+    """ lotID index sequence which reserves blocks of indices
+
+    Every ``block_size`` indices cost one write of the counter document,
+    the rest are handed out locally. Blocks left from previous days and
+    blocks still held on shutdown are released.
+    """
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE, retry_policy=None):
+        self.block_size = block_size
+        self.retry_policy = retry_policy
+        self.blocks = {}
+        self.lock = Lock()
+        self.db = None
+
+    def next_index(self, db, lotIDdoc, ctime):
+        key = ctime.date().isoformat()
+        with self.lock:
+            self.db = db
+            block = self.blocks.get((lotIDdoc, key))
+            if block is None or block[0] >= block[1]:
+                self._release_other_days(db, lotIDdoc, key)
+                start = reserve_lot_index(db, lotIDdoc, key, self.block_size, self.retry_policy)
+                block = self.blocks[(lotIDdoc, key)] = [start, start + self.block_size]
+            index = block[0]
+            block[0] += 1
+        return index
+
+    def next_indices(self, db, lotIDdoc, ctime, count):
+        return [self.next_index(db, lotIDdoc, ctime) for _ in range(count)]
+
+    def _release_other_days(self, db, lotIDdoc, key):
+        for doc_id, day in self.blocks.keys():
+            if doc_id == lotIDdoc and day != key:
+                self._release_block(db, doc_id, day)
+
+    def _release_block(self, db, lotIDdoc, key):
+        start, stop = self.blocks.pop((lotIDdoc, key))
+        if start < stop:
+            try:
+                release_lot_indices(db, lotIDdoc, key, start, stop, self.retry_policy)
+            except LotIDGenerationError:
+                return
+            LOGGER.info('Released lotID indices {}-{} of {} ({})'.format(start, stop - 1, key, lotIDdoc),
+                        extra={'MESSAGE_ID': 'lot_id_block_release'})
+
+    def release(self, db=None):
+        db = db or self.db
+        if db is None:
+            return
+        with self.lock:
+            for lotIDdoc, key in self.blocks.keys():
+                self._release_block(db, lotIDdoc, key)
+
+
+class SnowflakeLotIDSequence(object):
+    """ Coordination-free lotID index sequence
+
+    The index of the day is composed of a time-ordered tick and the worker
+    id in the lowest ``worker_bits`` bits, offset by SNOWFLAKE_MIN_INDEX so
+    it never collides with counter indices. Workers with distinct ids never
+    collide and the counter document is never touched. The day is split
+    into as many ticks as fit up to ``max_index``; more than one lotID per
+    tick borrows the following ticks.
+
+    Every process claims a free worker id on its first lotID by saving a
+    lease into the ``<lotIDdoc>_snowflake_<worker id>`` document, the lease
+    is renewed while the process issues lotIDs and released on shutdown.
+    Borrowed ticks are recorded as a high-water mark in the same document,
+    so the next owner of the worker id doesn't issue them again.
+    """
+
+    def __init__(self, worker_bits=DEFAULT_WORKER_BITS, max_index=DEFAULT_MAX_INDEX,
+                 retry_policy=None, lease_ttl=DEFAULT_LEASE_TTL):
+        if max_index > DEFAULT_MAX_INDEX:
+            raise ValueError('max_index should not exceed {}'.format(DEFAULT_MAX_INDEX))
+        self.worker_bits = worker_bits
+        self.ticks = (max_index + 1 - SNOWFLAKE_MIN_INDEX) >> worker_bits
+        if self.ticks < 2:
+            raise ValueError('max_index should leave room for snowflake indices over {}'.format(SNOWFLAKE_MIN_INDEX))
+        self.retry_policy = retry_policy
+        self.lease_ttl = lease_ttl
+        self.lock = Lock()
+        self.slots = {}
+        self.db = None
+
+    def mark_doc(self, lotIDdoc, worker_id):
+        return '{}_snowflake_{}'.format(lotIDdoc, worker_id)
+
+    def claim(self, db, lotIDdoc, now):
+        """ Lease the first worker id nobody holds, create-only or over an expired lease """
+        owner = uuid4().hex
+        for worker_id in range(2 ** self.worker_bits):
+            doc_id = self.mark_doc(lotIDdoc, worker_id)
+            try:
+                doc = db.get(doc_id, {'_id': doc_id})
+                if doc.get('lease', {}).get('expires', 0) > now:
+                    continue
+                doc['lease'] = {'owner': owner, 'pid': getpid(), 'expires': now + self.lease_ttl}
+                db.save(doc)
+            except ResourceConflict:
+                continue
+            except Exception, e:
+                raise LotIDGenerationError('Unable to claim snowflake worker id: {!r}'.format(e))
+            LOGGER.info('Claimed snowflake worker id {} of {}'.format(worker_id, lotIDdoc),
+                        extra={'MESSAGE_ID': 'lot_id_worker_claimed'})
+            return {'worker_id': worker_id, 'owner': owner, 'expires': now + self.lease_ttl,
+                    'day': None, 'last_tick': 0, 'mark': 0}
+        raise ConfigurationError('All {} snowflake worker ids of {} are taken, '
+                                 'raise lot_id.worker_bits'.format(2 ** self.worker_bits, lotIDdoc))
+
+    def renew(self, db, lotIDdoc, slot, now):
+        """ Extend the lease of ``slot``, False if another process took it over """
+        doc_id = self.mark_doc(lotIDdoc, slot['worker_id'])
+        try:
+            doc = db.get(doc_id, {'_id': doc_id})
+            if doc.get('lease', {}).get('owner') != slot['owner']:
+                return False
+            doc['lease']['expires'] = now + self.lease_ttl
+            db.save(doc)
+        except ResourceConflict:
+            return False
+        except Exception, e:
+            if now < slot['expires']:
+                LOGGER.warning('Failed to renew lease of {}: {!r}'.format(doc_id, e),
+                               extra={'MESSAGE_ID': 'lot_id_lease_renew_failed'})
+                return True
+            raise LotIDGenerationError('Unable to renew snowflake worker id lease: {!r}'.format(e))
+        slot['expires'] = now + self.lease_ttl
+        return True
+
+    def lease(self, db, lotIDdoc):
+        now = time()
+        slot = self.slots.get(lotIDdoc)
+        if slot is not None and now < slot['expires'] - self.lease_ttl / 2.0:
+            return slot
+        if slot is not None:
+            if self.renew(db, lotIDdoc, slot, now):
+                return slot
+            LOGGER.warning('Lost lease of snowflake worker id {} of {}'.format(slot['worker_id'], lotIDdoc),
+                           extra={'MESSAGE_ID': 'lot_id_lease_lost'})
+        slot = self.slots[lotIDdoc] = self.claim(db, lotIDdoc, now)
+        return slot
+
+    def load_mark(self, db, lotIDdoc, slot, key):
+        try:
+            return db.get(self.mark_doc(lotIDdoc, slot['worker_id']), {}).get(key, 0)
+        except Exception, e:
+            raise LotIDGenerationError('Unable to read lotID high-water mark: {!r}'.format(e))
+
+    def save_mark(self, db, lotIDdoc, slot, key, mark):
+        doc_id = self.mark_doc(lotIDdoc, slot['worker_id'])
+
+        def update(doc):
+            if doc.get('lease', {}).get('owner') != slot['owner']:
+                raise LotIDGenerationError('Lease of {} is lost'.format(doc_id))
+            # marks of the past days are not needed any more
+            for day in [i for i in doc if not i.startswith('_') and i not in (key, 'lease')]:
+                del doc[day]
+            doc[key] = max(doc.get(key, 0), mark)
+        update_counter_doc(db, doc_id, update, self.retry_policy)
+
+    def next_index(self, db, lotIDdoc, ctime):
+        midnight = ctime.replace(hour=0, minute=0, second=0, microsecond=0)
+        seconds = (ctime - midnight).total_seconds()
+        tick = 1 + int(seconds * (self.ticks - 1) / SECONDS_PER_DAY)
+        key = midnight.date().isoformat()
+        with self.lock:
+            self.db = db
+            slot = self.lease(db, lotIDdoc)
+            if slot['day'] != key:
+                # ticks up to the current one could be issued by the previous owner
+                slot['mark'] = self.load_mark(db, lotIDdoc, slot, key)
+                slot['last_tick'] = max(slot['mark'], tick if slot['day'] is None else 0)
+                slot['day'] = key
+            index_tick = max(tick, slot['last_tick'] + 1)
+            if index_tick >= self.ticks:
+                raise LotIDGenerationError('lotID sequence of the day is exhausted')
+            if index_tick > tick and index_tick > slot['mark']:
+                mark = min(index_tick + SNOWFLAKE_MARK_AHEAD, self.ticks)
+                try:
+                    self.save_mark(db, lotIDdoc, slot, key, mark)
+                except LotIDGenerationError:
+                    # the lease is renewed or claimed again by the next lotID
+                    slot['expires'] = 0
+                    raise
+                slot['mark'] = mark
+            slot['last_tick'] = index_tick
+        return SNOWFLAKE_MIN_INDEX + (index_tick << self.worker_bits | slot['worker_id'])
+
+    def next_indices(self, db, lotIDdoc, ctime, count):
+        return [self.next_index(db, lotIDdoc, ctime) for _ in range(count)]
+
+    def release(self, db=None):
+        db = db or self.db
+        if db is None:
+            return
+        with self.lock:
+            for lotIDdoc, slot in self.slots.items():
+                doc_id = self.mark_doc(lotIDdoc, slot['worker_id'])
+                try:
+                    doc = db.get(doc_id, {})
+                    if doc.get('lease', {}).get('owner') == slot['owner']:
+                        del doc['lease']
+                        db.save(doc)
+                except Exception, e:
+                    LOGGER.warning('Failed to release lease of {}: {!r}'.format(doc_id, e),
+                                   extra={'MESSAGE_ID': 'lot_id_lease_release_failed'})
+                else:
+                    LOGGER.info('Released snowflake worker id {} of {}'.format(slot['worker_id'], lotIDdoc),
+                                extra={'MESSAGE_ID': 'lot_id_worker_released'})
+            self.slots = {}
+
+
+def lot_id_sequence_factory(settings, metrics=None):
+    """ Build lotID index sequence from ``lot_id`` plugin settings """
+    mode = settings.get('mode', 'counter')
+    retry_policy = RetryPolicy.from_settings(settings.get('retry') or {}, metrics)
+    if mode == 'counter':
+        return CounterLotIDSequence(retry_policy)
+    if mode == 'block':
+        sequence = BlockLotIDSequence(int(settings.get('block_size', DEFAULT_BLOCK_SIZE)), retry_policy)
+        atexit.register(sequence.release)
+        return sequence
+    if mode == 'snowflake':
+        sequence = SnowflakeLotIDSequence(
+            int(settings.get('worker_bits', DEFAULT_WORKER_BITS)),
+            int(settings.get('max_index', DEFAULT_MAX_INDEX)),
+            retry_policy,
+            float(settings.get('lease_ttl', DEFAULT_LEASE_TTL)),
+        )
+        atexit.register(sequence.release)
+        return sequence
+    raise ValueError('Unknown lotID generation mode: {}'.format(mode))
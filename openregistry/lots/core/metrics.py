@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+    """ Monotonic counter """
+
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Gauge(object):
+    """ Value which is set to the last measurement """
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(object):
+    """ Histogram of observed values counted in buckets by upper bound """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """ ``(upper bound, number of values up to it)`` pairs, the last bound is ``'+Inf'`` """
+        with self.lock:
+            counts = list(self.counts)
+        total, result = 0, []
+        for bound, count in zip(self.buckets + ('+Inf', ), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(object):
+    """ Metrics of lots core by name and labels """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = Lock()
+
+    def metric(self, factory, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(key, factory())
+        return metric
+
+    def counter(self, name, **labels):
+        return self.metric(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self.metric(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self.metric(Histogram, name, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Observe the time spent in the block by ``name`` histogram """
+        start = time()
+        try:
+            yield
+        finally:
+            self.histogram(name, **labels).observe(time() - start)
+
+    def collect(self):
+        """ ``(name, labels, metric)`` of all metrics sorted by name and labels """
+        return [(name, dict(labels), metric) for (name, labels), metric in sorted(self.metrics.items())]
+
+
+def escape_label(value):
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def series(name, labels):
+    """ Prometheus series of ``name`` with ``labels`` """
+    if not labels:
+        return name
+    return u'{}{{{}}}'.format(name, u','.join([
+        u'{}="{}"'.format(label, escape_label(value)) for label, value in sorted(labels.items())
+    ]))
+
+
+METRIC_TYPES = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}
+
+
+def render_prometheus(metrics):
+    """ ``metrics`` in Prometheus text exposition format """
+    lines, typed = [], set()
+    for name, labels, metric in metrics.collect():
+        kind = METRIC_TYPES[type(metric)]
+        if name not in typed:
+            typed.add(name)
+            lines.append(u'# TYPE {} {}'.format(name, kind))
+        if kind != 'histogram':
+            lines.append(u'{} {}'.format(series(name, labels), metric.value))
+            continue
+        for bound, count in metric.cumulative():
+            lines.append(u'{} {}'.format(series(name + '_bucket', dict(labels, le=bound)), count))
+        lines.append(u'{} {!r}'.format(series(name + '_sum', labels), metric.sum))
+        lines.append(u'{} {}'.format(series(name + '_count', labels), metric.count))
+    return u'\n'.join(lines) + u'\n'
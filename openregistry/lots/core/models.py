@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from itertools import chain
+
 from pyramid.security import Allow
 from schematics.exceptions import ValidationError
-from schematics.transforms import whitelist, blacklist
-from schematics.types import StringType, MD5Type
+from schematics.models import Model as SchematicsModel
+from schematics.transforms import whitelist, blacklist, wholelist, allow_none, sort_dict, Role
+from schematics.types import IntType, StringType, MD5Type
 from schematics.types.compound import ModelType, ListType
 from zope.interface import implementer
 
@@ -52,17 +56,154 @@ from .constants import LOT_STATUSES
 
 lots_embedded_role = sensitive_embedded_role
 
-create_role = (blacklist('owner', '_attachments', 'revisions',
+create_role = (blacklist('owner', '_attachments', 'revisions', 'revisionsCount',
                          'date', 'dateModified', 'lotID', 'documents',
                          'status', 'doc_id') + lots_embedded_role)
 edit_role = (blacklist('owner', '_attachments',
-                       'revisions', 'date', 'dateModified', 'documents',
+                       'revisions', 'revisionsCount', 'date', 'dateModified', 'documents',
                        'lotID', 'mode', 'doc_id') + lots_embedded_role)
-view_role = (blacklist('_attachments', 'revisions') + lots_embedded_role)
+view_role = (blacklist('_attachments', 'revisions', 'revisionsCount') + lots_embedded_role)
 
 Administrator_role = whitelist('status', 'mode')
 
 
+def to_primitive(field, value):
+    return field.to_primitive(value)
+
+
+class TrackedData(dict):
+    """ Model data recording the fields which may change
+
+    ``touch`` is called once per field before the field is assigned or,
+    for values which can be changed in place (lists and models), read.
+    Reads are not recorded while ``paused``.
+    """
+
+    def __init__(self, data, touch):
+        super(TrackedData, self).__init__(data)
+        self.touch = touch
+        self.touched = set()
+        self.paused = False
+
+    def track(self, key):
+        if key not in self.touched:
+            self.touched.add(key)
+            self.touch(key)
+
+    def track_read(self, key, value):
+        if not self.paused and isinstance(value, (list, dict, SchematicsModel)):
+            self.track(key)
+        return value
+
+    def __getitem__(self, key):
+        return self.track_read(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        return self.track_read(key, dict.get(self, key, default))
+
+    def __setitem__(self, key, value):
+        self.track(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.track(key)
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        data = dict(*args, **kwargs)
+        for key in data:
+            self.track(key)
+        dict.update(self, data)
+
+
+class LazyListType(ListType):
+    """ ListType of models kept raw in lots until the list is used
+
+    Lots store the raw items of these fields in a ``LazyModelList``, so
+    conversion errors of the items are raised on their first use.
+    """
+
+
+class LazyModelList(list):
+    """ List of raw model items converted on first access of the items
+
+    The length is known without conversion. Converted models get the
+    parent model of the list, like the ones converted with the parent.
+    """
+
+    def __init__(self, field, items, parent=None):
+        super(LazyModelList, self).__init__(items)
+        self.field = field
+        self.parent = parent
+        self.hydrated = False
+
+    def hydrate(self):
+        if self.hydrated:
+            return
+        self.hydrated = True
+        models = [self.field.field.to_native(item) for item in list.__iter__(self)]
+        for model in models:
+            if hasattr(model, '__parent__') and model.__parent__ is None:
+                model.__parent__ = self.parent
+        list.__setitem__(self, slice(None), models)
+
+
+def hydrating(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        for i in (self, ) + args:
+            if isinstance(i, LazyModelList):
+                i.hydrate()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for name in ('__getitem__', '__getslice__', '__iter__', '__reversed__', '__contains__',
+             '__setitem__', '__setslice__', '__delitem__', '__delslice__', '__add__',
+             '__iadd__', '__mul__', '__imul__', '__rmul__', '__eq__', '__ne__', '__lt__',
+             '__le__', '__gt__', '__ge__', '__repr__', '__reduce_ex__', 'append', 'extend',
+             'insert', 'pop', 'remove', 'index', 'count', 'sort', 'reverse'):
+    setattr(LazyModelList, name, hydrating(name))
+del name
+
+
+# role filters which depend on the field name only
+STATIC_ROLE_FILTERS = (Role.wholelist, Role.whitelist, Role.blacklist)
+
+
+def compile_role(cls, role):
+    """ Serializer of ``cls`` instances with ``role``
+
+    Role filter is applied to the fields once, the serializer loops over
+    the fields left. Returns ``None`` for roles filtering by field values.
+    Embedded models are serialized as usual.
+    """
+    gottago = cls._options.roles[role]
+    if getattr(gottago, 'function', None) not in STATIC_ROLE_FILTERS:
+        return
+    fields = [
+        (name, field, field.serialized_name or name, hasattr(field, 'export_loop'), allow_none(cls, field))
+        for name, field in chain(cls._fields.items(), cls._serializables.items())
+        if not gottago(name, None)
+    ]
+    fields_order = getattr(cls._options, 'fields_order', None)
+
+    def serialize(instance):
+        data = {}
+        for name, field, key, compound, print_none in fields:
+            value = instance[name]
+            if value is not None:
+                value = field.export_loop(value, to_primitive, role=role) if compound else to_primitive(field, value)
+            if value is not None or print_none:
+                data[key] = value
+        if data:
+            return sort_dict(data, fields_order) if fields_order else data
+    serialize.fields = [i[0] for i in fields]
+    return serialize
+
+
 class ILot(IORContent):
     """ Base lot marker interface """
 
@@ -137,11 +278,30 @@ class BaseLot(BaseResourceItem):
     description_en = StringType()
     description_ru = StringType()
     lotCustodian = ModelType(Organization, required=True)
-    documents = ListType(ModelType(Document), default=list())  # All documents and attachments related to the lot.
+    documents = LazyListType(ModelType(Document), default=list())  # All documents and attachments related to the lot.
+    # index of the last revision, set when revisions are kept in lot history documents
+    revisionsCount = IntType(min_value=0)
 
     create_accreditation = 1
     edit_accreditation = 2
     _internal_type = None
+    # lot types which serializations depend on nothing but the stored
+    # document (no current time or request in serializables) set it to
+    # True to have them cached by the serialization cache
+    cacheable_serialization = False
+
+    def __init__(self, raw_data=None, *args, **kwargs):
+        lazy = {}
+        if isinstance(raw_data, dict):
+            lazy = dict([
+                (name, raw_data[name]) for name, field in self._fields.items()
+                if isinstance(field, LazyListType) and isinstance(raw_data.get(name), list)
+            ])
+        if lazy:
+            raw_data = dict([(i, j) for i, j in raw_data.items() if i not in lazy])
+        super(BaseLot, self).__init__(raw_data, *args, **kwargs)
+        for name, items in lazy.items():
+            self._data[name] = LazyModelList(self._fields[name], items, parent=self)
 
     def __local_roles__(self):
         roles = dict([('{}_{}'.format(self.owner, self.owner_token), 'lot_owner')])
@@ -160,6 +320,77 @@ class BaseLot(BaseResourceItem):
             role = 'edit_{}'.format(request.context.status)
         return role
 
+    def track_changes(self):
+        """ Start recording ``plain`` serialization of fields before they change """
+        if isinstance(self._data, TrackedData):
+            return
+        self.__lot_src__ = self.serialize_fields(self._serializables)
+        self._data = TrackedData(self._data, self._keep_source)
+
+    def _keep_source(self, name):
+        self.__lot_src__.update(self.serialize_fields([name]))
+
+    def changes_source(self, names=()):
+        """ ``plain`` serialization of the tracked fields as they were
+
+        ``names`` are tracked from now on, so the source covers them as well.
+        """
+        for name in names:
+            if name in self._fields:
+                self._data.track(name)
+        return self.__lot_src__
+
+    def untrack_changes(self):
+        """ Stop tracking, returns ``(data, src)`` of the tracked fields """
+        names = set(self._data.touched).union(self._serializables)
+        data = self.serialize_fields(names)
+        self._data = dict(self._data)
+        return data, self.__lot_src__
+
+    def serialize_fields(self, names, role='plain'):
+        """ ``self.serialize(role)`` limited to the top level fields ``names`` """
+        cls = type(self)
+        gottago = cls._options.roles.get(role) or cls._options.roles.get('default', wholelist())
+        data = {}
+        with self.untracked():
+            for name in names:
+                field = cls._fields.get(name) or cls._serializables.get(name)
+                value = getattr(self, name, None)
+                if field is None or gottago(name, value):
+                    continue
+                if value is not None and hasattr(field, 'export_loop'):
+                    value = field.export_loop(value, to_primitive, role=role)
+                elif value is not None:
+                    value = to_primitive(field, value)
+                if value is not None or allow_none(cls, field):
+                    data[field.serialized_name or name] = value
+        return data
+
+    @contextmanager
+    def untracked(self):
+        """ Reads of the fields are not recorded within the block """
+        data = self._data
+        if not isinstance(data, TrackedData):
+            yield
+            return
+        paused, data.paused = data.paused, True
+        try:
+            yield
+        finally:
+            data.paused = paused
+
+    @classmethod
+    def compile_roles(cls):
+        """ Compile serializers of the lot type roles """
+        cls._role_serializers = dict([(role, compile_role(cls, role)) for role in cls._options.roles])
+
+    def to_primitive(self, role=None, context=None):
+        serializer = type(self).__dict__.get('_role_serializers', {}).get(role)
+        with self.untracked():
+            if serializer is not None and context is None:
+                return serializer(self)
+            return super(BaseLot, self).to_primitive(role=role, context=context)
+
     def __acl__(self):
         acl = [
             (Allow, '{}_{}'.format(self.owner, self.owner_token), 'edit_lot'),
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+from cProfile import Profile
+from collections import defaultdict
+from logging import getLogger
+from pstats import Stats
+from random import random
+from time import time
+
+from pyramid.settings import asbool
+
+LOGGER = getLogger(__name__)
+
+PROFILE_HEADER = 'X-Lots-Profile'
+PROFILE_FILE_HEADER = 'X-Lots-Profile-File'
+PSTATS_EXTENSION = '.pstats'
+COLLAPSED_EXTENSION = '.collapsed'
+
+
+def is_lots_path(path):
+    """ Whether ``path`` is of lots API (``/api/<version>/lots...``) """
+    parts = path.split('/')
+    return len(parts) > 3 and parts[3] == 'lots'
+
+
+def tag(value):
+    """ ``value`` usable in a file name """
+    return re.sub(r'[^\w.-]+', '_', unicode(value or '-'))[:64]
+
+
+def func_label(func):
+    filename, line, name = func
+    return '{}:{}:{}'.format(os.path.basename(filename), line, name).replace(';', '_').replace(' ', '_')
+
+
+def collapsed_stacks(stats, min_seconds=1e-6, max_depth=64):
+    """ Flame graph collapsed stacks of ``pstats.Stats``, in microseconds
+
+    cProfile keeps caller and callee pairs only, so the time of a function
+    is split between its stacks in proportion to the time of the calls
+    from each caller.
+    """
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees[caller].append((func, edge[3]))
+    lines = defaultdict(float)
+
+    def walk(func, stack, labels, scale):
+        own = stats.stats[func][2] * scale
+        if own >= min_seconds:
+            lines[';'.join(labels)] += own
+        if len(stack) >= max_depth:
+            return
+        for callee, seconds in callees[func]:
+            total = stats.stats[callee][3]
+            if callee in stack or not total or seconds * scale < min_seconds:
+                continue
+            walk(callee, stack + (callee, ), labels + (func_label(callee), ), scale * seconds / total)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            walk(func, (func, ), (func_label(func), ), 1.0)
+    return [u'{} {}'.format(stack, int(round(seconds * 1e6)))
+            for stack, seconds in sorted(lines.items()) if seconds * 1e6 >= 0.5]
+
+
+class LotsProfiler(object):
+    """ Profiles lots requests with cProfile
+
+    Requests of Administrator with ``X-Lots-Profile`` header and a
+    ``sample_rate`` share of lots requests are profiled. Stats are saved to
+    ``directory`` as ``.pstats`` files named by time, route, lotType, lot id
+    and duration, only the last ``keep`` profiles are kept.
+    """
+
+    def __init__(self, directory, keep=20, sample_rate=0.0, collapsed=False):
+        self.directory = directory
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self.collapsed = collapsed
+
+    def wanted(self, request):
+        if not is_lots_path(request.path):
+            return False
+        if PROFILE_HEADER in request.headers:
+            return request.authenticated_role == 'Administrator'
+        return self.sample_rate > 0 and random() < self.sample_rate
+
+    def profile(self, handler, request):
+        profile = Profile()
+        start = time()
+        response = profile.runcall(handler, request)
+        duration = time() - start
+        try:
+            name = self.save(profile, request, duration)
+        except Exception, e:
+            LOGGER.error('Failed to save profile of {}: {!r}'.format(request.path, e),
+                         extra={'MESSAGE_ID': 'lots_profile_error'})
+        else:
+            if PROFILE_HEADER in request.headers:
+                response.headers[PROFILE_FILE_HEADER] = str(name)
+        return response
+
+    def file_name(self, request, duration):
+        lot = request.__dict__.get('lot') or getattr(request, 'validated', {}).get('lot')
+        route = request.matched_route.name if request.matched_route else None
+        lot_id = (request.matchdict or {}).get('lot_id') or getattr(lot, 'id', None)
+        return '-'.join([
+            '{:.6f}'.format(time()), tag(route), tag(getattr(lot, 'lotType', None)), tag(lot_id),
+            '{}ms'.format(int(duration * 1000))
+        ])
+
+    def save(self, profile, request, duration):
+        """ Write stats to the ring, returns the file name """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        name = self.file_name(request, duration)
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + PSTATS_EXTENSION)
+        if self.collapsed:
+            with open(path + COLLAPSED_EXTENSION, 'w') as collapsed:
+                collapsed.write(u'\n'.join(collapsed_stacks(Stats(profile))).encode('utf-8'))
+        self.trim()
+        LOGGER.info('Saved profile {} of {}'.format(name, request.path),
+                    extra={'MESSAGE_ID': 'lots_profile'})
+        return name + PSTATS_EXTENSION
+
+    def trim(self):
+        """ Remove the oldest profiles over ``keep``
+
+        Names start with the time, so they sort from the oldest. Profiles
+        removed by other workers meanwhile are skipped.
+        """
+        profiles = sorted([i[:-len(PSTATS_EXTENSION)] for i in os.listdir(self.directory)
+                           if i.endswith(PSTATS_EXTENSION)])
+        for name in profiles[:max(len(profiles) - self.keep, 0)]:
+            for extension in (PSTATS_EXTENSION, COLLAPSED_EXTENSION):
+                try:
+                    os.remove(os.path.join(self.directory, name + extension))
+                except OSError:
+                    pass
+
+
+def lots_profiler_factory(settings):
+    """ Build profiler from ``profiling`` plugin settings """
+    if not settings or not settings.get('directory'):
+        return
+    return LotsProfiler(
+        settings['directory'],
+        keep=int(settings.get('keep', 20)),
+        sample_rate=float(settings.get('sample_rate', 0)),
+        collapsed=asbool(settings.get('collapsed', False)),
+    )
+
+
+def profiling_tween_factory(handler, registry):
+    profiler = registry.lots_profiler
+
+    def profiling_tween(request):
+        if profiler.wanted(request):
+            return profiler.profile(handler, request)
+        return handler(request)
+    return profiling_tween
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import unittest
+import mock
+
+from openregistry.lots.core.benchmarks.runner import (
+    Benchmark,
+    compare,
+    measure,
+    median,
+    run_benchmarks,
+    summary
+)
+
+
+def results(**timings):
+    return {'results': dict([
+        (name, {'median': value} if value is not None else {'error': 'failed'}) for name, value in timings.items()
+    ])}
+
+
+class TestMeasure(unittest.TestCase):
+
+    def test_summary(self):
+        assert median([3, 1, 2]) == 2
+        assert median([4, 1, 2, 3]) == 2.5
+        assert summary([1.0, 3.0]) == {
+            'rounds': 2, 'min': 1.0, 'max': 3.0, 'mean': 2.0, 'median': 2.0, 'stdev': 1.0
+        }
+
+    def test_rounds(self):
+        run = mock.MagicMock(return_value={'conflicts': 2})
+        setup = mock.MagicMock(return_value=('lot', ))
+        result = measure(Benchmark('bench', run, setup), min_time=0, min_rounds=3)
+        assert result['rounds'] == 3
+        assert result['extra'] == {'conflicts': 6}
+        assert setup.call_count == 3
+        run.assert_called_with('lot')
+
+    def test_max_rounds(self):
+        result = measure(Benchmark('bench', lambda: None), min_time=60, min_rounds=1, max_rounds=10)
+        assert result['rounds'] == 10
+        assert 'extra' not in result
+
+    def test_errors(self):
+        def fail():
+            raise ValueError('broken')
+        run = run_benchmarks([Benchmark('ok', lambda: None), Benchmark('failed', fail), Benchmark('skipped', fail)],
+                             pattern='ok|failed', min_time=0, min_rounds=1)
+        assert run['results']['failed'] == {'error': 'ValueError: broken'}
+        assert run['results']['ok']['rounds'] == 1
+        assert 'skipped' not in run['results']
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_compare(self):
+        current = results(slower=1.2, faster=0.8, same=1.05, new=1.0, failed=None)
+        baseline = results(slower=1.0, faster=1.0, same=1.0, missing=1.0, failed=1.0)
+        assert compare(current, baseline, threshold=0.1) == [
+            ('failed', 'error', None),
+            ('faster', 'improvement', 0.8),
+            ('missing', 'missing', None),
+            ('new', 'new', None),
+            ('same', 'same', 1.05),
+            ('slower', 'regression', 1.2),
+        ]
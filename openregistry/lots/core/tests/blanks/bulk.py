@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+from copy import deepcopy
+from uuid import uuid4
+
+import mock
+from couchdb import ResourceConflict, ServerError
+
+
+def create_lots_batch(self):
+    invalid = deepcopy(self.initial_data)
+    del invalid['title']
+    response = self.app.post_json('/{}/batch'.format(self.resource_name),
+                                  {'data': [self.initial_data, invalid, self.initial_data]})
+    self.assertEqual(response.status, '200 OK')
+    self.assertEqual(response.content_type, 'application/json')
+    results = response.json['data']
+    self.assertEqual([i['status'] for i in results], ['created', 'error', 'created'])
+    self.assertEqual([i['code'] for i in results], [201, 422, 201])
+    self.assertEqual(results[1]['errors'], [
+        {u'description': [u'This field is required.'], u'location': u'body', u'name': u'title'}
+    ])
+    self.assertNotEqual(results[0]['data']['lotID'], results[2]['data']['lotID'])
+
+    for result in (results[0], results[2]):
+        self.assertIn('token', result['access'])
+        self.assertEqual(result['data']['status'], 'draft')
+        response = self.app.get('/{}/{}'.format(self.resource_name, result['data']['id']))
+        self.assertEqual(response.json['data'], result['data'])
+        self.assertIn(response.request.path, result['location'])
+
+
+def create_lots_batch_item_status(self):
+    pending = dict(self.initial_data, status='pending')
+    response = self.app.post_json('/{}/batch'.format(self.resource_name),
+                                  {'data': [pending, self.initial_data]})
+    results = response.json['data']
+    self.assertEqual([i['code'] for i in results], [403, 201])
+    self.assertEqual(results[0]['errors'], [
+        {u'description': u'You can create only in draft status', u'location': u'body', u'name': u'status'}
+    ])
+
+
+def create_lots_batch_invalid(self):
+    url = '/{}/batch'.format(self.resource_name)
+    for data in ([self.initial_data], {'data': []}, {'data': self.initial_data}, {'data': ['lot']}):
+        response = self.app.post_json(url, data, status=422)
+        self.assertEqual(response.json['errors'], [
+            {u'description': u'Data not available', u'location': u'body', u'name': u'data'}
+        ])
+
+    with mock.patch('openregistry.lots.core.validation.BATCH_SIZE_LIMIT', 2):
+        response = self.app.post_json(url, {'data': [self.initial_data] * 3}, status=422)
+    self.assertEqual(response.json['errors'], [
+        {u'description': u'Batch size is limited to 2 lots', u'location': u'body', u'name': u'data'}
+    ])
+
+    response = self.app.get('/{}'.format(self.resource_name))
+    self.assertEqual(response.json['data'], [])
+
+
+def create_lots_batch_store_errors(self):
+    def update(docs):
+        return [
+            (False, docs[0]['_id'], ResourceConflict(('conflict', 'Document update conflict.'))),
+            (False, docs[1]['_id'], ServerError((500, ('error', 'Internal Server Error')))),
+        ]
+
+    with mock.patch.object(self.db, 'update', side_effect=update):
+        response = self.app.post_json('/{}/batch'.format(self.resource_name),
+                                      {'data': [self.initial_data, self.initial_data]})
+    results = response.json['data']
+    self.assertEqual([i['status'] for i in results], ['error', 'error'])
+    self.assertEqual([i['code'] for i in results], [409, 500])
+    self.assertEqual(results[0]['errors'][0]['name'], 'data')
+
+    response = self.app.get('/{}'.format(self.resource_name))
+    self.assertEqual(response.json['data'], [])
+
+
+def batch_lot(self, status=None):
+    """ Lot created by the broker, switched to ``status`` editable by bots """
+    self.app.authorization = self.initial_auth
+    lot = self.create_resource()
+    doc = self.db.get(lot['id'])
+    doc['status'] = status or self.batch_status
+    self.db.save(doc)
+    self.app.authorization = ('Basic', (self.batch_bot, ''))
+    return doc
+
+
+def patch_lots_batch_permission(self):
+    doc = batch_lot(self)
+    self.app.authorization = self.initial_auth
+    self.app.patch_json('/{}/batch'.format(self.resource_name),
+                        {'data': [{'id': doc['_id'], 'status': doc['status']}]}, status=403)
+
+    self.app.authorization = ('Basic', (self.batch_bot, ''))
+    response = self.app.patch_json('/{}/batch'.format(self.resource_name),
+                                   {'data': [{'id': doc['_id'], 'status': doc['status']}]})
+    self.assertEqual(response.status, '200 OK')
+
+
+def patch_lots_batch_stale_rev(self):
+    stale, current = batch_lot(self), batch_lot(self)
+    rev = stale['_rev']
+    stale = self.db.get(stale['_id'])
+    self.db.save(stale)
+
+    response = self.app.patch_json('/{}/batch'.format(self.resource_name), {'data': [
+        {'id': stale['_id'], 'rev': rev, 'status': self.batch_next_status},
+        {'id': current['_id'], 'rev': current['_rev'], 'status': self.batch_next_status},
+    ]})
+    results = response.json['data']
+    self.assertEqual([i['code'] for i in results], [412, 200])
+    self.assertEqual(results[0]['errors'], [
+        {u'description': u'Precondition Failed', u'location': u'body', u'name': u'rev'}
+    ])
+    self.assertEqual(results[1]['status'], 'updated')
+    self.assertEqual(self.db.get(stale['_id'])['status'], self.batch_status)
+    self.assertEqual(self.db.get(current['_id'])['status'], self.batch_next_status)
+
+
+def patch_lots_batch_unchanged(self):
+    doc = batch_lot(self)
+    response = self.app.patch_json('/{}/batch'.format(self.resource_name), {'data': [
+        {'id': doc['_id'], 'rev': doc['_rev'], 'status': doc['status']}
+    ]})
+    self.assertEqual(response.json['data'], [
+        {u'status': u'unchanged', u'code': 200, u'id': doc['_id'], u'rev': doc['_rev']}
+    ])
+    stored = self.db.get(doc['_id'])
+    self.assertEqual(stored['_rev'], doc['_rev'])
+    self.assertEqual(stored['dateModified'], doc['dateModified'])
+
+
+def patch_lots_batch_conflict(self):
+    first, second = batch_lot(self), batch_lot(self)
+
+    def update(docs):
+        return [(False, docs[0]['_id'], ResourceConflict(('conflict', 'Document update conflict.')))] + [
+            (True, ) + self.db.save(i) for i in docs[1:]
+        ]
+
+    with mock.patch.object(self.db, 'update', side_effect=update):
+        response = self.app.patch_json('/{}/batch'.format(self.resource_name), {'data': [
+            {'id': first['_id'], 'status': self.batch_next_status},
+            {'id': second['_id'], 'status': self.batch_next_status},
+        ]})
+    results = response.json['data']
+    self.assertEqual([i['code'] for i in results], [409, 200])
+    self.assertEqual(results[0]['status'], 'error')
+    self.assertEqual(self.db.get(first['_id'])['_rev'], first['_rev'])
+
+
+def patch_lots_batch_invalid_status(self):
+    doc = batch_lot(self)
+    response = self.app.patch_json('/{}/batch'.format(self.resource_name), {'data': [
+        {'id': doc['_id'], 'status': 'unknown'}
+    ]})
+    result = response.json['data'][0]
+    self.assertEqual(result['code'], 422)
+    self.assertEqual(result['errors'][0]['name'], 'status')
+    self.assertEqual(self.db.get(doc['_id'])['_rev'], doc['_rev'])
+
+
+def bulk_get_lots(self):
+    first, second = self.create_resource(), self.create_resource()
+    missing = uuid4().hex
+    response = self.app.post_json('/{}/_bulk_get'.format(self.resource_name),
+                                  {'data': [second['id'], missing, first['id']]})
+    self.assertEqual(response.status, '200 OK')
+    self.assertEqual([i['id'] for i in response.json['data']], [second['id'], first['id']])
+    self.assertEqual(response.json['not_found'], [missing])
+
+    for lot in response.json['data']:
+        self.assertNotIn('owner_token', lot)
+        self.assertNotIn('transfer_token', lot)
+        self.assertNotIn('revisions', lot)
+        self.assertEqual(self.app.get('/{}/{}'.format(self.resource_name, lot['id'])).json['data'], lot)
+
+
+def bulk_get_lots_invalid(self):
+    url = '/{}/_bulk_get'.format(self.resource_name)
+    lot = self.create_resource()
+    response = self.app.post_json(url, {'data': [lot['id'], lot['id']]}, status=422)
+    self.assertEqual(response.json['errors'], [
+        {u'description': u'Lot ids should be unique', u'location': u'body', u'name': u'data'}
+    ])
+
+    for data in ({'data': []}, {'data': lot['id']}, {'data': [lot]}):
+        response = self.app.post_json(url, data, status=422)
+        self.assertEqual(response.json['errors'], [
+            {u'description': u'Data not available', u'location': u'body', u'name': u'data'}
+        ])
+
+    with mock.patch('openregistry.lots.core.validation.BATCH_SIZE_LIMIT', 2):
+        response = self.app.post_json(url, {'data': [uuid4().hex for _ in range(3)]}, status=422)
+    self.assertEqual(response.json['errors'], [
+        {u'description': u'Batch size is limited to 2 lots', u'location': u'body', u'name': u'data'}
+    ])
@@ -4,3 +4,42 @@ from openprocurement.api.tests.blanks.mixins import (
     ResourceTestMixin,  # noqa forwarded import
     ResourceDocumentTestMixin  # noqa forwarded import
 )
+
+from openregistry.lots.core.tests.base import snitch
+from openregistry.lots.core.tests.blanks.bulk import (
+    bulk_get_lots,
+    bulk_get_lots_invalid,
+    create_lots_batch,
+    create_lots_batch_item_status,
+    create_lots_batch_invalid,
+    create_lots_batch_store_errors,
+    patch_lots_batch_permission,
+    patch_lots_batch_stale_rev,
+    patch_lots_batch_unchanged,
+    patch_lots_batch_conflict,
+    patch_lots_batch_invalid_status
+)
+
+
+class LotsBatchTestMixin(object):
+
+    # bot patching the lots in batch_status, which it may switch to batch_next_status
+    batch_bot = 'concierge'
+    batch_status = 'verification'
+    batch_next_status = 'pending'
+
+    test_create_lots_batch = snitch(create_lots_batch)
+    test_create_lots_batch_item_status = snitch(create_lots_batch_item_status)
+    test_create_lots_batch_invalid = snitch(create_lots_batch_invalid)
+    test_create_lots_batch_store_errors = snitch(create_lots_batch_store_errors)
+    test_patch_lots_batch_permission = snitch(patch_lots_batch_permission)
+    test_patch_lots_batch_stale_rev = snitch(patch_lots_batch_stale_rev)
+    test_patch_lots_batch_unchanged = snitch(patch_lots_batch_unchanged)
+    test_patch_lots_batch_conflict = snitch(patch_lots_batch_conflict)
+    test_patch_lots_batch_invalid_status = snitch(patch_lots_batch_invalid_status)
+
+
+class LotsBulkGetTestMixin(object):
+
+    test_bulk_get_lots = snitch(bulk_get_lots)
+    test_bulk_get_lots_invalid = snitch(bulk_get_lots_invalid)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import unittest
+import mock
+
+from couchdb.client import Row
+from cornice.errors import Errors
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.httpexceptions import HTTPError
+
+from openregistry.lots.core.traversal import Root
+from openregistry.lots.core.views.bulk import LotsBatchResource, pop_errors
+
+
+def error_handler(request):
+    return HTTPError()
+
+
+class TestLotsBatchPermissions(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = ACLAuthorizationPolicy()
+        self.root = Root(mock.MagicMock())
+
+    def test_bots(self):
+        for group in ('g:concierge', 'g:convoy'):
+            assert self.policy.permits(self.root, [group], 'edit_lots_batch')
+
+    def test_brokers(self):
+        for group in ('g:brokers', 'g:Administrator', 'g:chronograph'):
+            assert not self.policy.permits(self.root, [group], 'edit_lots_batch')
+        assert self.policy.permits(self.root, ['g:brokers'], 'create_lot')
+
+
+class TestPopErrors(unittest.TestCase):
+
+    def test_pop_errors(self):
+        request = mock.MagicMock(errors=Errors())
+        request.errors.add('body', 'rev', 'Precondition Failed')
+        request.errors.status = 412
+        assert pop_errors(request) == {'status': 'error', 'code': 412, 'errors': [
+            {'location': 'body', 'name': 'rev', 'description': 'Precondition Failed'}
+        ]}
+        assert list(request.errors) == []
+        assert request.errors.status == 400
+
+
+@mock.patch('openregistry.lots.core.views.bulk.error_handler', new=error_handler)
+@mock.patch('openregistry.lots.core.views.bulk.apply_patch', new=mock.MagicMock())
+@mock.patch('openregistry.lots.core.views.bulk.validate_change_status', new=mock.MagicMock())
+@mock.patch('openregistry.lots.core.views.bulk.validate_patch_lot_item_data')
+@mock.patch('openregistry.lots.core.views.bulk.get_lot_changes')
+@mock.patch('openregistry.lots.core.views.bulk.store_lots')
+class TestLotsBatchPatch(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = dict([
+            (i, {'_id': i, '_rev': '1-{}'.format(i), 'doc_type': 'Lot', 'status': 'verification'})
+            for i in ('lot1', 'lot2')
+        ])
+        self.request = mock.MagicMock(validated={}, errors=Errors())
+        self.request.registry.db.view.side_effect = lambda name, keys, include_docs: [
+            Row(id=i, key=i, doc=self.docs.get(i)) for i in keys
+        ]
+        self.request.lot_from_data.side_effect = lambda doc: mock.MagicMock(
+            id=doc['_id'], rev=doc['_rev'], status=doc['status'], mode=None
+        )
+        self.root = mock.MagicMock()
+        self.resource = LotsBatchResource(self.request, self.root)
+
+    def patch(self, batch):
+        self.request.validated['batch'] = batch
+        return self.resource.patch()['data']
+
+    def test_updated(self, mocked_store, mocked_changes, mocked_validate):
+        mocked_changes.return_value = [{'op': 'replace', 'path': '/status', 'value': 'pending'}]
+        mocked_store.side_effect = lambda lots, request: [None for _ in lots]
+        results = self.patch([{'id': 'lot1', 'rev': '1-lot1', 'status': 'active.salable', 'title': u'Lot'}])
+        assert results == [{'status': 'updated', 'code': 200, 'id': 'lot1', 'rev': '1-lot1'}]
+        # fields other than status and auctions are not patched
+        mocked_validate.assert_called_once_with(self.request, error_handler, {'status': 'active.salable'})
+        assert [lot.id for lot, _ in mocked_store.call_args[0][0]] == ['lot1']
+        assert self.request.context is self.root
+
+    def test_stale_rev(self, mocked_store, mocked_changes, mocked_validate):
+        mocked_changes.return_value = [{'op': 'replace', 'path': '/status', 'value': 'pending'}]
+        mocked_store.side_effect = lambda lots, request: [None for _ in lots]
+        results = self.patch([{'id': 'lot1', 'rev': '0-lot1', 'status': 'pending'},
+                              {'id': 'lot2', 'status': 'pending'}])
+        assert results[0] == {'status': 'error', 'code': 412, 'errors': [
+            {'location': 'body', 'name': 'rev', 'description': 'Precondition Failed'}
+        ]}
+        assert results[1]['status'] == 'updated'
+        assert [lot.id for lot, _ in mocked_store.call_args[0][0]] == ['lot2']
+
+    def test_unchanged(self, mocked_store, mocked_changes, mocked_validate):
+        mocked_changes.return_value = []
+        mocked_store.return_value = []
+        results = self.patch([{'id': 'lot1', 'rev': '1-lot1', 'status': 'verification'}])
+        assert results == [{'status': 'unchanged', 'code': 200, 'id': 'lot1', 'rev': '1-lot1'}]
+        # nothing is stored, so neither revision nor dateModified are changed
+        mocked_store.assert_called_once_with([], self.request)
+
+    def test_store_conflict(self, mocked_store, mocked_changes, mocked_validate):
+        mocked_changes.return_value = [{'op': 'replace', 'path': '/status', 'value': 'pending'}]
+        conflict = {'code': 409, 'errors': [
+            {'location': 'body', 'name': 'data', 'description': 'Document update conflict.'}
+        ]}
+        mocked_store.return_value = [conflict, None]
+        results = self.patch([{'id': 'lot1', 'status': 'pending'}, {'id': 'lot2', 'status': 'pending'}])
+        assert results[0] == dict(conflict, status='error')
+        assert results[1]['status'] == 'updated'
+
+    def test_validation_error(self, mocked_store, mocked_changes, mocked_validate):
+        def validate(request, error_handler, data):
+            if data['status'] == 'unknown':
+                request.errors.add('body', 'status', ["Value must be one of ['pending']."])
+                request.errors.status = 422
+                raise error_handler(request)
+        mocked_validate.side_effect = validate
+        mocked_changes.return_value = [{'op': 'replace', 'path': '/status', 'value': 'pending'}]
+        mocked_store.side_effect = lambda lots, request: [None for _ in lots]
+        results = self.patch([{'id': 'lot1', 'status': 'unknown'}, {'id': 'lot2', 'status': 'pending'}])
+        assert results[0] == {'status': 'error', 'code': 422, 'errors': [
+            {'location': 'body', 'name': 'status', 'description': ["Value must be one of ['pending']."]}
+        ]}
+        assert results[1]['status'] == 'updated'
+        # errors of an item are not reported for the next one
+        assert list(self.request.errors) == []
+
+    def test_invalid_ids(self, mocked_store, mocked_changes, mocked_validate):
+        mocked_changes.return_value = []
+        mocked_store.return_value = []
+        results = self.patch([{'status': 'pending'}, {'id': 'lot3', 'status': 'pending'},
+                              {'id': 'lot1', 'status': 'verification'}, {'id': 'lot1', 'status': 'pending'}])
+        assert [i['code'] for i in results] == [422, 404, 200, 422]
+        assert results[1]['errors'] == [{'location': 'body', 'name': 'id', 'description': 'Not Found'}]
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(TestLotsBatchPatch))
+    tests.addTest(unittest.makeSuite(TestLotsBatchPermissions))
+    tests.addTest(unittest.makeSuite(TestPopErrors))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from socket import timeout
+
+from openregistry.lots.core.cache import (
+    LotDocumentCache,
+    SerializationCache,
+    changes_heartbeat,
+    follow_changes,
+    lot_cache_factory
+)
+from openregistry.lots.core.metrics import Metrics
+
+
+class TestLotDocumentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LotDocumentCache(size=2, ttl=60)
+        self.doc = {'_id': 'lot1', '_rev': '1-a', 'doc_type': 'Lot', 'documents': []}
+
+    def test_get_returns_copy(self):
+        self.cache.set(self.doc)
+        doc = self.cache.get('lot1')
+        assert doc == self.doc
+        doc['documents'].append({})
+        assert self.cache.get('lot1') == self.doc
+
+    def test_miss(self):
+        assert self.cache.get('lot1') is None
+
+    def test_lru_eviction(self):
+        self.cache.set(self.doc)
+        self.cache.set(dict(self.doc, _id='lot2'))
+        self.cache.get('lot1')
+        self.cache.set(dict(self.doc, _id='lot3'))
+        assert self.cache.get('lot2') is None
+        assert self.cache.get('lot1') is not None
+        assert self.cache.get('lot3') is not None
+
+    @mock.patch('openregistry.lots.core.cache.time', autospec=True)
+    def test_ttl(self, mocked_time):
+        mocked_time.side_effect = iter([100, 159, 161])
+        self.cache.set(self.doc)
+        assert self.cache.get('lot1') is not None
+        assert self.cache.get('lot1') is None
+
+    def test_invalidate(self):
+        self.cache.set(self.doc)
+        self.cache.invalidate('lot1')
+        assert self.cache.get('lot1') is None
+
+    def test_invalidate_same_revision(self):
+        self.cache.set(self.doc)
+        self.cache.invalidate('lot1', '1-a')
+        assert self.cache.get('lot1') is not None
+        self.cache.invalidate('lot1', '2-b')
+        assert self.cache.get('lot1') is None
+
+    def test_invalidated_during_read(self):
+        generation = self.cache.generation()
+        self.cache.invalidate('lot1', '2-b')
+        self.cache.set(self.doc, generation)
+        assert self.cache.get('lot1') is None
+        self.cache.set(dict(self.doc, _id='lot2'), generation)
+        assert self.cache.get('lot2') is not None
+
+    def test_forgotten_invalidations(self):
+        generation = self.cache.generation()
+        for lot_id in ('lot2', 'lot3', 'lot4'):
+            self.cache.invalidate(lot_id)
+        # lot1 could be invalidated among the forgotten ids
+        self.cache.set(self.doc, generation)
+        assert self.cache.get('lot1') is None
+        self.cache.set(self.doc, self.cache.generation())
+        assert self.cache.get('lot1') is not None
+
+
+class TestSerializationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SerializationCache(max_bytes=40)
+        self.key = ('lot1', '1-a', 'view', 'http://localhost')
+        self.value = {'id': 'lot1', 'items': []}
+
+    def test_hit_returns_copy(self):
+        self.cache.set(self.key, self.value)
+        value = self.cache.get(self.key)
+        assert value == self.value
+        value['items'].append(1)
+        assert self.cache.get(self.key) == self.value
+        assert self.cache.stats['hits'] == 2
+
+    def test_miss(self):
+        assert self.cache.get(self.key) is None
+        assert self.cache.stats['misses'] == 1
+
+    def test_memory_cap(self):
+        self.cache.set(self.key, self.value)
+        self.cache.set(('lot2', '1-a', 'view', 'http://localhost'), self.value)
+        assert self.cache.get(self.key) is None
+        assert self.cache.bytes <= self.cache.max_bytes
+        assert self.cache.stats['evictions'] == 1
+
+    def test_too_big_value(self):
+        self.cache.set(self.key, {'title': 'x' * 100})
+        assert self.cache.get(self.key) is None
+        assert self.cache.bytes == 0
+
+    def test_metrics(self):
+        metrics = Metrics()
+        cache = SerializationCache(max_bytes=40, metrics=metrics)
+        cache.get(self.key)
+        cache.set(self.key, self.value)
+        cache.get(self.key)
+        cache.set(('lot2', '1-a', 'view', 'http://localhost'), self.value)
+        assert dict((name, metric.value) for name, _, metric in metrics.collect()) == {
+            'lot_serialization_cache_evictions_total': 1,
+            'lot_serialization_cache_hits_total': 1,
+            'lot_serialization_cache_misses_total': 1,
+        }
+
+
+class TestSerializationCacheFileTier(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.key = ('lot1', '1-a', 'view', 'http://localhost')
+        self.value = {'id': 'lot1', 'items': []}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_caches(self):
+        SerializationCache(directory=self.directory).set(self.key, self.value)
+        cache = SerializationCache(directory=self.directory)
+        assert cache.get(self.key) == self.value
+        assert cache.get(self.key) == self.value
+        assert cache.stats['file_hits'] == 1
+        assert cache.stats['hits'] == 1
+
+    def test_prune(self):
+        cache = SerializationCache(directory=self.directory, max_files=2)
+        cache.prune_every = 1
+        for i in range(4):
+            cache.set(('lot{}'.format(i), '1-a', 'view', ''), self.value)
+        assert len(os.listdir(self.directory)) == 2
+
+
+class StopFollowing(Exception):
+    pass
+
+
+@mock.patch('openregistry.lots.core.cache.LOGGER', new=mock.MagicMock())
+@mock.patch('openregistry.lots.core.cache.sleep', autospec=True)
+class TestFollowChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.db.resource.session.connection_pool.timeout = 10
+        self.cache = LotDocumentCache()
+        self.cache.set({'_id': 'lot1', '_rev': '1-a'})
+        self.cache.set({'_id': 'lot2', '_rev': '1-a'})
+
+    def feed(self, *changes):
+        for change in changes:
+            if isinstance(change, Exception):
+                raise change
+            yield change
+
+    def test_heartbeat_within_timeout(self, mocked_sleep):
+        assert changes_heartbeat(self.db) == 5000
+        self.db.resource.session.connection_pool.timeout = None
+        assert changes_heartbeat(self.db) == 30000
+
+    def test_timeout_keeps_cache(self, mocked_sleep):
+        mocked_sleep.side_effect = iter([None, StopFollowing()])
+        self.db.changes.side_effect = iter([
+            self.feed({'seq': 5, 'id': 'lot1', 'changes': [{'rev': '2-b'}]}, timeout('timed out')),
+            self.feed({'seq': 6, 'id': 'lot3', 'changes': [{'rev': '1-a'}]}, timeout('timed out')),
+        ])
+        with self.assertRaises(StopFollowing):
+            follow_changes(self.db, self.cache)
+        assert [i[1] for i in self.db.changes.call_args_list] == [
+            {'feed': 'continuous', 'since': 'now', 'heartbeat': 5000},
+            {'feed': 'continuous', 'since': 5, 'heartbeat': 5000},
+        ]
+        assert self.cache.get('lot1') is None
+        assert self.cache.get('lot2') is not None
+
+    def test_failure_before_first_change_clears_cache(self, mocked_sleep):
+        mocked_sleep.side_effect = iter([StopFollowing()])
+        self.db.changes.side_effect = iter([self.feed(timeout('timed out'))])
+        with self.assertRaises(StopFollowing):
+            follow_changes(self.db, self.cache)
+        assert self.cache.get('lot2') is None
+
+
+class TestLotCacheFactory(unittest.TestCase):
+
+    def test_disabled(self):
+        assert lot_cache_factory({}) is None
+
+    def test_enabled(self):
+        cache = lot_cache_factory({'size': '10', 'ttl': '5'})
+        assert cache.size == 10
+        assert cache.ttl == 5
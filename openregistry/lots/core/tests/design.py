@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+import unittest
+import mock
+
+from socket import timeout
+
+from couchdb import ResourceConflict, ServerError
+from couchdb.client import Row
+from couchdb.design import ViewDefinition
+
+from openregistry.lots.core.design import (
+    configure_fields,
+    design_docs,
+    lots_views,
+    sync_views,
+    sync_lots_design,
+    remove_obsolete_feeds,
+    remove_stale_feed_designs,
+    serve_feed_design,
+    FeedView,
+    FEED,
+    FIELDS,
+    CHANGES_FIELDS,
+    LISTING_FIELDS,
+    VIEW_MAP,
+    CHANGES_VIEW_MAP,
+    lots_by_mode_dateModified_view,
+    lots_by_mode_local_seq_view
+)
+
+
+class TestConfigureFields(unittest.TestCase):
+
+    def tearDown(self):
+        configure_fields([])
+
+    def test_default_fields(self):
+        configure_fields([])
+        assert FIELDS == ['status', 'lotID', 'lotType']
+        assert CHANGES_FIELDS == ['status', 'lotID', 'lotType', 'dateModified']
+        assert lots_by_mode_dateModified_view.design == 'lots'
+        assert "var fields=['status', 'lotID', 'lotType'], data={};" in lots_by_mode_dateModified_view.map_fun
+
+    def test_extra_fields(self):
+        configure_fields([u'lotCustodian', u'status'])
+        assert FIELDS == ['status', 'lotID', 'lotType', 'lotCustodian']
+        assert CHANGES_FIELDS == ['status', 'lotID', 'lotType', 'lotCustodian', 'dateModified']
+        assert 'lotCustodian' in LISTING_FIELDS
+        for view in (lots_by_mode_dateModified_view, lots_by_mode_local_seq_view):
+            assert view.design.startswith('lots_')
+            assert "'lotCustodian'" in view.map_fun
+        assert "emit([doc.mode || '', doc._local_seq], data);" in lots_by_mode_local_seq_view.map_fun
+
+    def test_sensitive_field(self):
+        with self.assertRaises(ValueError):
+            configure_fields(['revisions'])
+
+
+def row(mode, key, doc_id):
+    return Row(id=doc_id, key=[mode, key], value={})
+
+
+class TestFeedView(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.view = mock.MagicMock()
+
+    def test_maps_use_single_view(self):
+        assert set(i.view for i in VIEW_MAP.values()) == {lots_by_mode_dateModified_view}
+        assert set(i.view for i in CHANGES_VIEW_MAP.values()) == {lots_by_mode_local_seq_view}
+
+    def test_mode_range(self):
+        self.view.return_value = [row(u'test', u'2018', 'a')]
+        rows = FeedView(self.view, [u'test'])(self.db, limit=10, startkey=u'2017')
+        self.view.assert_called_once_with(self.db, limit=10, startkey=[u'test', u'2017'],
+                                          endkey=[u'test', {}])
+        assert rows[0].key == u'2018'
+        assert rows[0].id == 'a'
+
+    def test_descending_range(self):
+        self.view.return_value = []
+        FeedView(self.view, [u''])(self.db, limit=10, descending=True)
+        self.view.assert_called_once_with(self.db, limit=10, descending=True,
+                                          startkey=[u'', {}], endkey=[u''])
+
+    def test_warmer_stale(self):
+        self.view.return_value = []
+        feed_view = FeedView(self.view, [u''])
+        feed_view.stale = 'ok'
+        feed_view(self.db, limit=10, stale='update_after')
+        self.view.assert_called_once_with(self.db, limit=10, stale='ok', startkey=[u''], endkey=[u'', {}])
+
+    def test_fallback(self):
+        fallback = mock.MagicMock(return_value=[])
+        feed_view = FeedView(self.view, [u''])
+        feed_view.fallback = fallback
+        feed_view(self.db, limit=10)
+        fallback.assert_called_once_with(self.db, limit=10, startkey=[u''], endkey=[u'', {}])
+        assert self.view.call_count == 0
+
+    def test_merged_ranges(self):
+        self.view.side_effect = [
+            [row(u'', 1, 'a'), row(u'', 4, 'b')],
+            [row(u'test', 2, 'c'), row(u'test', 3, 'd')],
+        ]
+        rows = FeedView(self.view, [u'', u'test'])(self.db, limit=3, startkey=0)
+        assert [i.id for i in rows] == ['a', 'c', 'd']
+        assert [i.key for i in rows] == [1, 2, 3]
+
+    def test_merged_ranges_descending(self):
+        self.view.side_effect = [
+            [row(u'', 4, 'b'), row(u'', 1, 'a')],
+            [row(u'test', 3, 'd'), row(u'test', 2, 'c')],
+        ]
+        rows = FeedView(self.view, [u'', u'test'])(self.db, limit=2, descending=True)
+        assert [i.key for i in rows] == [4, 3]
+
+
+class TestRemoveObsoleteViews(unittest.TestCase):
+
+    def setUp(self):
+        self.event = mock.MagicMock()
+        self.db = self.event.app.registry.db
+
+    def test_remove(self):
+        self.db.get.return_value = {'_id': '_design/lots', 'views': {
+            'by_dateModified': {}, 'test_by_local_seq': {}, 'by_mode_dateModified': {}
+        }}
+        remove_obsolete_feeds(self.event)
+        self.db.save.assert_called_once_with({'_id': '_design/lots', 'views': {'by_mode_dateModified': {}}})
+
+    def test_nothing_to_remove(self):
+        self.db.get.return_value = {'_id': '_design/lots', 'views': {'by_mode_dateModified': {}}}
+        remove_obsolete_feeds(self.event)
+        assert self.db.save.call_count == 0
+
+    def test_stale_default_design(self):
+        self.db.view.return_value = [design_row('_design/lots')]
+        configure_fields(['lotCustodian'])
+        try:
+            remove_obsolete_feeds(self.event)
+        finally:
+            configure_fields([])
+        self.db.delete.assert_called_once_with({'_id': '_design/lots', '_rev': '1-a'})
+        assert self.db.save.call_count == 0
+
+
+def design_row(doc_id):
+    return Row(id=doc_id, key=doc_id, value={'rev': '1-a'})
+
+
+class TestRemoveStaleFeedDesigns(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+
+    def tearDown(self):
+        configure_fields([])
+
+    def test_other_fields_designs(self):
+        configure_fields(['lotCustodian'])
+        current = '_design/' + lots_by_mode_dateModified_view.design
+        self.db.view.return_value = [design_row(i) for i in [
+            '_design/lots', '_design/lots_staging', '_design/lots_0123abcd', '_design/lots_0123abcd_staging',
+            current, current + '_staging', '_design/lots_custom'
+        ]]
+        remove_stale_feed_designs(self.db)
+        assert [i[0][0]['_id'] for i in self.db.delete.call_args_list] == [
+            '_design/lots', '_design/lots_staging', '_design/lots_0123abcd', '_design/lots_0123abcd_staging'
+        ]
+
+    def test_default_fields(self):
+        self.db.view.return_value = [design_row('_design/lots'), design_row('_design/lots_0123abcd')]
+        self.db.delete.side_effect = [ResourceConflict()]
+        remove_stale_feed_designs(self.db)
+        self.db.delete.assert_called_once_with({'_id': '_design/lots_0123abcd', '_rev': '1-a'})
+
+
+class TestSyncViews(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.views = [ViewDefinition('lots', 'by_key', 'function(doc) {emit(doc.key, null);}')]
+        self.doc = design_docs(self.views)['_design/lots']
+
+    def test_hash(self):
+        assert self.doc['views_hash'] == design_docs(self.views)['_design/lots']['views_hash']
+        self.views[0].map_fun = 'function(doc) {emit(doc.other, null);}'
+        assert self.doc['views_hash'] != design_docs(self.views)['_design/lots']['views_hash']
+
+    def test_unchanged(self):
+        self.db.get.return_value = dict(self.doc, _id='_design/lots', _rev='1-a')
+        sync_views(self.db, self.views)
+        assert self.db.save.call_count == 0
+
+    def test_new_design(self):
+        self.db.get.return_value = None
+        sync_views(self.db, self.views)
+        self.db.save.assert_called_once_with(dict(self.doc, _id='_design/lots'))
+        assert self.db.view.call_count == 0
+
+    def test_staged(self):
+        live = {'_id': '_design/lots', '_rev': '1-a', 'views': {'old': {'map': ''}}}
+        self.db.get.side_effect = [live, None]
+        sync_views(self.db, self.views)
+        staging = dict(self.doc, _id='_design/lots_staging')
+        assert self.db.save.call_args_list == [mock.call(staging), mock.call(dict(self.doc, _id='_design/lots', _rev='1-a'))]
+        self.db.view.assert_called_once_with('lots_staging/by_key', limit=0)
+        self.db.delete.assert_called_once_with(staging)
+
+    def test_conflict(self):
+        self.db.get.return_value = None
+        self.db.save.side_effect = ResourceConflict()
+        sync_views(self.db, self.views)
+        assert self.db.delete.call_count == 0
+
+    def test_build_failure(self):
+        live = {'_id': '_design/lots', '_rev': '1-a', 'views': {'old': {'map': ''}}}
+        staging = dict(self.doc, _id='_design/lots_staging', _rev='1-b')
+        self.db.get.side_effect = [live, None, staging]
+        self.db.view.side_effect = timeout('timed out')
+        with mock.patch('openregistry.lots.core.design.LOGGER') as mocked_logger:
+            sync_views(self.db, self.views)
+        assert mocked_logger.exception.call_count == 1
+        # live document is kept and the staging one is cleaned up
+        assert self.db.save.call_count == 1
+        self.db.delete.assert_called_once_with(staging)
+
+    def test_server_error(self):
+        self.db.get.side_effect = ServerError((500, 'error'))
+        with mock.patch('openregistry.lots.core.design.LOGGER') as mocked_logger:
+            sync_views(self.db, self.views)
+        assert mocked_logger.exception.call_count == 1
+        assert self.db.save.call_count == 0
+
+    def test_background_failure(self):
+        with mock.patch('openregistry.lots.core.design.sync_views') as mocked_sync, \
+                mock.patch('openregistry.lots.core.design.LOGGER') as mocked_logger:
+            mocked_sync.side_effect = ValueError('broken')
+            sync_lots_design(self.db)
+        assert mocked_logger.exception.call_count == 1
+
+
+@mock.patch('openregistry.lots.core.design.LOGGER', new=mock.MagicMock())
+@mock.patch('openregistry.lots.core.design.remove_stale_feed_designs')
+@mock.patch('openregistry.lots.core.design.sync_views')
+class TestSyncLotsDesignFieldsChange(unittest.TestCase):
+
+    def setUp(self):
+        # the previous deployment served the default fields
+        self.previous = dict(design_docs(lots_views())['_design/lots'], _id='_design/lots', _rev='1-a')
+        configure_fields(['lotCustodian'])
+        self.db = mock.MagicMock()
+        self.served = []
+
+        def view(name, **options):
+            if name == '_all_docs':
+                return [Row(id=i['_id'], key=i['_id'], value={'rev': i['_rev']}, doc=i) for i in [self.previous]]
+            # the listing while the new views are built
+            self.served.append((name, VIEW_MAP[u''].fallback.design, sorted(LISTING_FIELDS)))
+            return []
+        self.db.view.side_effect = view
+
+    def tearDown(self):
+        serve_feed_design()
+        configure_fields([])
+
+    def test_previous_design_served_until_built(self, mocked_sync, mocked_remove):
+        sync_lots_design(self.db)
+        design = lots_by_mode_dateModified_view.design
+        assert self.served == [
+            ('{}/by_mode_dateModified'.format(design), 'lots', ['dateModified', 'id', 'lotID', 'lotType', 'status'])
+        ]
+        assert all(j.fallback is None for i in FEED.values() for j in i.values())
+        assert 'lotCustodian' in LISTING_FIELDS
+        mocked_remove.assert_called_once_with(self.db)
+
+    def test_build_failure(self, mocked_sync, mocked_remove):
+        mocked_sync.side_effect = timeout('timed out')
+        sync_lots_design(self.db)
+        assert VIEW_MAP[u''].fallback.design == 'lots'
+        assert CHANGES_VIEW_MAP[u'test'].fallback.design == 'lots'
+        assert 'lotCustodian' not in LISTING_FIELDS
+        assert mocked_remove.call_count == 0
+
+    def test_no_previous_design(self, mocked_sync, mocked_remove):
+        self.previous = dict(self.previous, _id='_design/' + lots_by_mode_dateModified_view.design)
+        sync_lots_design(self.db)
+        assert self.served == []
+        assert VIEW_MAP[u''].fallback is None
+        assert 'lotCustodian' in LISTING_FIELDS
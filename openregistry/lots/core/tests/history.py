@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import unittest
+import mock
+
+from couchdb.client import Row
+from couchdb.http import ResourceConflict, ServerError
+
+from openregistry.lots.core.history import (
+    LotHistory,
+    lot_history_factory,
+    lot_revisions,
+    lot_snapshot,
+    revision_doc_id,
+    revisions_count
+)
+
+
+class TestLotHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = LotHistory()
+        self.db = mock.MagicMock()
+        self.lot = mock.MagicMock(id='a' * 32, rev='3-abc', revisions=[], revisionsCount=2)
+
+    def test_revision_doc_id(self):
+        assert revision_doc_id('lot', 12) == 'lot-r000012'
+        assert revisions_count({'revisionsCount': 7, 'revisions': [{}]}) == 7
+        assert revisions_count({'revisions': [{}, {}]}) == 2
+        assert revisions_count({}) == 0
+
+    def test_detach(self):
+        doc = {'_id': 'lot', 'revisions': [{'rev': None}, {'rev': '1-a'}]}
+        assert self.history.detach(doc) == [(1, {'rev': None}), (2, {'rev': '1-a'})]
+        assert doc == {'_id': 'lot', 'revisionsCount': 2}
+        assert self.history.detach(doc) == []
+
+    def test_detach_latest(self):
+        doc = {'_id': 'lot', 'revisions': [{'rev': '6-a'}], 'revisionsCount': 7}
+        assert self.history.detach(doc) == [(7, {'rev': '6-a'})]
+        assert doc == {'_id': 'lot', 'revisionsCount': 7}
+
+    def test_add(self):
+        self.history.add(self.lot, {'author': 'broker', 'changes': []})
+        assert self.lot.revisions == [{'author': 'broker', 'changes': []}]
+        assert self.lot.revisionsCount == 3
+        lot = mock.MagicMock(revisions=[], revisionsCount=None)
+        self.history.add(lot, {'author': 'broker', 'changes': []})
+        assert lot.revisionsCount == 1
+
+    def test_commit(self):
+        self.history.commit(self.db, self.lot)
+        assert self.db.save.call_count == 0
+
+    def test_commit_snapshot(self):
+        self.history.snapshot_every = 2
+        self.lot.serialize.return_value = {'title': 'lot'}
+        self.history.commit(self.db, self.lot)
+        self.db.save.assert_called_once_with({
+            '_id': self.lot.id + '-s000002',
+            'doc_type': 'LotSnapshot',
+            'lot_id': self.lot.id,
+            'index': 2,
+            'data': {'title': 'lot'}
+        })
+        self.lot.serialize.assert_called_once_with('plain')
+
+    def test_commit_snapshot_failure(self):
+        self.history.snapshot_every = 2
+        self.db.save.side_effect = ServerError()
+        with mock.patch('openregistry.lots.core.history.LOGGER') as mocked_logger:
+            self.history.commit(self.db, self.lot)
+        assert mocked_logger.warning.call_count == 1
+
+    def test_migrate(self):
+        self.lot.__detached_revisions__ = [(1, {'rev': None}), (2, {'rev': '1-a'})]
+        self.db.update.return_value = [(True, 'x', '1-b'), (False, 'y', ResourceConflict())]
+        self.history.migrate(self.db, self.lot)
+        docs = self.db.update.call_args[0][0]
+        assert docs == [{
+            '_id': self.lot.id + '-r000001',
+            'doc_type': 'LotRevision',
+            'lot_id': self.lot.id,
+            'index': 1,
+            'revision': {'rev': None}
+        }, {
+            '_id': self.lot.id + '-r000002',
+            'doc_type': 'LotRevision',
+            'lot_id': self.lot.id,
+            'index': 2,
+            'revision': {'rev': '1-a'}
+        }]
+        assert self.lot.__detached_revisions__ == []
+
+    def test_migrate_failure(self):
+        self.lot.__detached_revisions__ = [(1, {'rev': None})]
+        self.db.update.return_value = [(False, 'x', ServerError())]
+        with self.assertRaises(ServerError):
+            self.history.migrate(self.db, self.lot)
+        assert self.lot.__detached_revisions__ == [(1, {'rev': None})]
+
+    def test_revisions(self):
+        self.db.view.return_value = [Row(id='lot-r000003', doc={'index': 3, 'revision': {'rev': None}})]
+        assert self.history.revisions(self.db, 'lot', start=3, stop=12) == [(3, {'rev': None})]
+        self.db.view.assert_called_once_with('_all_docs', startkey='lot-r000003', endkey='lot-r000012',
+                                             include_docs=True)
+
+
+class TestLotRevisions(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        # title set on creation, changed to 'b' and then to 'c'
+        self.revisions = [
+            {'changes': [{'op': 'remove', 'path': '/title'}]},
+            {'changes': [{'op': 'replace', 'path': '/title', 'value': 'a'}]},
+            {'changes': [{'op': 'replace', 'path': '/title', 'value': 'b'}]},
+        ]
+        self.doc = {'_id': 'lot', '_rev': '4-a', 'title': 'c', 'revisions': self.revisions}
+        self.history = mock.MagicMock()
+        # the latest revision is embedded in the lot, the others are history documents
+        self.history.revisions.side_effect = lambda db, lot_id, start, stop: [
+            (i, self.revisions[i - 1]) for i in range(start, stop + 1) if i <= 2
+        ]
+        self.history.snapshot.return_value = None
+        self.history_doc = dict(self.doc, revisions=self.revisions[2:], revisionsCount=3)
+
+    def test_embedded_slice(self):
+        assert lot_revisions(self.db, self.doc, skip=1, limit=1) == [(2, self.revisions[1])]
+        assert lot_revisions(self.db, self.doc, skip=2) == [(3, self.revisions[2])]
+
+    def test_history(self):
+        assert lot_revisions(self.db, self.history_doc, self.history) == list(enumerate(self.revisions, 1))
+        assert lot_revisions(self.db, self.history_doc, self.history, skip=1, limit=1) == [(2, self.revisions[1])]
+        self.history.revisions.assert_called_with(self.db, 'lot', start=2, stop=2)
+        assert lot_revisions(self.db, self.history_doc, self.history, skip=2, limit=5) == [(3, self.revisions[2])]
+        assert self.history.revisions.call_count == 2
+
+    def test_embedded_snapshot(self):
+        assert lot_snapshot(self.db, self.doc, 3) == {'_id': 'lot', 'title': 'c'}
+        assert lot_snapshot(self.db, self.doc, 2) == {'_id': 'lot', 'title': 'b'}
+        assert lot_snapshot(self.db, self.doc, 1) == {'_id': 'lot', 'title': 'a'}
+        assert lot_snapshot(self.db, self.doc, 4) is None
+        assert lot_snapshot(self.db, self.doc, 0) is None
+
+    def test_history_snapshot(self):
+        self.history.snapshot.return_value = {'index': 3, 'data': {'_id': 'lot', 'title': 'c', 'revisionsCount': 3}}
+        self.history.revisions.side_effect = lambda db, lot_id, start, stop: [
+            (i, self.revisions[i - 1]) for i in range(start, stop + 1)
+        ]
+        doc = dict(self.history_doc, revisions=[{'changes': [{'op': 'replace', 'path': '/title', 'value': 'c'}]}],
+                   revisionsCount=4, title='d')
+        assert lot_snapshot(self.db, doc, 2, self.history) == {'_id': 'lot', 'title': 'b'}
+        self.history.snapshot.assert_called_once_with(self.db, 'lot', 2)
+        self.history.revisions.assert_called_once_with(self.db, 'lot', start=2, stop=3)
+
+    def test_history_without_snapshot(self):
+        assert lot_snapshot(self.db, self.history_doc, 1, self.history) == {'_id': 'lot', 'title': 'a'}
+        self.history.revisions.assert_called_once_with(self.db, 'lot', start=1, stop=2)
+
+    def test_gap(self):
+        # the second revision document is missing
+        self.history.revisions.side_effect = lambda db, lot_id, start, stop: [(1, self.revisions[0])]
+        with mock.patch('openregistry.lots.core.history.LOGGER') as mocked_logger:
+            assert lot_snapshot(self.db, self.history_doc, 1, self.history) is None
+        assert mocked_logger.warning.call_count == 1
+        assert lot_snapshot(self.db, self.history_doc, 3, self.history) == {'_id': 'lot', 'title': 'c'}
+
+    def test_history_disabled(self):
+        # revisions moved to history documents can't be read without it
+        with mock.patch('openregistry.lots.core.history.LOGGER'):
+            assert lot_snapshot(self.db, self.history_doc, 1) is None
+        assert lot_revisions(self.db, self.history_doc) == [(3, self.revisions[2])]
+
+
+class TestLotHistoryFactory(unittest.TestCase):
+
+    def test_disabled(self):
+        assert lot_history_factory({}) is None
+        assert lot_history_factory({'separate': False}) is None
+        assert lot_history_factory({'separate': 'false'}) is None
+
+    def test_enabled(self):
+        assert isinstance(lot_history_factory({'separate': True}), LotHistory)
+        assert isinstance(lot_history_factory({'separate': 'true'}), LotHistory)
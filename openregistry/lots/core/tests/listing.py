@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import mock
+
+from couchdb.client import Row
+
+from openregistry.lots.core.design import LISTING_FIELDS
+from openregistry.lots.core.listing import ListingStream, iter_view_rows
+
+
+def view_rows(keys):
+    return [Row(id='lot{}'.format(i), key=key, value={'status': 'pending'}) for i, key in enumerate(keys)]
+
+
+class FakeView(object):
+    """ Ascending view over ``rows`` supporting startkey and startkey_docid """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def __call__(self, limit, startkey, startkey_docid=None, **kwargs):
+        self.calls.append(limit)
+        self.include_docs = kwargs.get('include_docs', False)
+        rows = [i for i in self.rows if (i.key, i.id) >= (startkey, startkey_docid or '')]
+        return rows[:limit]
+
+
+class TestIterViewRows(unittest.TestCase):
+
+    def setUp(self):
+        self.view = FakeView(view_rows([1, 2, 2, 2, 3, 4, 5]))
+
+    def test_batches(self):
+        rows = list(iter_view_rows(self.view, 0, 10, 2))
+        assert [i.id for i in rows] == ['lot{}'.format(i) for i in range(7)]
+        assert self.view.calls == [2, 3, 3, 3]
+
+    def test_limit(self):
+        rows = list(iter_view_rows(self.view, 2, 4, 3))
+        assert [i.id for i in rows] == ['lot1', 'lot2', 'lot3', 'lot4']
+        assert self.view.calls == [3, 2]
+
+
+class TestListingStream(unittest.TestCase):
+
+    def setUp(self):
+        self.view = FakeView(view_rows([u'2018-01-0{}'.format(i) for i in range(1, 6)]))
+        self.resource = mock.MagicMock()
+        self.resource.VIEW_MAP = {u'': mock.MagicMock()}
+        self.resource.FEED = {u'dateModified': self.resource.VIEW_MAP}
+        self.resource.FIELDS = sorted(LISTING_FIELDS)
+        self.resource.object_name_for_listing = 'Lots'
+        self.resource.update_after = True
+        self.request = self.resource.request
+        self.request.route_path.side_effect = lambda name, _query: '/lots?offset={}'.format(_query['offset'])
+        self.request.route_url.side_effect = lambda name, _query: 'http://localhost/lots'
+
+    def render(self, params):
+        self.request.params = params
+        stream = ListingStream(self.resource, batch_size=2)
+        stream.view = self.view
+        return json.loads(''.join(stream))
+
+    def test_first_page(self):
+        data = self.render({'limit': '3'})
+        assert data['data'] == [
+            {'id': 'lot0', 'dateModified': u'2018-01-01'},
+            {'id': 'lot1', 'dateModified': u'2018-01-02'},
+            {'id': 'lot2', 'dateModified': u'2018-01-03'},
+        ]
+        assert data['next_page']['offset'] == u'2018-01-03'
+        assert 'prev_page' not in data
+
+    def test_next_page(self):
+        data = self.render({'limit': '3', 'offset': u'2018-01-03', 'opt_fields': 'status'})
+        assert data['data'] == [
+            {'id': 'lot3', 'dateModified': u'2018-01-04', 'status': 'pending'},
+            {'id': 'lot4', 'dateModified': u'2018-01-05', 'status': 'pending'},
+        ]
+        assert data['next_page']['offset'] == u'2018-01-05'
+        assert data['prev_page']['offset'] == u'2018-01-03'
+
+    def test_empty_page(self):
+        data = self.render({'offset': u'2018-02-01'})
+        assert data['data'] == []
+        assert data['next_page']['offset'] == u'2018-02-01'
+
+    def test_view_values(self):
+        data = self.render({'limit': '2', 'opt_fields': 'status,id'})
+        assert data['data'] == [
+            {'id': 'lot0', 'dateModified': u'2018-01-01', 'status': 'pending'},
+            {'id': 'lot1', 'dateModified': u'2018-01-02', 'status': 'pending'},
+        ]
+        assert not self.view.include_docs
+        assert self.resource.serialize_func.call_count == 0
+
+    def test_documents(self):
+        self.view.rows = [Row(i, doc={'_id': i.id}) for i in self.view.rows]
+        self.resource.serialize_func.side_effect = lambda request, doc, fields: {'id': doc['_id']}
+        data = self.render({'limit': '1', 'opt_fields': 'status,title'})
+        assert data['data'] == [{'id': 'lot0'}]
+        assert self.view.include_docs
+        self.resource.serialize_func.assert_called_with(self.request, {'_id': 'lot0'},
+                                                        ['status', 'title', 'dateModified', 'id'])
+
+    def test_update_after(self):
+        self.request.params = {'descending': '1'}
+        ListingStream(self.resource).view(limit=1)
+        self.resource.VIEW_MAP[u''].assert_called_once_with(self.resource.db, descending=True,
+                                                            stale='update_after', limit=1)
+
+    def test_no_update_after(self):
+        self.request.params = {}
+        self.resource.update_after = False
+        ListingStream(self.resource).view(limit=1)
+        self.resource.VIEW_MAP[u''].assert_called_once_with(self.resource.db, descending=False, limit=1)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+import unittest
+import mock
+
+from couchdb.http import ResourceConflict
+from datetime import datetime, timedelta
+from pyramid.exceptions import ConfigurationError
+
+from openregistry.lots.core.benchmarks.fixtures import InMemoryDB
+from openregistry.lots.core.lot_id import (
+    BlockLotIDSequence,
+    CounterLotIDSequence,
+    LotIDGenerationError,
+    RetryPolicy,
+    SNOWFLAKE_MIN_INDEX,
+    SnowflakeLotIDSequence,
+    update_counter_doc,
+    reserve_lot_index,
+    release_lot_indices,
+    lot_id_sequence_factory
+)
+from openregistry.lots.core.metrics import Metrics
+
+
+class TestReserveLotIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.key = '2018-01-01'
+
+    def test_reserve_block(self):
+        self.db.get.side_effect = iter([{self.key: 5}])
+        assert reserve_lot_index(self.db, 'lotID', self.key, 50) == 5
+        self.db.save.assert_called_with({self.key: 55})
+
+    def test_release_last_block(self):
+        self.db.get.side_effect = iter([{self.key: 55}])
+        release_lot_indices(self.db, 'lotID', self.key, 10, 55)
+        self.db.save.assert_called_with({self.key: 10})
+
+    def test_release_block_with_gap(self):
+        self.db.get.side_effect = iter([{self.key: 105}])
+        release_lot_indices(self.db, 'lotID', self.key, 10, 55)
+        self.db.save.assert_called_with({self.key: 105, 'gaps': {self.key: [[10, 55]]}})
+
+
+@mock.patch('openregistry.lots.core.lot_id.sleep', autospec=True)
+class TestUpdateCounterDoc(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.policy = RetryPolicy(max_attempts=3, base_delay=0.1, max_delay=0.3)
+
+    def test_retries_with_backoff(self, mocked_sleep):
+        self.db.get.side_effect = iter([{}, {}, {}])
+        self.db.save.side_effect = iter([ResourceConflict, Exception, None])
+        assert update_counter_doc(self.db, 'lotID', lambda doc: 'result', self.policy) == 'result'
+        assert mocked_sleep.call_count == 2
+        assert 0.05 <= mocked_sleep.call_args_list[0][0][0] <= 0.1
+        assert 0.1 <= mocked_sleep.call_args_list[1][0][0] <= 0.2
+        assert self.policy.stats == {'calls': 1, 'conflicts': 1, 'errors': 1, 'retries': 2, 'failures': 0}
+
+    def test_gives_up_after_max_attempts(self, mocked_sleep):
+        self.db.get.side_effect = Exception
+        with self.assertRaises(LotIDGenerationError):
+            update_counter_doc(self.db, 'lotID', lambda doc: None, self.policy)
+        assert self.db.get.call_count == 3
+        assert mocked_sleep.call_count == 2
+        assert self.policy.stats['failures'] == 1
+
+    def test_gives_up_after_deadline(self, mocked_sleep):
+        self.policy.deadline = 0
+        self.db.save.side_effect = ResourceConflict
+        with self.assertRaises(LotIDGenerationError):
+            update_counter_doc(self.db, 'lotID', lambda doc: None, self.policy)
+        assert self.db.save.call_count == 1
+        assert mocked_sleep.call_count == 0
+
+    @mock.patch('openregistry.lots.core.lot_id.LOGGER', autospec=True)
+    def test_metrics(self, mocked_logger, mocked_sleep):
+        self.policy.metrics = Metrics()
+        self.db.save.side_effect = iter([ResourceConflict, None, ResourceConflict, Exception, Exception])
+        update_counter_doc(self.db, 'lotID', lambda doc: None, self.policy)
+        with self.assertRaises(LotIDGenerationError):
+            update_counter_doc(self.db, 'lotID', lambda doc: None, self.policy)
+        assert dict((name, metric.value) for name, _, metric in self.policy.metrics.collect()) == {
+            'lot_id_counter_calls_total': 2,
+            'lot_id_counter_conflicts_total': 2,
+            'lot_id_counter_errors_total': 2,
+            'lot_id_counter_retries_total': 3,
+            'lot_id_counter_failures_total': 1,
+        }
+
+
+class TestBlockLotIDSequence(unittest.TestCase):
+
+    def setUp(self):
+        self.ctime = datetime(2018, 1, 1, 12)
+        self.key = self.ctime.date().isoformat()
+        self.counter = {}
+        self.db = mock.MagicMock()
+        self.db.get.side_effect = lambda doc_id, default: dict(self.counter)
+        self.db.save.side_effect = self.counter.update
+        self.sequence = BlockLotIDSequence(block_size=3)
+
+    def test_one_write_per_block(self):
+        indices = [self.sequence.next_index(self.db, 'lotID', self.ctime) for _ in range(7)]
+        assert indices == range(1, 8)
+        assert self.db.save.call_count == 3
+        assert self.counter[self.key] == 10
+
+    def test_release_unused_indices(self):
+        self.sequence.next_index(self.db, 'lotID', self.ctime)
+        self.sequence.release()
+        assert self.counter[self.key] == 2
+        assert self.sequence.blocks == {}
+
+    def test_day_change_releases_previous_block(self):
+        self.sequence.next_index(self.db, 'lotID', self.ctime)
+        next_day = self.ctime + timedelta(days=1)
+        assert self.sequence.next_index(self.db, 'lotID', next_day) == 1
+        assert self.counter[self.key] == 2
+        assert self.sequence.blocks.keys() == [('lotID', next_day.date().isoformat())]
+
+
+class TestSnowflakeLotIDSequence(unittest.TestCase):
+
+    def setUp(self):
+        self.ctime = datetime(2018, 1, 1, 12)
+        self.db = mock.MagicMock(wraps=InMemoryDB())
+        self.sequence = SnowflakeLotIDSequence()
+
+    def index(self, ctime=None, sequence=None):
+        return (sequence or self.sequence).next_index(self.db, 'lotID', ctime or self.ctime)
+
+    def doc(self, worker_id=0):
+        return self.db.get('lotID_snowflake_{}'.format(worker_id))
+
+    def test_index_layout(self):
+        index = self.index()
+        assert index >= SNOWFLAKE_MIN_INDEX
+        assert index <= 999999
+        assert (index - SNOWFLAKE_MIN_INDEX) & 0b1111 == 0
+        # the first lotID of a process skips the current tick
+        assert (index - SNOWFLAKE_MIN_INDEX) >> 4 == 2 + (31250 - 1) / 2
+
+    def test_time_ordered_and_unique(self):
+        indices = [self.index() for _ in range(3)]
+        indices.append(self.index(self.ctime + timedelta(hours=1)))
+        assert indices == sorted(set(indices))
+
+    def test_processes_do_not_collide(self):
+        settings = {'mode': 'snowflake', 'worker_bits': '2'}
+        with mock.patch('openregistry.lots.core.lot_id.atexit'):
+            sequences = [lot_id_sequence_factory(settings) for _ in range(4)]
+        indices = [self.index(sequence=sequence) for sequence in sequences for _ in range(3)]
+        assert len(set(indices)) == 12
+        assert sorted(i['worker_id'] for sequence in sequences for i in sequence.slots.values()) == range(4)
+
+    def test_all_worker_ids_taken(self):
+        for _ in range(2):
+            self.index(sequence=SnowflakeLotIDSequence(worker_bits=1))
+        with self.assertRaises(ConfigurationError):
+            self.index(sequence=SnowflakeLotIDSequence(worker_bits=1))
+
+    @mock.patch('openregistry.lots.core.lot_id.time')
+    def test_expired_lease_taken_over(self, mocked_time):
+        mocked_time.return_value = 1000.0
+        before = [self.index() for _ in range(3)]
+        mocked_time.return_value = 1000.0 + 601
+        other = SnowflakeLotIDSequence()
+        after = [self.index(sequence=other) for _ in range(3)]
+        assert other.slots['lotID']['worker_id'] == 0
+        # borrowed ticks of the previous owner are not issued again
+        assert min(after) > max(before)
+        # the previous owner claims another worker id
+        assert (self.index() - SNOWFLAKE_MIN_INDEX) & 0b1111 == 1
+
+    @mock.patch('openregistry.lots.core.lot_id.time')
+    def test_lease_renewed(self, mocked_time):
+        mocked_time.return_value = 1000.0
+        self.index()
+        mocked_time.return_value = 1000.0 + 400
+        self.index()
+        assert self.doc()['lease']['expires'] == 1000.0 + 400 + 600
+        mocked_time.return_value = 1000.0 + 601
+        self.index(sequence=SnowflakeLotIDSequence())
+        assert self.doc(1)['lease']['owner'] != self.doc()['lease']['owner']
+
+    def test_lost_lease_not_marked(self):
+        self.index()
+        lease = self.doc()
+        lease['lease']['owner'] = 'other'
+        self.db.save(lease)
+        self.sequence.slots['lotID']['mark'] = 0
+        with self.assertRaises(LotIDGenerationError):
+            self.index()
+        assert (self.index() - SNOWFLAKE_MIN_INDEX) & 0b1111 == 1
+
+    def test_release(self):
+        self.index()
+        self.sequence.release()
+        assert 'lease' not in self.doc()
+        assert self.sequence.slots == {}
+        self.index(sequence=SnowflakeLotIDSequence())
+        assert self.db.get('lotID_snowflake_1') is None
+
+    def test_day_exhausted(self):
+        ctime = datetime(2018, 1, 1, 23, 59, 59, 999999)
+        with self.assertRaises(LotIDGenerationError):
+            self.index(ctime)
+
+    def test_new_day_restarts_ticks(self):
+        self.index(datetime(2018, 1, 1, 23, 59))
+        assert self.index(datetime(2018, 1, 2)) == SNOWFLAKE_MIN_INDEX + (1 << 4 | 0)
+
+    def test_borrowed_ticks_marked(self):
+        indices = [self.index() for _ in range(3)]
+        # the lease and the first borrowed tick
+        assert self.db.save.call_count == 2
+        mark = self.doc()['2018-01-01']
+        assert mark == ((indices[0] - SNOWFLAKE_MIN_INDEX) >> 4) + 64
+
+    def test_restart_continues_after_mark(self):
+        before = [self.index() for _ in range(3)]
+        self.sequence.release()
+        restarted = SnowflakeLotIDSequence()
+        after = [self.index(sequence=restarted) for _ in range(3)]
+        assert not set(before) & set(after)
+        assert min(after) > max(before)
+
+    def test_mark_of_past_days_dropped(self):
+        self.db.save({'_id': 'lotID_snowflake_0', '2017-12-31': 100})
+        self.index()
+        self.index()
+        assert sorted(self.doc()) == ['2018-01-01', '_id', '_rev', 'lease']
+
+    def test_max_index_range(self):
+        with self.assertRaises(ValueError):
+            SnowflakeLotIDSequence(max_index=SNOWFLAKE_MIN_INDEX)
+        with self.assertRaises(ValueError):
+            SnowflakeLotIDSequence(max_index=1000000)
+
+
+class TestLotIDIndexPartition(unittest.TestCase):
+
+    def setUp(self):
+        self.key = '2018-01-01'
+        self.db = mock.MagicMock()
+
+    def test_counter_stops_below_snowflake(self):
+        self.db.get.side_effect = iter([{self.key: SNOWFLAKE_MIN_INDEX - 1}, {self.key: SNOWFLAKE_MIN_INDEX}])
+        assert reserve_lot_index(self.db, 'lotID', self.key) == SNOWFLAKE_MIN_INDEX - 1
+        with self.assertRaises(LotIDGenerationError):
+            reserve_lot_index(self.db, 'lotID', self.key)
+        assert self.db.save.call_count == 1
+
+    def test_block_stops_below_snowflake(self):
+        self.db.get.side_effect = iter([{self.key: SNOWFLAKE_MIN_INDEX - 10}])
+        with self.assertRaises(LotIDGenerationError):
+            BlockLotIDSequence(block_size=50).next_index(self.db, 'lotID', datetime(2018, 1, 1))
+        assert self.db.get.call_count == 1
+        assert self.db.save.call_count == 0
+
+    def test_mixed_modes_do_not_collide(self):
+        counter = {}
+        self.db.get.side_effect = lambda doc_id, default: dict(counter.get(doc_id, default))
+        self.db.save.side_effect = lambda doc: counter.__setitem__(doc['_id'], dict(doc))
+        ctime = datetime(2018, 1, 1)
+        indices = [CounterLotIDSequence().next_index(self.db, 'lotID', ctime) for _ in range(3)]
+        indices += SnowflakeLotIDSequence().next_indices(self.db, 'lotID', ctime, 3)
+        indices += BlockLotIDSequence(block_size=5).next_indices(self.db, 'lotID', ctime, 3)
+        assert len(set(indices)) == 9
+
+
+class TestLotIDSequenceFactory(unittest.TestCase):
+
+    def test_counter_mode(self):
+        metrics = Metrics()
+        sequence = lot_id_sequence_factory({'retry': {'max_attempts': '5'}}, metrics)
+        assert isinstance(sequence, CounterLotIDSequence)
+        assert sequence.retry_policy.max_attempts == 5
+        assert sequence.retry_policy.metrics is metrics
+
+    @mock.patch('openregistry.lots.core.lot_id.atexit', autospec=True)
+    def test_block_mode(self, mocked_atexit):
+        sequence = lot_id_sequence_factory({'mode': 'block', 'block_size': '20'})
+        assert sequence.block_size == 20
+        mocked_atexit.register.assert_called_with(sequence.release)
+
+    @mock.patch('openregistry.lots.core.lot_id.atexit', autospec=True)
+    def test_snowflake_mode(self, mocked_atexit):
+        sequence = lot_id_sequence_factory({'mode': 'snowflake', 'worker_bits': 3, 'lease_ttl': '60'})
+        assert sequence.ticks == 62500
+        assert sequence.lease_ttl == 60
+        mocked_atexit.register.assert_called_with(sequence.release)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            lot_id_sequence_factory({'mode': 'unknown'})
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from openregistry.lots.core.metrics import Metrics, Histogram, render_prometheus
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        assert histogram.cumulative() == [(0.1, 2), (1, 3), ('+Inf', 4)]
+        assert histogram.count == 4
+        assert histogram.sum == 3.65
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_labels(self):
+        self.metrics.counter('errors', operation='get').inc()
+        self.metrics.counter('errors', operation='get').inc(2)
+        self.metrics.counter('errors', operation='save').inc()
+        assert [(name, labels, metric.value) for name, labels, metric in self.metrics.collect()] == [
+            ('errors', {'operation': 'get'}, 3),
+            ('errors', {'operation': 'save'}, 1),
+        ]
+
+    def test_gauge(self):
+        self.metrics.gauge('lag', view='a').set(5)
+        self.metrics.gauge('lag', view='a').set(2)
+        assert self.metrics.gauge('lag', view='a').value == 2
+
+    def test_timer(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('seconds', operation='get'):
+                raise ValueError
+        assert self.metrics.histogram('seconds', operation='get').count == 1
+
+
+class TestRenderPrometheus(unittest.TestCase):
+
+    def test_render(self):
+        metrics = Metrics()
+        metrics.counter('couchdb_errors_total', operation='get', error='Conflict "a"').inc()
+        metrics.gauge('lots_view_index_lag', view='lots/by_dateModified').set(3)
+        histogram = metrics.histogram('lot_stage_seconds', stage='store')
+        histogram.buckets, histogram.counts = (0.1, ), [0, 0]
+        histogram.observe(0.5)
+        assert render_prometheus(metrics).splitlines() == [
+            '# TYPE couchdb_errors_total counter',
+            'couchdb_errors_total{error="Conflict \\"a\\"",operation="get"} 1',
+            '# TYPE lot_stage_seconds histogram',
+            'lot_stage_seconds_bucket{le="0.1",stage="store"} 0',
+            'lot_stage_seconds_bucket{le="+Inf",stage="store"} 1',
+            'lot_stage_seconds_sum{stage="store"} 0.5',
+            'lot_stage_seconds_count{stage="store"} 1',
+            '# TYPE lots_view_index_lag gauge',
+            'lots_view_index_lag{view="lots/by_dateModified"} 3',
+        ]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from openregistry.lots.core.profiling import (
+    LotsProfiler,
+    is_lots_path,
+    lots_profiler_factory,
+    profiling_tween_factory
+)
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def handler(request):
+    fib(12)
+    return mock.MagicMock(headers={})
+
+
+class DummyRequest(object):
+
+    def __init__(self, headers=None, role='broker'):
+        self.path = '/api/2.4/lots/{}'.format('a' * 32)
+        self.headers = headers or {}
+        self.authenticated_role = role
+        self.matched_route = mock.MagicMock()
+        self.matched_route.name = 'Lot'
+        self.matchdict = {'lot_id': 'a' * 32}
+        self.validated = {'lot': mock.MagicMock(lotType='loki')}
+
+
+class TestLotsProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = LotsProfiler(os.path.join(self.directory, 'profiles'), keep=2, collapsed=True)
+        self.registry = mock.MagicMock(lots_profiler=self.profiler)
+        self.tween = profiling_tween_factory(handler, self.registry)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self):
+        return sorted(os.listdir(self.profiler.directory))
+
+    def test_lots_path(self):
+        assert is_lots_path('/api/2.4/lots/lot_id')
+        assert not is_lots_path('/api/2.4/assets')
+
+    def test_wanted(self):
+        assert self.profiler.wanted(DummyRequest({'X-Lots-Profile': '1'}, 'Administrator'))
+        assert not self.profiler.wanted(DummyRequest({'X-Lots-Profile': '1'}))
+        assert not self.profiler.wanted(DummyRequest())
+        self.profiler.sample_rate = 1.0
+        assert self.profiler.wanted(DummyRequest())
+
+    def test_profile(self):
+        response = self.tween(DummyRequest({'X-Lots-Profile': '1'}, 'Administrator'))
+        name = response.headers['X-Lots-Profile-File']
+        assert name.endswith('.pstats')
+        assert '-Lot-loki-{}-'.format('a' * 32) in name
+        assert name in self.files()
+        with open(os.path.join(self.profiler.directory, name[:-len('.pstats')] + '.collapsed')) as collapsed:
+            lines = collapsed.read().splitlines()
+        assert any(['profiling.py:20:handler;profiling.py:16:fib' in i for i in lines])
+
+    def test_not_profiled(self):
+        response = self.tween(DummyRequest())
+        assert 'X-Lots-Profile-File' not in response.headers
+        assert not os.path.exists(self.profiler.directory)
+
+    def test_ring(self):
+        for _ in range(3):
+            self.tween(DummyRequest({'X-Lots-Profile': '1'}, 'Administrator'))
+        assert len(self.files()) == 4
+        assert len([i for i in self.files() if i.endswith('.pstats')]) == 2
+
+    def test_factory(self):
+        assert lots_profiler_factory({}) is None
+        profiler = lots_profiler_factory({'directory': '/tmp/profiles', 'sample_rate': '0.01'})
+        assert profiler.sample_rate == 0.01
+        assert profiler.keep == 20
+        assert not profiler.collapsed
+        assert not lots_profiler_factory({'directory': '/tmp/profiles', 'collapsed': 'false'}).collapsed
+        assert lots_profiler_factory({'directory': '/tmp/profiles', 'collapsed': 'true'}).collapsed
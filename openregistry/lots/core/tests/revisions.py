@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import unittest
+import mock
+
+from cornice.errors import Errors
+
+from openregistry.lots.core.models import Lot
+from openregistry.lots.core.views.revisions import LotRevisionSnapshotResource
+
+LOT_ID = 'a' * 32
+
+
+@mock.patch('openregistry.lots.core.views.revisions.get_lot_docs')
+class TestLotRevisionSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = {
+            '_id': LOT_ID,
+            '_rev': '3-a',
+            'doc_type': 'Lot',
+            'title': u'Лот',
+            'owner': 'broker',
+            'owner_token': 'b' * 32,
+            'transfer_token': 'c' * 32,
+            'revisions': [
+                {'author': 'broker', 'changes': [{'op': 'remove', 'path': '/title'}]},
+                {'author': 'broker', 'changes': [{'op': 'replace', 'path': '/title', 'value': u'Лот 1'}]},
+            ],
+        }
+        self.request = mock.MagicMock(validated={'lot_id': LOT_ID}, errors=Errors())
+        self.request.registry.lot_history = None
+        self.request.lot_from_data.side_effect = lambda data, raise_error: Lot(data)
+        self.resource = LotRevisionSnapshotResource(self.request, mock.MagicMock())
+
+    def test_snapshot(self, mocked_get_lot_docs):
+        mocked_get_lot_docs.return_value = {LOT_ID: self.doc}
+        self.request.matchdict = {'revision_index': '1'}
+        data = self.resource.get()['data']
+        assert data['title'] == u'Лот 1'
+        assert data['owner'] == 'broker'
+        for name in ('owner_token', 'transfer_token', 'revisions'):
+            assert name not in data
+
+    def test_not_found(self, mocked_get_lot_docs):
+        mocked_get_lot_docs.return_value = {LOT_ID: self.doc}
+        for index in ('3', 'last'):
+            self.request.matchdict = {'revision_index': index}
+            assert self.resource.get() is None
+            assert self.request.errors.status == 404
+        assert self.request.lot_from_data.call_count == 0
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(TestLotRevisionSnapshot))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
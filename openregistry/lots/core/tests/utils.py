@@ -2,26 +2,41 @@
 import unittest
 import mock
 
-from couchdb.http import ResourceConflict
+from couchdb.client import Row
+from couchdb.http import ResourceConflict, ServerError
 from datetime import datetime, timedelta
 from schematics.exceptions import ModelValidationError
+from schematics.transforms import to_primitive as schematics_to_primitive
 
 from openregistry.lots.core.utils import (
     get_now,
     generate_lot_id,
+    generate_lot_ids,
     extract_lot,
     extract_lot_adapter,
+    get_lot_docs,
     lot_from_data,
     register_lotType,
     apply_patch,
     lot_serialize,
+    serialize_lot,
     save_lot,
     SubscribersPicker,
     isLot,
     store_lot,
-    get_lot_types
+    store_lots,
+    get_lot_types,
+    get_lot_changes,
+    lot_internal_type,
+    LotTypeIndex,
+    lot_stage,
+    lot_stage_timings,
+    observe_lot_stages
 )
-from openregistry.lots.core.models import Lot
+from openregistry.lots.core.cache import LotDocumentCache
+from openregistry.lots.core.history import LotHistory
+from openregistry.lots.core.metrics import Metrics
+from openregistry.lots.core.models import Lot, LazyModelList
 from openregistry.lots.core.tests.base import DummyException
 
 now = get_now()
@@ -97,6 +112,31 @@ class TestGenerateLotID(unittest.TestCase):
         assert self.db.save.call_count == 1
         self.db.save.assert_called_with(mocked_lotID)
 
+    def test_generation_with_sequence(self):
+        index = 7
+        sequence = mock.MagicMock()
+        sequence.next_index.side_effect = iter([index])
+        lot_id = 'UA-LR-DGF-{:04}-{:02}-{:02}-{:06}{}'.format(
+                                                self.ctime.year,
+                                                self.ctime.month,
+                                                self.ctime.day,
+                                                index,
+                                                '-' + self.server_id
+                                            )
+
+        returned_lot_id = generate_lot_id(self.ctime, self.db, self.server_id, sequence)
+        assert lot_id == returned_lot_id
+        sequence.next_index.assert_called_with(self.db, 'lotID_' + self.server_id, self.ctime)
+        assert self.db.get.call_count == 0
+        assert self.db.save.call_count == 0
+
+    def test_generation_of_many(self):
+        self.db.get.side_effect = iter([{self.mocked_key: 5}])
+        lot_ids = generate_lot_ids(self.ctime, self.db, 3, self.server_id)
+        assert [int(i.split('-')[-2]) for i in lot_ids] == [5, 6, 7]
+        assert self.db.save.call_count == 1
+        self.db.save.assert_called_with({self.mocked_key: 8})
+
     def test_while_loop(self):
         self.db.get.side_effect = iter([{}, {}, {}])
         self.db.save.side_effect = iter([DummyException, ResourceConflict, None])
@@ -105,6 +145,37 @@ class TestGenerateLotID(unittest.TestCase):
         assert self.db.save.call_count == 3
 
 
+@mock.patch('openregistry.lots.core.utils.lot_stored', autospec=True)
+@mock.patch('openregistry.lots.core.utils.prepare_lot_store', autospec=True)
+class TestStoreLots(unittest.TestCase):
+
+    def setUp(self):
+        self.mocked_request = mock.MagicMock()
+        self.lots = [mock.MagicMock(), mock.MagicMock(), mock.MagicMock()]
+        for index, lot in enumerate(self.lots):
+            lot.to_primitive.return_value = {'_id': str(index)}
+        self.lots[1].validate.side_effect = ModelValidationError({'title': 'required'})
+
+    def test_store(self, mocked_prepare, mocked_stored):
+        self.mocked_request.registry.db.update.return_value = [
+            (True, '0', '1-a'), (False, '2', ResourceConflict('conflict'))
+        ]
+        errors = store_lots([(lot, 'patch') for lot in self.lots], self.mocked_request)
+        self.mocked_request.registry.db.update.assert_called_once_with([{'_id': '0'}, {'_id': '2'}])
+        assert errors[0] is None
+        assert errors[1]['code'] == 422
+        assert errors[1]['errors'] == [{'location': 'body', 'name': 'title', 'description': 'required'}]
+        assert errors[2]['code'] == 409
+        assert self.lots[0]._rev == '1-a'
+        assert mocked_prepare.call_count == 3
+        assert mocked_stored.call_count == 1
+
+    def test_nothing_valid(self, mocked_prepare, mocked_stored):
+        errors = store_lots([(self.lots[1], 'patch')], self.mocked_request)
+        assert errors[0]['code'] == 422
+        assert self.mocked_request.registry.db.update.call_count == 0
+
+
 @mock.patch('openregistry.lots.core.utils.decode_path_info', autospec=True)
 @mock.patch('openregistry.lots.core.utils.extract_lot_adapter', autospec=True)
 class TestExtractLot(unittest.TestCase):
@@ -170,6 +241,7 @@ class TestExtractLotAdapter(unittest.TestCase):
 
         self.mocked_request.registry.db.get = mock.MagicMock()
         self.db = self.mocked_request.registry.db
+        self.mocked_request.registry.lot_doc_cache = None
 
     def test_when_db_return_none(self, mocked_handler):
         doc = None
@@ -228,6 +300,81 @@ class TestExtractLotAdapter(unittest.TestCase):
         assert self.mocked_request.lot_from_data.call_count == 1
         self.mocked_request.lot_from_data.assert_called_with(doc)
 
+    def test_get_from_cache(self, mocked_handler):
+        doc = {'_id': self.lot_id, '_rev': '1-a', 'doc_type': 'Lot'}
+        cache = self.mocked_request.registry.lot_doc_cache = mock.MagicMock()
+        cache.get.side_effect = iter([doc])
+        self.mocked_request.method = 'GET'
+        self.mocked_request.lot_from_data.side_effect = iter(['lotFromData'])
+
+        assert extract_lot_adapter(self.mocked_request, self.lot_id) == 'lotFromData'
+        cache.get.assert_called_with(self.lot_id)
+        assert self.db.get.call_count == 0
+        self.mocked_request.lot_from_data.assert_called_with(doc)
+
+    def test_cache_miss_stores_doc(self, mocked_handler):
+        doc = {'_id': self.lot_id, '_rev': '1-a', 'doc_type': 'Lot'}
+        cache = self.mocked_request.registry.lot_doc_cache = mock.MagicMock()
+        cache.get.side_effect = iter([None])
+        self.db.get.side_effect = iter([doc])
+        self.mocked_request.method = 'GET'
+
+        extract_lot_adapter(self.mocked_request, self.lot_id)
+        assert self.db.get.call_count == 1
+        cache.set.assert_called_with(doc, cache.generation.return_value)
+
+    def test_cache_miss_invalidated_during_read(self, mocked_handler):
+        doc = {'_id': self.lot_id, '_rev': '1-a', 'doc_type': 'Lot'}
+        cache = self.mocked_request.registry.lot_doc_cache = LotDocumentCache()
+
+        def get(lot_id):
+            # the feed reports the next revision before the read returns
+            cache.invalidate(lot_id, '2-b')
+            return doc
+        self.db.get.side_effect = get
+        self.mocked_request.method = 'GET'
+
+        extract_lot_adapter(self.mocked_request, self.lot_id)
+        assert cache.get(self.lot_id) is None
+
+    def test_cache_not_used_for_writes(self, mocked_handler):
+        doc = {'_id': self.lot_id, '_rev': '1-a', 'doc_type': 'Lot'}
+        cache = self.mocked_request.registry.lot_doc_cache = mock.MagicMock()
+        self.db.get.side_effect = iter([doc])
+        self.mocked_request.method = 'PATCH'
+
+        extract_lot_adapter(self.mocked_request, self.lot_id)
+        assert self.db.get.call_count == 1
+        assert cache.get.call_count == 0
+        assert cache.set.call_count == 0
+
+
+class TestGetLotDocs(unittest.TestCase):
+
+    def setUp(self):
+        self.mocked_request = mock.MagicMock()
+        self.mocked_request.registry.lot_doc_cache = None
+        self.db = self.mocked_request.registry.db
+        self.db.view.return_value = [
+            Row(id='1', key='1', doc={'_id': '1', 'doc_type': 'Lot'}),
+            Row(id='2', key='2', doc={'_id': '2', 'doc_type': 'Asset'}),
+            Row(key='3', error='not_found'),
+        ]
+
+    def test_lots_only(self):
+        docs = get_lot_docs(self.mocked_request, ['1', '2', '3'])
+        assert docs == {'1': {'_id': '1', 'doc_type': 'Lot'}}
+        self.db.view.assert_called_once_with('_all_docs', keys=mock.ANY, include_docs=True)
+        assert sorted(self.db.view.call_args[1]['keys']) == ['1', '2', '3']
+
+    def test_cached(self):
+        cache = self.mocked_request.registry.lot_doc_cache = mock.MagicMock()
+        cache.get.side_effect = lambda lot_id: {'_id': lot_id, 'doc_type': 'Lot'} if lot_id == '3' else None
+        docs = get_lot_docs(self.mocked_request, ['1', '3'])
+        assert sorted(docs) == ['1', '3']
+        self.db.view.assert_called_once_with('_all_docs', keys=['1'], include_docs=True)
+        cache.set.assert_called_once_with({'_id': '1', 'doc_type': 'Lot'}, cache.generation.return_value)
+
 
 @mock.patch('openregistry.lots.core.utils.update_logging_context', autospec=True)
 @mock.patch('openregistry.lots.core.utils.error_handler', autospec=True)
@@ -236,13 +383,15 @@ class TestLotFromData(unittest.TestCase):
     def setUp(self):
         self.mocked_request = mock.MagicMock(
             registry=mock.MagicMock(
-                lotTypes={}
+                lotTypes={},
+                lot_history=None
             ),
             errors=mock.MagicMock(add=mock.MagicMock(), status=None)
         )
         self.mocked_request.errors.status = None
         self. mocked_model = mock.MagicMock()
         self.mocked_request.registry.lotTypes['someLotType'] = self.mocked_model
+        self.mocked_request.registry.lot_type_index = LotTypeIndex(self.mocked_request.registry.lotTypes, {})
 
     def test_with_create_true(self, mocked_handler, mocked_update_logging):
         data = {'lotType': 'someLotType'}
@@ -295,6 +444,14 @@ class TestLotFromData(unittest.TestCase):
         self.mocked_request.errors.add.assert_called_with('body', 'lotType', 'Not implemented')
         assert self.mocked_request.errors.status == 415
 
+    def test_default_lotType(self, mocked_handler, mocked_update_logging):
+        self.mocked_request.registry.lot_type_index = LotTypeIndex(
+            self.mocked_request.registry.lotTypes, {'someLotType': 'basic'}
+        )
+        self.mocked_model.side_effect = iter(['model'])
+        assert lot_from_data(self.mocked_request, {}) == 'model'
+        mocked_update_logging.assert_called_with(self.mocked_request, {'lot_type': 'someLotType'})
+
     def test_with_wrong_lotType_and_raise_false(self, mocked_handler, mocked_update_logging):
         data = {'lotType': 'wrongLotType'}
         self.mocked_model.side_effect = iter(['model'])
@@ -328,6 +485,30 @@ class TestRegisterLotType(unittest.TestCase):
         register_lotType(self.mocked_config, self.mocked_model, 'lotType')
         assert self.mocked_config.registry.lotTypes.keys()[0] == self.mocked_model.lotType.default
         assert self.mocked_config.registry.lotTypes[self.mocked_model.lotType.default] == self.mocked_model
+        self.mocked_model.compile_roles.assert_called_once_with()
+        index = self.mocked_config.registry.lot_type_index
+        assert index.models == {'lotType': self.mocked_model}
+
+    def test_lot_type_index(self):
+        index = LotTypeIndex({'a': 'A', 'b': 'B', 'c': 'C'}, {'a': 'basic', 'b': 'loki', 'c': 'loki'})
+        assert index.default_type == 'a'
+        assert sorted(index.lot_types['loki']) == ['b', 'c']
+        assert index.internal_types['b'] == 'loki'
+        assert LotTypeIndex({}, {}).default_type == 'basic'
+
+    def test_compiled_roles(self):
+        class PluginLot(Lot):
+            pass
+
+        register_lotType(self.mocked_config, PluginLot, 'pluginLot')
+        assert 'plain' in PluginLot.__dict__['_role_serializers']
+        lot = PluginLot({
+            'title': u'title', 'status': u'pending', 'lotCustodian': {'name': u'custodian'},
+            'assets': ['a' * 32], 'documents': [{'title': u'document'}], 'revisions': [{'author': u'broker'}],
+            'owner': u'broker', 'owner_token': u'token'
+        })
+        for role in PluginLot._options.roles:
+            assert lot.serialize(role) == schematics_to_primitive(PluginLot, lot, role=role), role
 
 
 @mock.patch('openregistry.lots.core.utils.save_lot', autospec=True)
@@ -462,6 +643,7 @@ class TestLotSerialize(unittest.TestCase):
         self.mocked_request = mock.MagicMock(
             lot_from_data=mock.MagicMock()
         )
+        self.mocked_request.registry.lot_serialization_cache = None
         self.mocked_lot = mock.MagicMock(
             serialize=mock.MagicMock()
         )
@@ -512,6 +694,113 @@ class TestLotSerialize(unittest.TestCase):
         self.mocked_lot.serialize.assert_called_with(self.mocked_lot.status)
 
 
+class TestSerializeLot(unittest.TestCase):
+
+    def setUp(self):
+        self.mocked_request = mock.MagicMock(errors=[], application_url='http://localhost')
+        self.cache = self.mocked_request.registry.lot_serialization_cache = mock.MagicMock()
+        self.lot = mock.MagicMock(id='lot_id', rev='1-a', cacheable_serialization=True)
+        self.lot.serialize.side_effect = iter(['serialized'])
+        self.key = ('lot_id', '1-a', 'role', 'http://localhost')
+
+    def test_cache_hit(self):
+        self.cache.get.side_effect = iter(['cached'])
+        assert serialize_lot(self.mocked_request, self.lot, 'role') == 'cached'
+        self.cache.get.assert_called_with(self.key)
+        assert self.lot.serialize.call_count == 0
+
+    def test_cache_miss(self):
+        self.cache.get.side_effect = iter([None])
+        assert serialize_lot(self.mocked_request, self.lot, 'role') == 'serialized'
+        self.lot.serialize.assert_called_with('role')
+        self.cache.set.assert_called_with(self.key, 'serialized')
+
+    def test_not_stored_lot(self):
+        self.lot.rev = None
+        assert serialize_lot(self.mocked_request, self.lot, 'role') == 'serialized'
+        assert self.cache.get.call_count == 0
+        assert self.cache.set.call_count == 0
+
+    def test_not_cacheable_type(self):
+        self.lot.cacheable_serialization = False
+        assert serialize_lot(self.mocked_request, self.lot, 'role') == 'serialized'
+        assert self.cache.get.call_count == 0
+        assert self.cache.set.call_count == 0
+        assert Lot.cacheable_serialization is False
+
+    def test_request_with_errors(self):
+        self.mocked_request.errors = ['error']
+        assert serialize_lot(self.mocked_request, self.lot, 'role') == 'serialized'
+        assert self.cache.get.call_count == 0
+        assert self.cache.set.call_count == 0
+
+
+class TestLazyDocuments(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            'title': u'title', 'lotCustodian': {'name': u'custodian'}, 'assets': ['a' * 32],
+            'documents': [{'title': u'first'}, {'title': u'second'}]
+        }
+        self.lot = Lot(self.data)
+        self.documents = self.lot._data['documents']
+
+    def test_not_hydrated(self):
+        assert isinstance(self.documents, LazyModelList)
+        assert len(self.lot.documents) == 2
+        assert self.documents.hydrated is False
+
+    def test_access(self):
+        assert self.lot.documents[1].title == u'second'
+        assert self.documents.hydrated is True
+        assert self.lot.documents[0].__parent__ is self.lot
+
+    def test_serialize(self):
+        assert self.lot.serialize('plain')['documents'] == Lot(self.data).serialize('plain')['documents']
+        assert [i['title'] for i in self.lot.serialize('plain')['documents']] == [u'first', u'second']
+
+    def test_compare(self):
+        assert self.lot == Lot(self.data)
+
+
+class TestGetLotChanges(unittest.TestCase):
+
+    def setUp(self):
+        data = {
+            'title': u'title', 'description': u'description', 'lotCustodian': {'name': u'custodian'},
+            'assets': ['a' * 32], 'documents': [{'title': u'document'}]
+        }
+        self.lot = Lot(data)
+        self.untracked_lot = Lot(data)
+
+    def change(self, lot, src):
+        apply_patch(mock.MagicMock(context=lot), data={'title': u'new'}, save=False, src=src)
+        lot.documents[0].title = u'changed'
+        lot.status = u'pending'
+
+    def test_tracked_changes(self):
+        src = self.untracked_lot.serialize('plain')
+        self.change(self.untracked_lot, src)
+        patch = get_lot_changes(self.untracked_lot, src)
+
+        self.lot.track_changes()
+        src = self.lot.changes_source()
+        assert src == self.lot.serialize_fields(self.lot._serializables)
+        self.change(self.lot, src)
+        assert {'title', 'documents', 'status'}.issubset(self.lot._data.touched)
+        assert 'lotCustodian' not in self.lot._data.touched
+        assert 'description' not in self.lot._data.touched
+
+        key = lambda i: i['path']
+        assert sorted(get_lot_changes(self.lot, src), key=key) == sorted(patch, key=key)
+        assert type(self.lot._data) is dict
+
+    def test_serialize_fields(self):
+        plain = self.lot.serialize('plain')
+        fields = self.lot.serialize_fields(['title', 'lotCustodian', 'revisions'])
+        assert fields == {'title': plain['title'], 'lotCustodian': plain['lotCustodian']}
+
+
 @mock.patch('openregistry.lots.core.utils.get_revision_changes', autospec=True)
 @mock.patch('openregistry.lots.core.utils.store_lot', autospec=True)
 @mock.patch('openregistry.lots.core.utils.set_modetest_titles', autospec=True)
@@ -581,6 +870,30 @@ class TestSaveLot(unittest.TestCase):
         assert mocked_store_lot.call_count == 0
 
 
+class TestLotStages(unittest.TestCase):
+
+    def setUp(self):
+        self.mocked_request = mock.MagicMock(validated={'lot': mock.MagicMock(lotType='someLotType')})
+        self.mocked_request.matched_route.name = 'Lot'
+        self.mocked_request.registry.lot_metrics = Metrics()
+        self.mocked_request.lot_stage_timings = lot_stage_timings(self.mocked_request)
+
+    def test_observe(self):
+        self.mocked_request.add_finished_callback.assert_called_once_with(observe_lot_stages)
+        with self.assertRaises(DummyException):
+            with lot_stage(self.mocked_request, 'store'):
+                raise DummyException
+        with lot_stage(self.mocked_request, 'serialize'):
+            pass
+        assert [i for i, _ in self.mocked_request.lot_stage_timings] == ['store', 'serialize']
+
+        observe_lot_stages(self.mocked_request)
+        histogram = self.mocked_request.registry.lot_metrics.histogram(
+            'lot_stage_seconds', stage='store', route='Lot', lot_type='someLotType'
+        )
+        assert histogram.count == 1
+
+
 class TestSubscribersPicker(unittest.TestCase):
 
     def setUp(self):
@@ -632,9 +945,17 @@ class TestIsLot(unittest.TestCase):
     def test_request_lot_is_not_none_and_lotType_equal_value(self):
         self.mocked_lot.lotType = 'someValue'
         self.mocked_request.lot = self.mocked_lot
-        self.mocked_request.registry.lot_type_configurator = {'someValue': 'value'}
+        self.mocked_request.registry.lot_type_index = LotTypeIndex({}, {'someValue': 'value'})
+        self.mocked_request.lot_internal_type = lot_internal_type(self.mocked_request)
         assert self.is_lot_instance({}, self.mocked_request) is True
 
+    def test_lot_internal_type(self):
+        self.mocked_request.registry.lot_type_index = LotTypeIndex({}, {'someValue': 'value'})
+        self.mocked_request.lot = None
+        assert lot_internal_type(self.mocked_request) is None
+        self.mocked_request.lot = mock.MagicMock(lotType='someValue')
+        assert lot_internal_type(self.mocked_request) == 'value'
+
     def test_get_lot_types(self):
         self.mocked_lot.lotType = 'someValue'
         self.mocked_request.lot = self.mocked_lot
@@ -656,6 +977,7 @@ class TestStoreLot(unittest.TestCase):
         self.mocked_request = mock.MagicMock()
         self.mocked_request.authenticated_userid = 'authID'
         self.mocked_request.registry.db = 'db'
+        self.mocked_request.registry.lot_history = None
         self.mocked_request.errors = mock.MagicMock()
         self.mocked_request.errors.status = None
         self.mocked_request.errors.add = mock.MagicMock()
@@ -713,6 +1035,41 @@ class TestStoreLot(unittest.TestCase):
                 assert self.mocked_request.errors.add.call_count == 0
                 assert self.mocked_request.errors.status is None
 
+    def test_history(self, mocked_get_now, mocked_prepare_revision, mocked_lot_revisions, mocked_logger, mocked_context_unpack):
+        self.mocked_request.registry.lot_history = LotHistory(snapshot_every=0)
+        self.mocked_request.registry.db = mock.MagicMock()
+        self.mocked_request.registry.db.update.return_value = [(True, 'x', '1-a')]
+        self.lot.dateModified = self.old_date
+        self.lot.revisionsCount = 1
+        self.lot.__detached_revisions__ = [(1, {'rev': None})]
+        mocked_get_now.return_value = self.new_date
+        mocked_lot_revisions.model_class.return_value = self.new_rev
+        with mock.patch.object(self.lot, 'store', autospec=True) as mocked_store:
+            with mock.patch.object(self.lot, 'revisions') as revisions_mock:
+                # revisions detached from the lot are written before it
+                mocked_store.side_effect = lambda db: self.assertEqual(db.update.call_count, 1)
+                assert store_lot(self.lot, self.patch, self.mocked_request) is True
+
+                revisions_mock.append.assert_called_once_with(self.new_rev)
+                assert self.lot.revisionsCount == 2
+                assert self.lot.__detached_revisions__ == []
+                assert mocked_store.call_count == 1
+
+    def test_history_failure(self, mocked_get_now, mocked_prepare_revision, mocked_lot_revisions, mocked_logger, mocked_context_unpack):
+        self.mocked_request.registry.lot_history = LotHistory(snapshot_every=0)
+        self.mocked_request.registry.db = mock.MagicMock()
+        self.mocked_request.registry.db.update.return_value = [(False, 'x', ServerError('failed'))]
+        self.lot.dateModified = self.old_date
+        self.lot.__detached_revisions__ = [(1, {'rev': None})]
+        mocked_get_now.return_value = self.new_date
+        with mock.patch.object(self.lot, 'store', autospec=True) as mocked_store:
+            with mock.patch.object(self.lot, 'revisions'):
+                assert store_lot(self.lot, self.patch, self.mocked_request) is None
+
+                assert mocked_store.call_count == 0
+                self.mocked_request.errors.add.assert_called_once_with('body', 'data', 'failed')
+                assert self.lot.__detached_revisions__ == [(1, {'rev': None})]
+
     def test_model_validation_error(self, mocked_get_now, mocked_prepare_revision, mocked_lot_revisions, mocked_logger, mocked_context_unpack):
         with mock.patch.object(self.lot, 'store', autospec=True) as mocked_store:
             with mock.patch.object(self.lot, 'revisions') as revisions_mock:
@@ -3,6 +3,7 @@ import unittest
 import mock
 
 from datetime import timedelta
+from webob.etag import AnyETag, ETagMatcher
 
 
 
@@ -13,7 +14,11 @@ from openregistry.lots.core.validation import (
     validate_lot_document_update_not_by_author_or_lot_owner,
     validate_update_item_in_not_allowed_status,
     validate_lot_data,
-    validate_patch_lot_data
+    validate_patch_lot_data,
+    validate_lot_if_match,
+    validate_lot_item_data,
+    validate_lots_batch_data,
+    validate_lots_ids_data
 )
 from openregistry.lots.core.tests.base import DummyException
 
@@ -97,6 +102,35 @@ class TestValidateLotDocumentUpdateNotByAuthorOrLotOwner(unittest.TestCase):
         assert self.mocked_request.errors.status is None
 
 
+class TestValidateLotIfMatch(unittest.TestCase):
+
+    def setUp(self):
+        self.mocked_request = mock.MagicMock()
+        self.mocked_request.errors = mock.MagicMock(add=mock.MagicMock(), status=None)
+        self.mocked_request.validated = {'lot': mock.MagicMock(rev='2-abc', status='pending')}
+
+        self.mocked_handler = mock.MagicMock()
+        self.mocked_handler.side_effect = [DummyException]
+
+    def test_without_header(self):
+        self.mocked_request.if_match = AnyETag
+        validate_lot_if_match(self.mocked_request, self.mocked_handler)
+        assert self.mocked_request.errors.status is None
+
+    def test_matching_etag(self):
+        self.mocked_request.if_match = ETagMatcher.parse('"2-abc/pending"')
+        validate_lot_if_match(self.mocked_request, self.mocked_handler)
+        assert self.mocked_request.errors.status is None
+
+    def test_outdated_etag(self):
+        self.mocked_request.if_match = ETagMatcher.parse('"1-xyz/pending"')
+        with self.assertRaises(DummyException):
+            validate_lot_if_match(self.mocked_request, self.mocked_handler)
+        self.mocked_handler.assert_called_with(self.mocked_request)
+        self.mocked_request.errors.add.assert_called_with('header', 'If-Match', 'Precondition Failed')
+        assert self.mocked_request.errors.status == 412
+
+
 @mock.patch('openregistry.lots.core.validation.raise_operation_error')
 class TestValidateUpdateItemInNotAllowedStatus(unittest.TestCase):
 
@@ -347,10 +381,122 @@ class TestValidatePatchLotData(unittest.TestCase):
         )
 
 
+@mock.patch('openregistry.lots.core.validation.update_logging_context')
+class TestValidateLotsBatchData(unittest.TestCase):
+
+    def setUp(self):
+        self.mocked_request = mock.MagicMock(validated={})
+        self.mocked_request.errors = mock.MagicMock(add=mock.MagicMock(), status=None)
+
+        self.mocked_handler = mock.MagicMock()
+        self.mocked_handler.side_effect = [DummyException]
+
+    def assert_invalid(self, description):
+        with self.assertRaises(DummyException):
+            validate_lots_batch_data(self.mocked_request, self.mocked_handler)
+        self.mocked_handler.assert_called_with(self.mocked_request)
+        self.mocked_request.errors.add.assert_called_with('body', 'data', description)
+        assert self.mocked_request.errors.status == 422
+        assert 'batch' not in self.mocked_request.validated
+
+    def test_success_validation(self, mocked_update_context):
+        batch = [{'title': u'Lot'}, {'title': u'Lot', 'status': 'draft'}]
+        self.mocked_request.json_body = {'data': batch}
+
+        validate_lots_batch_data(self.mocked_request, self.mocked_handler)
+        mocked_update_context.assert_called_with(self.mocked_request, {'lot_id': '__batch__'})
+        assert self.mocked_request.validated['batch'] == batch
+        assert self.mocked_request.errors.add.call_count == 0
+
+    def test_invalid_json(self, mocked_update_context):
+        type(self.mocked_request).json_body = mock.PropertyMock(side_effect=ValueError('No JSON object'))
+        self.assert_invalid('No JSON object')
+
+    def test_not_list(self, mocked_update_context):
+        for json_body in ([{'title': u'Lot'}], {'data': {'title': u'Lot'}}, {'data': []}):
+            self.mocked_handler.side_effect = [DummyException]
+            self.mocked_request.json_body = json_body
+            self.assert_invalid('Data not available')
+
+    def test_not_objects(self, mocked_update_context):
+        self.mocked_request.json_body = {'data': [{'title': u'Lot'}, 'lot']}
+        self.assert_invalid('Data not available')
+
+    def test_size_limit(self, mocked_update_context):
+        with mock.patch('openregistry.lots.core.validation.BATCH_SIZE_LIMIT', 2):
+            self.mocked_request.json_body = {'data': [{}, {}]}
+            validate_lots_batch_data(self.mocked_request, self.mocked_handler)
+            assert len(self.mocked_request.validated.pop('batch')) == 2
+
+            self.mocked_request.json_body = {'data': [{}, {}, {}]}
+            self.assert_invalid('Batch size is limited to 2 lots')
+
+    def test_item_errors(self, mocked_update_context):
+        self.mocked_request.json_body = {'data': [{'title': u'Lot'}, {'title': u'Lot'}]}
+        validate_lots_batch_data(self.mocked_request, self.mocked_handler)
+        # items are validated one by one by the view, errors are reported per item
+        self.mocked_request.lot_from_data.return_value = mock.MagicMock(create_accreditation='1')
+        self.mocked_request.check_accreditation.side_effect = [True, False]
+        with mock.patch('openregistry.lots.core.validation.validate_data') as mocked_validate_data:
+            mocked_validate_data.return_value = {'title': u'Lot', 'mode': u'test'}
+            validate_lot_item_data(self.mocked_request, self.mocked_handler,
+                                   self.mocked_request.validated['batch'][0])
+            with self.assertRaises(DummyException):
+                validate_lot_item_data(self.mocked_request, self.mocked_handler,
+                                       self.mocked_request.validated['batch'][1])
+        self.mocked_handler.assert_called_with(self.mocked_request.errors)
+        self.mocked_request.errors.add.assert_called_once_with(
+            'body', 'accreditation', 'Broker Accreditation level does not permit lot creation'
+        )
+        assert self.mocked_request.errors.status == 403
+
+
+class TestValidateLotsIdsData(unittest.TestCase):
+
+    def setUp(self):
+        self.mocked_request = mock.MagicMock(validated={})
+        self.mocked_request.errors = mock.MagicMock(add=mock.MagicMock(), status=None)
+
+        self.mocked_handler = mock.MagicMock()
+        self.mocked_handler.side_effect = [DummyException]
+
+    def assert_invalid(self, description):
+        with self.assertRaises(DummyException):
+            validate_lots_ids_data(self.mocked_request, self.mocked_handler)
+        self.mocked_handler.assert_called_with(self.mocked_request)
+        self.mocked_request.errors.add.assert_called_with('body', 'data', description)
+        assert self.mocked_request.errors.status == 422
+        assert 'ids' not in self.mocked_request.validated
+
+    def test_success_validation(self):
+        self.mocked_request.json_body = {'data': ['a' * 32, u'b' * 32]}
+        validate_lots_ids_data(self.mocked_request, self.mocked_handler)
+        assert self.mocked_request.validated['ids'] == ['a' * 32, u'b' * 32]
+        assert self.mocked_request.errors.add.call_count == 0
+
+    def test_not_ids(self):
+        for json_body in ({'data': []}, {'data': 'a' * 32}, {'data': ['a' * 32, {'id': 'b' * 32}]}):
+            self.mocked_handler.side_effect = [DummyException]
+            self.mocked_request.json_body = json_body
+            self.assert_invalid('Data not available')
+
+    def test_repeated_ids(self):
+        self.mocked_request.json_body = {'data': ['a' * 32, 'b' * 32, 'a' * 32]}
+        self.assert_invalid('Lot ids should be unique')
+
+    def test_size_limit(self):
+        self.mocked_request.json_body = {'data': [str(i) for i in range(3)]}
+        with mock.patch('openregistry.lots.core.validation.BATCH_SIZE_LIMIT', 2):
+            self.assert_invalid('Batch size is limited to 2 lots')
+
+
 def suite():
     tests = unittest.TestSuite()
     tests.addTest(unittest.makeSuite(TestValidateLotData))
     tests.addTest(unittest.makeSuite(TestValidateLotDocumentUpdateNotByAuthorOrLotOwner))
+    tests.addTest(unittest.makeSuite(TestValidateLotIfMatch))
+    tests.addTest(unittest.makeSuite(TestValidateLotsBatchData))
+    tests.addTest(unittest.makeSuite(TestValidateLotsIdsData))
     tests.addTest(unittest.makeSuite(TestValidatePatchLotData))
     tests.addTest(unittest.makeSuite(TestValidatePostLotRole))
     tests.addTest(unittest.makeSuite(TestValidateUpdateItemInNotAllowedStatus))
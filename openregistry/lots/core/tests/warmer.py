@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import unittest
+import mock
+
+from openregistry.lots.core.metrics import Metrics
+from openregistry.lots.core.warmer import ViewWarmer, seq_number, view_warmer_factory
+
+
+class FeedView(object):
+    stale = None
+
+    def __init__(self, view):
+        self.view = view
+
+
+class TestViewWarmer(unittest.TestCase):
+
+    def setUp(self):
+        self.view = mock.MagicMock()
+        self.view.name = 'by_mode_dateModified'
+        self.feed_views = [FeedView(self.view), FeedView(self.view)]
+        self.warmer = ViewWarmer({u'dateModified': {u'': self.feed_views[0], u'test': self.feed_views[1]}},
+                                 max_lag=10, metrics=Metrics())
+        self.warmer.db = mock.MagicMock()
+        self.warmer.db.info.return_value = {'update_seq': '120-g1AAAA'}
+
+    def test_seq_number(self):
+        assert seq_number(42) == 42
+        assert seq_number('42-g1AAAA') == 42
+
+    def test_warm(self):
+        self.view.return_value.update_seq = '115-g1AAAA'
+        assert self.warmer.warm() == {'by_mode_dateModified': 5}
+        self.view.assert_called_once_with(self.warmer.db, limit=0, stale='update_after', update_seq=True)
+        assert not self.warmer.lagging
+
+    def test_lagging_view_read_stale(self):
+        self.view.return_value.update_seq = 100
+        self.warmer.warm()
+        assert [i.stale for i in self.feed_views] == ['ok', 'ok']
+        self.view.return_value.update_seq = 120
+        self.warmer.warm()
+        assert [i.stale for i in self.feed_views] == [None, None]
+
+    def test_lag_gauge(self):
+        self.view.return_value.update_seq = '115-g1AAAA'
+        self.warmer.warm()
+        assert self.warmer.metrics.gauge('lots_view_index_lag', view='by_mode_dateModified').value == 5
+        self.view.return_value.update_seq = '120-g1AAAA'
+        self.warmer.warm()
+        assert self.warmer.metrics.gauge('lots_view_index_lag', view='by_mode_dateModified').value == 0
+
+    @mock.patch('openregistry.lots.core.warmer.LOGGER', autospec=True)
+    def test_failures_counted(self, mocked_logger):
+        self.warmer.db.info.side_effect = IOError
+        self.warmer.warm_safely()
+        self.warmer.warm_safely()
+        assert self.warmer.metrics.counter('lots_views_warm_failures_total', error='IOError').value == 2
+        assert mocked_logger.warning.call_count == 2
+
+    def test_touch(self):
+        self.warmer.touch()
+        assert self.warmer.written.is_set()
+
+
+class TestViewWarmerFactory(unittest.TestCase):
+
+    def test_disabled(self):
+        assert view_warmer_factory({}) is None
+
+    def test_enabled(self):
+        warmer = view_warmer_factory({'max_lag': '5'})
+        assert warmer.max_lag == 5
+        assert warmer.views
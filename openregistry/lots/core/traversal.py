@@ -15,10 +15,14 @@ class Root(object):
         (Allow, 'g:brokers', 'create_lot'),
         (Allow, 'g:brokers', 'edit_lot'),
         (Allow, 'g:Administrator', 'edit_lot'),
+        (Allow, 'g:Administrator', 'view_lot_revisions'),
+        (Allow, 'g:Administrator', 'view_metrics'),
         (Allow, 'g:convoy', 'edit_lot'),
         (Allow, 'g:chronograph', 'edit_lot'),
         (Allow, 'g:concierge', 'edit_lot'),
         (Allow, 'g:concierge', 'extract_credentials'),
+        (Allow, 'g:concierge', 'edit_lots_batch'),
+        (Allow, 'g:convoy', 'edit_lots_batch'),
     ]
 
     def __init__(self, request):
@@ -26,6 +30,24 @@ class Root(object):
         self.db = request.registry.db
 
 
+def get_lot_src(request, lot):
+    """ Source of the lot revision patch
+
+    Whole ``plain`` serialization of the lot, or only the fields which
+    change if changes of lots are tracked.
+    """
+    if request.registry.lot_change_tracking:
+        lot.track_changes()
+        return lot.changes_source()
+    return lot.serialize('plain')
+
+
+def revisions_factory(request):
+    """ Lot revisions factory, the lot document is read by the views """
+    request.validated['lot_id'] = request.matchdict['lot_id']
+    return Root(request)
+
+
 def factory(request):
     request.validated['lot_src'] = {}
     root = Root(request)
@@ -38,7 +60,7 @@ def factory(request):
     request.validated['lot_status'] = lot.status
     request.validated['resource_type'] = "lot"
     if request.method != 'GET':
-        request.validated['lot_src'] = lot.serialize('plain')
+        request.validated['lot_src'] = get_lot_src(request, lot)
     if request.matchdict.get('auction_id'):
         auction = get_item(lot, 'auction', request)
         if request.matchdict.get('document_id'):
@@ -1,6 +1,7 @@
 from logging import getLogger
+from contextlib import contextmanager
 from functools import partial
-from time import sleep
+from time import time
 from pkg_resources import get_distribution
 from couchdb.http import ResourceConflict
 from schematics.exceptions import ModelValidationError
@@ -32,6 +33,10 @@ from openprocurement.api.utils import (  # noqa: F401
 )
 
 from openregistry.lots.core.constants import DEFAULT_LOT_TYPE
+from openregistry.lots.core.models import TrackedData
+from openregistry.lots.core.lot_id import (
+    get_lot_id_doc, format_lot_id, reserve_lot_index, CounterLotIDSequence
+)
 
 from openregistry.lots.core.traversal import factory
 
@@ -44,28 +49,47 @@ oplotsresource = partial(resource,
                          factory=factory)
 
 
-def generate_lot_id(ctime, db, server_id=''):
-    key = ctime.date().isoformat()
-    lotIDdoc = 'lotID_' + server_id if server_id else 'lotID'
-    while True:
-        try:
-            lotID = db.get(lotIDdoc, {'_id': lotIDdoc})
-            index = lotID.get(key, 1)
-            lotID[key] = index + 1
-            db.save(lotID)
-        except ResourceConflict:  # pragma: no cover
-            pass
-        except Exception:  # pragma: no cover
-            sleep(1)
-        else:
-            break
-    return 'UA-LR-DGF-{:04}-{:02}-{:02}-{:06}{}'.format(
-                                                ctime.year,
-                                                ctime.month,
-                                                ctime.day,
-                                                index,
-                                                server_id and '-' + server_id
-                                            )
+def generate_lot_id(ctime, db, server_id='', sequence=None):
+    lotIDdoc = get_lot_id_doc(server_id)
+    if sequence is None:
+        index = reserve_lot_index(db, lotIDdoc, ctime.date().isoformat())
+    else:
+        index = sequence.next_index(db, lotIDdoc, ctime)
+    return format_lot_id(ctime, index, server_id)
+
+
+def generate_lot_ids(ctime, db, count, server_id='', sequence=None):
+    """ Generate ``count`` lotIDs, the counter indices are reserved at once """
+    lotIDdoc = get_lot_id_doc(server_id)
+    sequence = sequence or CounterLotIDSequence()
+    return [format_lot_id(ctime, index, server_id)
+            for index in sequence.next_indices(db, lotIDdoc, ctime, count)]
+
+
+def lot_stage_timings(request):
+    """ ``(stage, seconds)`` of the request, observed once it is finished """
+    request.add_finished_callback(observe_lot_stages)
+    return []
+
+
+def observe_lot_stages(request):
+    route = request.matched_route.name if request.matched_route else ''
+    lot = request.validated.get('lot') or request.__dict__.get('lot')
+    lot_type = getattr(lot, 'lotType', None) or ''
+    for stage, seconds in request.lot_stage_timings:
+        request.registry.lot_metrics.histogram(
+            'lot_stage_seconds', stage=stage, route=route, lot_type=lot_type
+        ).observe(seconds)
+
+
+@contextmanager
+def lot_stage(request, stage):
+    """ Time ``stage`` of lot request """
+    start = time()
+    try:
+        yield
+    finally:
+        request.lot_stage_timings.append((stage, time() - start))
 
 
 def extract_lot(request):
@@ -89,7 +113,17 @@ def extract_lot(request):
 
 def extract_lot_adapter(request, lot_id):
     db = request.registry.db
-    doc = db.get(lot_id)
+    cache = request.registry.lot_doc_cache
+    with lot_stage(request, 'fetch'):
+        if cache is not None and request.method == 'GET':
+            doc = cache.get(lot_id)
+            if doc is None:
+                generation = cache.generation()
+                doc = db.get(lot_id)
+                if doc is not None and doc.get('doc_type') == 'Lot':
+                    cache.set(doc, generation)
+        else:
+            doc = db.get(lot_id)
     if doc is None or doc.get('doc_type') != 'Lot':
         request.errors.add('url', 'lot_id', 'Not Found')
         request.errors.status = 404
@@ -98,6 +132,31 @@ def extract_lot_adapter(request, lot_id):
     return request.lot_from_data(doc)
 
 
+def get_lot_docs(request, lot_ids):
+    """ Fetch lot documents with one ``_all_docs`` request
+
+    Returns dict of the found documents by id. Cached documents are used
+    when the lot documents cache is enabled.
+    """
+    cache = request.registry.lot_doc_cache
+    docs = {}
+    if cache is not None:
+        for lot_id in lot_ids:
+            doc = cache.get(lot_id)
+            if doc is not None:
+                docs[lot_id] = doc
+    missing = [i for i in set(lot_ids) if i not in docs]
+    if missing:
+        generation = cache.generation() if cache is not None else None
+        for row in request.registry.db.view('_all_docs', keys=missing, include_docs=True):
+            doc = row.doc
+            if doc is not None and doc.get('doc_type') == 'Lot':
+                docs[row.id] = doc
+                if cache is not None:
+                    cache.set(doc, generation)
+    return docs
+
+
 def get_lot_types(registry, internal_types):
     lot_types = [
         lt for lt, it in registry.lot_type_configurator.items() if it in internal_types
@@ -105,29 +164,58 @@ def get_lot_types(registry, internal_types):
     return lot_types
 
 
+class LotTypeIndex(object):
+    """ Lookups of the registered lot types
+
+    Built by ``register_lotType`` from ``lotTypes`` and
+    ``lot_type_configurator`` and replaced, never changed, on registration.
+    """
+
+    def __init__(self, lot_types, configurator):
+        self.models = dict(lot_types)
+        self.internal_types = dict(configurator)
+        by_internal_type = {}
+        for lot_type, internal_type in configurator.items():
+            by_internal_type.setdefault(internal_type, []).append(lot_type)
+        self.lot_types = dict([(i, tuple(j)) for i, j in by_internal_type.items()])
+        self.default_type = self.lot_types.get(DEFAULT_LOT_TYPE, (DEFAULT_LOT_TYPE, ))[0]
+
+
+def lot_internal_type(request):
+    """ Internal type of the request lot, reified for the route predicates """
+    if request.lot is not None:
+        return request.registry.lot_type_index.internal_types.get(getattr(request.lot, 'lotType', None))
+
+
 def lot_from_data(request, data, raise_error=True, create=True):
-    lotType = data.get('lotType')
-    if not lotType:
-        lot_types = get_lot_types(request.registry, (DEFAULT_LOT_TYPE,))
-        lotType = lot_types[0] if lot_types else DEFAULT_LOT_TYPE
-    model = request.registry.lotTypes.get(lotType)
+    index = request.registry.lot_type_index
+    lotType = data.get('lotType') or index.default_type
+    model = index.models.get(lotType)
     if model is None and raise_error:
         request.errors.add('body', 'lotType', 'Not implemented')
         request.errors.status = 415
         raise error_handler(request)
     update_logging_context(request, {'lot_type': lotType})
     if model is not None and create:
-        model = model(data)
+        history = request.registry.lot_history
+        detached = history.detach(data) if history is not None else None
+        with lot_stage(request, 'build'):
+            model = model(data)
+        if detached:
+            model.__detached_revisions__ = detached
     return model
 
 
 def apply_patch(request, data=None, save=True, src=None):
     data = request.validated.get('data') if data is None else data
-    patch = data and apply_data_patch(src or request.context.serialize(), data)
-    if patch:
-        request.context.import_data(patch)
-        if save:
-            return save_lot(request)
+    with lot_stage(request, 'apply_patch'):
+        if data and isinstance(getattr(request.context, '_data', None), TrackedData):
+            src = request.context.changes_source(data)
+        patch = data and apply_data_patch(src or request.context.serialize(), data)
+        if patch:
+            request.context.import_data(patch)
+    if patch and save:
+        return save_lot(request)
 
 
 class isLot(object):
@@ -143,8 +231,7 @@ class isLot(object):
 
     def __call__(self, context, request):
         if request.lot is not None:
-            lot_type = getattr(request.lot, 'lotType', None)
-            return request.registry.lot_type_configurator.get(lot_type) == self.val
+            return request.lot_internal_type == self.val
         return False
 
 
@@ -155,8 +242,11 @@ def register_lotType(config, model, lot_type):
     :param model:
         The lot model class
     """
+    model.compile_roles()
     config.registry.lotTypes[lot_type] = model
     config.registry.lot_type_configurator[lot_type] = model._internal_type
+    config.registry.lot_type_index = LotTypeIndex(config.registry.lotTypes,
+                                                  config.registry.lot_type_configurator)
 
 
 class SubscribersPicker(isLot):
@@ -169,21 +259,84 @@ class SubscribersPicker(isLot):
         return False
 
 
+def serialize_lot(request, lot, role):
+    """ lot.serialize(role) through the serialization cache
+
+    Only lots of types declaring ``cacheable_serialization`` are cached, as
+    the key doesn't cover serializables depending on time or request. Lots
+    not stored yet and lots of failed requests (which could be changed
+    without being saved) are always serialized.
+    """
+    cache = request.registry.lot_serialization_cache
+    key = None
+    if cache is not None and lot.rev and not request.errors and getattr(lot, 'cacheable_serialization', False):
+        key = (lot.id, lot.rev, role, request.application_url)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    with lot_stage(request, 'serialize'):
+        data = lot.serialize(role)
+    if key is not None:
+        cache.set(key, data)
+    return data
+
+
 def lot_serialize(request, lot_data, fields):
+    """ ``fields`` of lot document of a listing row fetched with include_docs
+
+    Listings of LISTING_FIELDS only are served from the view values and
+    never get here.
+    """
     lot = request.lot_from_data(lot_data, raise_error=False)
     if lot is None:
         return dict([(i, lot_data.get(i, '')) for i in ['lotType', 'dateModified', 'id']])
-    return dict([(i, j) for i, j in lot.serialize(lot.status).items() if i in fields])
+    return dict([(i, j) for i, j in serialize_lot(request, lot, lot.status).items() if i in fields])
 
 
-def store_lot(lot, patch, request):
-    revision = prepare_revision(lot, patch, request.authenticated_userid)
-    lot.revisions.append(type(lot).revisions.model_class(revision))
+def get_lot_etag(lot, role):
+    """ Strong entity tag of ``lot`` serialized with ``role`` """
+    return '{}/{}'.format(lot.rev, role)
+
+
+def prepare_lot_store(lot, patch, request):
+    """ Add revision and bump dateModified, returns previous dateModified """
+    revision = type(lot).revisions.model_class(prepare_revision(lot, patch, request.authenticated_userid))
+    if request.registry.lot_history is None:
+        lot.revisions.append(revision)
+        if lot.revisionsCount:
+            # keep counting revisions of lots stored with the history before
+            lot.revisionsCount += 1
+    else:
+        request.registry.lot_history.add(lot, revision)
     old_dateModified = lot.dateModified
     if getattr(lot, 'modified', True):
         lot.dateModified = get_now()
+    return old_dateModified
+
+
+def lot_stored(lot, old_dateModified, request):
+    if request.registry.lot_history is not None:
+        request.registry.lot_history.commit(request.registry.db, lot)
+    if request.registry.lot_doc_cache is not None:
+        request.registry.lot_doc_cache.invalidate(lot.id)
+    if request.registry.view_warmer is not None:
+        request.registry.view_warmer.touch()
+    LOGGER.info(
+        'Saved lot {lot_id}: dateModified {old_dateModified} -> {new_dateModified}'.format(
+            lot_id=lot.id,
+            old_dateModified=old_dateModified and old_dateModified.isoformat(),
+            new_dateModified=lot.dateModified.isoformat()),
+        extra=context_unpack(request, {'MESSAGE_ID': 'save_lot'}, {'RESULT': lot.rev}))
+
+
+def store_lot(lot, patch, request):
+    old_dateModified = prepare_lot_store(lot, patch, request)
+    history = request.registry.lot_history
     try:
-        lot.store(request.registry.db)
+        with lot_stage(request, 'store'):
+            if history is not None:
+                history.migrate(request.registry.db, lot)
+            lot.store(request.registry.db)
     except ModelValidationError, e:
         for i in e.message:
             request.errors.add('body', i, e.message[i])
@@ -194,19 +347,66 @@ def store_lot(lot, patch, request):
     except Exception, e:  # pragma: no cover
         request.errors.add('body', 'data', str(e))
     else:
-        LOGGER.info(
-            'Saved lot {lot_id}: dateModified {old_dateModified} -> {new_dateModified}'.format(
-                lot_id=lot.id,
-                old_dateModified=old_dateModified and old_dateModified.isoformat(),
-                new_dateModified=lot.dateModified.isoformat()),
-            extra=context_unpack(request, {'MESSAGE_ID': 'save_lot'}, {'RESULT': lot.rev}))
+        lot_stored(lot, old_dateModified, request)
         return True
 
 
+def store_lots(lots, request):
+    """ Store ``(lot, patch)`` pairs with one ``_bulk_docs`` request
+
+    Returns list of errors in the order of ``lots``, ``None`` for the
+    stored lots.
+    """
+    errors, docs = [], []
+    history = request.registry.lot_history
+    for lot, patch in lots:
+        old_dateModified = prepare_lot_store(lot, patch, request)
+        try:
+            lot.validate()
+            if history is not None:
+                history.migrate(request.registry.db, lot)
+        except ModelValidationError, e:
+            errors.append({'code': 422, 'errors': [
+                {'location': 'body', 'name': i, 'description': e.message[i]} for i in e.message
+            ]})
+        except Exception, e:
+            errors.append({'code': 500, 'errors': [
+                {'location': 'body', 'name': 'data', 'description': str(e)}
+            ]})
+        else:
+            errors.append(None)
+            docs.append((lot, old_dateModified, lot.to_primitive()))
+    with lot_stage(request, 'store'):
+        results = request.registry.db.update([doc for _, _, doc in docs]) if docs else []
+    stored = iter(zip(docs, results))
+    for index, error in enumerate(errors):
+        if error is not None:
+            continue
+        (lot, old_dateModified, doc), (success, _, rev) = next(stored)
+        if success:
+            lot._rev = rev
+            lot_stored(lot, old_dateModified, request)
+        else:
+            errors[index] = {'code': 409 if isinstance(rev, ResourceConflict) else 500, 'errors': [
+                {'location': 'body', 'name': 'data', 'description': str(rev)}
+            ]}
+    return errors
+
+
+def get_lot_changes(lot, src, request=None):
+    """ Revision patch of ``lot`` changed since ``src`` was serialized """
+    if request is not None:
+        with lot_stage(request, 'revision_diff'):
+            return get_lot_changes(lot, src)
+    if isinstance(getattr(lot, '_data', None), TrackedData):
+        return get_revision_changes(*lot.untrack_changes())
+    return get_revision_changes(lot.serialize("plain"), src)
+
+
 def save_lot(request):
     lot = request.validated['lot']
     if lot.mode == u'test':
         set_modetest_titles(lot)
-    patch = get_revision_changes(lot.serialize("plain"), request.validated['lot_src'])
+    patch = get_lot_changes(lot, request.validated['lot_src'], request)
     if patch:
         return store_lot(lot, patch, request)
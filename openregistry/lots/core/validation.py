@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from openprocurement.api.validation import validate_data, validate_json_data
-from .utils import update_logging_context, raise_operation_error
+from .constants import BATCH_SIZE_LIMIT
+from .utils import update_logging_context, raise_operation_error, get_lot_etag, lot_stage
 from openprocurement.api.validation import (  # noqa: F401
     validate_file_upload, # noqa forwarded import
     validate_document_data, # noqa forwarded import
@@ -12,7 +13,12 @@ from openprocurement.api.validation import (  # noqa: F401
 
 def validate_lot_data(request, error_handler, **kwargs):
     update_logging_context(request, {'lot_id': '__new__'})
-    data = validate_json_data(request)
+    with lot_stage(request, 'validate'):
+        data = validate_json_data(request)
+        validate_lot_item_data(request, error_handler, data)
+
+
+def validate_lot_item_data(request, error_handler, data):
     model = request.lot_from_data(data, create=False)
     if not any([request.check_accreditation(acc) for acc in iter(str(model.create_accreditation))]):
         request.errors.add('body', 'accreditation',
@@ -27,6 +33,39 @@ def validate_lot_data(request, error_handler, **kwargs):
         raise error_handler(request)
 
 
+def validate_json_list(request, error_handler, item_type):
+    try:
+        json = request.json_body
+    except ValueError, e:
+        request.errors.add('body', 'data', e.message)
+        request.errors.status = 422
+        raise error_handler(request)
+    data = json.get('data') if isinstance(json, dict) else None
+    if not isinstance(data, list) or not data or not all([isinstance(i, item_type) for i in data]):
+        request.errors.add('body', 'data', 'Data not available')
+        request.errors.status = 422
+        raise error_handler(request)
+    if len(data) > BATCH_SIZE_LIMIT:
+        request.errors.add('body', 'data', 'Batch size is limited to {} lots'.format(BATCH_SIZE_LIMIT))
+        request.errors.status = 422
+        raise error_handler(request)
+    return data
+
+
+def validate_lots_batch_data(request, error_handler, **kwargs):
+    update_logging_context(request, {'lot_id': '__batch__'})
+    request.validated['batch'] = validate_json_list(request, error_handler, dict)
+
+
+def validate_lots_ids_data(request, error_handler, **kwargs):
+    ids = validate_json_list(request, error_handler, basestring)
+    if len(set(ids)) != len(ids):
+        request.errors.add('body', 'data', 'Lot ids should be unique')
+        request.errors.status = 422
+        raise error_handler(request)
+    request.validated['ids'] = ids
+
+
 def validate_post_lot_role(request, error_handler, **kwargs):
     if request.authenticated_role in ('convoy', 'concierge'):
         request.errors.add('body', 'accreditation', 'Can\'t create lot as bot')
@@ -35,7 +74,12 @@ def validate_post_lot_role(request, error_handler, **kwargs):
 
 
 def validate_patch_lot_data(request, error_handler, **kwargs):
-    data = validate_json_data(request)
+    with lot_stage(request, 'validate'):
+        data = validate_json_data(request)
+        return validate_patch_lot_item_data(request, error_handler, data)
+
+
+def validate_patch_lot_item_data(request, error_handler, data):
     editing_roles = request.content_configurator.available_statuses[request.context.status]['editing_permissions']
     if request.authenticated_role not in editing_roles:
         msg = 'Can\'t update {} in current ({}) status'.format(request.validated['resource_type'],
@@ -47,6 +91,14 @@ def validate_patch_lot_data(request, error_handler, **kwargs):
     return validate_data(request, type(request.lot), data=data)
 
 
+def validate_lot_if_match(request, error_handler, **kwargs):
+    lot = request.validated['lot']
+    if get_lot_etag(lot, lot.status) not in request.if_match:
+        request.errors.add('header', 'If-Match', 'Precondition Failed')
+        request.errors.status = 412
+        raise error_handler(request)
+
+
 def validate_lot_document_update_not_by_author_or_lot_owner(request, error_handler, **kwargs):
     if request.authenticated_role != (request.context.author or 'lot_owner'):
         request.errors.add('url', 'role', 'Can update document only author')
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from pyramid.response import Response
+
+from openregistry.lots.core.metrics import render_prometheus
+from openregistry.lots.core.utils import oplotsresource, json_view, APIResource
+
+
+# /lots/_metrics is defined before /lots/{lot_id} as views modules are scanned in order
+@oplotsresource(name='LotsMetrics',
+                path='/lots/_metrics',
+                description="Lots core metrics")
+class LotsMetricsResource(APIResource):
+
+    @json_view(permission='view_metrics')
+    def get(self):
+        """Metrics of lots requests and database in Prometheus text format."""
+        return Response(
+            body=render_prometheus(self.request.registry.lot_metrics).encode('utf-8'),
+            content_type='text/plain; version=0.0.4',
+            charset='utf-8'
+        )
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+from pyramid.httpexceptions import HTTPError
+
+from openprocurement.api.utils import (
+    get_now, generate_id, json_view, set_ownership, set_modetest_titles,
+    get_revision_changes, context_unpack, APIResource, error_handler
+)
+
+from openregistry.lots.core.events import LotInitializeEvent
+from openregistry.lots.core.interfaces import ILotManager, IContentConfigurator
+from openregistry.lots.core.lot_id import LotIDGenerationError
+from openregistry.lots.core.traversal import get_lot_src
+from openregistry.lots.core.utils import (
+    oplotsresource, generate_lot_ids, store_lots, apply_patch, get_lot_docs,
+    serialize_lot, get_lot_changes
+)
+from openregistry.lots.core.validation import (
+    validate_lots_batch_data,
+    validate_lots_ids_data,
+    validate_lot_item_data,
+    validate_patch_lot_item_data,
+    validate_change_status,
+)
+
+# fields bots are allowed to change through the batch
+BATCH_PATCH_FIELDS = ('status', 'auctions')
+
+
+def pop_errors(request):
+    """ Move request errors to the result of a batch item """
+    result = {'status': 'error', 'code': request.errors.status, 'errors': list(request.errors)}
+    del request.errors[:]
+    request.errors.status = 400
+    return result
+
+
+# /lots/batch is defined before /lots/{lot_id} as views modules are scanned in order
+@oplotsresource(name='LotsBatch',
+                path='/lots/batch',
+                description="Bulk lots operations")
+class LotsBatchResource(APIResource):
+
+    @json_view(content_type="application/json", permission='create_lot',
+               validators=(validate_lots_batch_data, ))
+    def post(self):
+        """Create lots of the batch, reporting result per lot."""
+        results, lots = [], []
+        for index, data in enumerate(self.request.validated['batch']):
+            try:
+                lot = self.validate_new_lot(data)
+            except HTTPError:
+                results.append(pop_errors(self.request))
+                continue
+            results.append(None)
+            lots.append((index, lot))
+
+        unnumbered = [i for _, i in lots if not i.get('lotID')]
+        if unnumbered:
+            try:
+                lot_ids = generate_lot_ids(get_now(), self.db, len(unnumbered), self.server_id,
+                                           self.request.registry.lot_id_sequence)
+            except LotIDGenerationError, e:
+                self.request.errors.add('body', 'lotID', e.message)
+                self.request.errors.status = 503
+                return
+            for lot, lot_id in zip(unnumbered, lot_ids):
+                lot.lotID = lot_id
+
+        created = []
+        for index, lot in lots:
+            self.request.registry.notify(LotInitializeEvent(lot))
+            acc = set_ownership(lot, self.request)
+            if lot.mode == u'test':
+                set_modetest_titles(lot)
+            created.append((index, lot, acc, get_revision_changes(lot.serialize("plain"), {})))
+        errors = store_lots([(lot, patch) for _, lot, _, patch in created], self.request)
+
+        for (index, lot, acc, _), error in zip(created, errors):
+            if error is not None:
+                results[index] = dict(error, status='error')
+                continue
+            self.LOGGER.info('Created lot {} ({})'.format(lot.id, lot.lotID),
+                             extra=context_unpack(self.request, {'MESSAGE_ID': 'lot_create'},
+                                                  {'lot_id': lot.id, 'lotID': lot.lotID}))
+            results[index] = {
+                'status': 'created',
+                'code': 201,
+                'location': self.request.route_url('Lot', lot_id=lot.id),
+                'data': lot.serialize(lot.status),
+                'access': acc
+            }
+        return {'data': results}
+
+    @json_view(content_type="application/json", permission='edit_lots_batch',
+               validators=(validate_lots_batch_data, ))
+    def patch(self):
+        """Change status and auctions of the batch lots, reporting result per lot."""
+        batch = self.request.validated['batch']
+        ids = [item.get('id') for item in batch]
+        docs = dict([
+            (row.id, row.doc) for row in self.db.view('_all_docs', keys=[i for i in ids if i], include_docs=True)
+            if row.doc and row.doc.get('doc_type') == 'Lot'
+        ])
+        results, lots = [], []
+        root = self.context
+        for index, item in enumerate(batch):
+            try:
+                updated = self.patch_lot(item, docs.get(item.get('id')), ids[:index])
+            except HTTPError:
+                results.append(pop_errors(self.request))
+                continue
+            finally:
+                self.request.context = root
+            if updated is None:
+                results.append({'status': 'unchanged', 'code': 200, 'id': item['id'], 'rev': item.get('rev')})
+                continue
+            results.append(None)
+            lots.append((index, updated))
+        errors = store_lots([i for _, i in lots], self.request)
+
+        for (index, (lot, _)), error in zip(lots, errors):
+            if error is not None:
+                results[index] = dict(error, status='error')
+                continue
+            self.LOGGER.info('Updated lot {}'.format(lot.id),
+                             extra=context_unpack(self.request, {'MESSAGE_ID': 'lot_patch'}))
+            results[index] = {'status': 'updated', 'code': 200, 'id': lot.id, 'rev': lot.rev}
+        return {'data': results}
+
+    def patch_lot(self, item, doc, previous_ids):
+        """Run ``LotResource.patch`` for one lot without saving it.
+
+        Returns the lot with its revision patch, or ``None`` if nothing changed.
+        """
+        request = self.request
+        if not item.get('id') or item['id'] in previous_ids:
+            request.errors.add('body', 'id', 'Lot id is missing or repeated')
+            request.errors.status = 422
+            raise error_handler(request)
+        if doc is None:
+            request.errors.add('body', 'id', 'Not Found')
+            request.errors.status = 404
+            raise error_handler(request)
+        if item.get('rev') and item['rev'] != doc['_rev']:
+            request.errors.add('body', 'rev', 'Precondition Failed')
+            request.errors.status = 412
+            raise error_handler(request)
+        lot = request.lot_from_data(doc)
+        self.bind_lot(lot)
+        data = dict([(i, item[i]) for i in BATCH_PATCH_FIELDS if i in item])
+        validate_patch_lot_item_data(request, error_handler, data)
+        validate_change_status(request, error_handler)
+        request.registry.getAdapter(lot, ILotManager).change_lot(request)
+        apply_patch(request, save=False, src=request.validated['lot_src'])
+        if lot.mode == u'test':
+            set_modetest_titles(lot)
+        patch = get_lot_changes(lot, request.validated['lot_src'], request)
+        return (lot, patch) if patch else None
+
+    def bind_lot(self, lot):
+        """Set request up for ``lot`` as the traversal factory does."""
+        request = self.request
+        lot.__parent__ = self.context
+        request.context = request.lot = lot
+        request.content_configurator = request.registry.queryMultiAdapter((lot, request), IContentConfigurator)
+        request.validated.update({
+            'lot': lot,
+            'db_doc': lot,
+            'lot_id': lot.id,
+            'id': lot.id,
+            'lot_status': lot.status,
+            'resource_type': 'lot',
+            'lot_src': get_lot_src(request, lot),
+        })
+
+    def validate_new_lot(self, data):
+        """Run lot creation checks of ``LotsResource.post`` for one lot."""
+        self.request.validated.pop('lot', None)
+        validate_lot_item_data(self.request, error_handler, data)
+        lot = self.request.validated['lot']
+        self.request.registry.getAdapter(lot, ILotManager).create_lot(self.request)
+        lot.id = generate_id()
+        default_status = type(lot).fields['status'].default
+        if data.get('status', default_status) != 'draft':
+            self.request.errors.add('body', 'status', 'You can create only in draft status')
+            self.request.errors.status = 403
+            raise error_handler(self.request)
+        lot.status = 'draft'
+        return lot
+
+
+@oplotsresource(name='LotsBulkGet',
+                path='/lots/_bulk_get',
+                description="Lots lookup by ids")
+class LotsBulkGetResource(APIResource):
+
+    @json_view(content_type="application/json", permission='view_lot',
+               validators=(validate_lots_ids_data, ))
+    def post(self):
+        """Get lots by ids in one request, ids not found are listed separately."""
+        ids = self.request.validated['ids']
+        docs = get_lot_docs(self.request, ids)
+        lots, not_found = [], []
+        for lot_id in ids:
+            doc = docs.get(lot_id)
+            lot = doc and self.request.lot_from_data(doc, raise_error=False)
+            if lot is None:
+                not_found.append(lot_id)
+                continue
+            lot.__parent__ = self.context
+            lots.append(serialize_lot(self.request, lot, lot.status))
+        return {'data': lots, 'not_found': not_found}
@@ -10,15 +10,17 @@ from openregistry.lots.core.validation import (
 )
 
 from openregistry.lots.core.utils import (
-    oplotsresource, apply_patch
+    oplotsresource, apply_patch, get_lot_etag, serialize_lot
 )
 
 from openregistry.lots.core.validation import (
     validate_patch_lot_data,
+    validate_lot_if_match,
 )
 
 
 patch_lot_validators = (
+    validate_lot_if_match,
     validate_patch_lot_data,
     validate_change_status,
 )
@@ -31,7 +33,13 @@ class LotResource(APIResource):
 
     @json_view(permission='view_lot')
     def get(self):
-        lot_data = self.context.serialize(self.context.status)
+        role = self.context.status
+        response = self.request.response
+        response.etag = get_lot_etag(self.context, role)
+        if response.etag in self.request.if_none_match:
+            response.status = 304
+            return response
+        lot_data = serialize_lot(self.request, self.context, role)
         return {'data': lot_data}
 
     @json_view(content_type="application/json", validators=patch_lot_validators,
@@ -44,4 +52,5 @@ class LotResource(APIResource):
             'Updated lot {}'.format(lot.id),
             extra=context_unpack(self.request, {'MESSAGE_ID': 'lot_patch'})
         )
-        return {'data': lot.serialize(lot.status)}
+        self.request.response.etag = get_lot_etag(lot, lot.status)
+        return {'data': serialize_lot(self.request, lot, lot.status)}
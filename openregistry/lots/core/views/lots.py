@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from openregistry.lots.core.events import LotInitializeEvent
 from openregistry.lots.core.design import (
-    FIELDS, VIEW_MAP, CHANGES_VIEW_MAP, FEED
+    LISTING_FIELDS, VIEW_MAP, CHANGES_VIEW_MAP, FEED
 )
 
 from openprocurement.api.utils import (
@@ -16,6 +16,8 @@ from openregistry.lots.core.validation import (
     validate_lot_data,
 )
 from openregistry.lots.core.interfaces import ILotManager
+from openregistry.lots.core.listing import ListingStream
+from openregistry.lots.core.lot_id import LotIDGenerationError
 
 
 @oplotsresource(name='Lots',
@@ -29,11 +31,21 @@ class LotsResource(APIResourceListing):
         self.VIEW_MAP = VIEW_MAP
         self.CHANGES_VIEW_MAP = CHANGES_VIEW_MAP
         self.FEED = FEED
-        self.FIELDS = FIELDS
+        # opt_fields served from the view values, without include_docs:
+        # dateModified is the key of the dateModified feed and a value of
+        # the changes feed, id is the id of every view row
+        self.FIELDS = sorted(LISTING_FIELDS)
         self.serialize_func = lot_serialize
         self.object_name_for_listing = 'Lots'
         self.log_message_id = 'lot_list_custom'
 
+    @json_view(permission='view_listing')
+    def get(self):
+        batch_size = self.request.registry.listing_stream_batch
+        if not batch_size:
+            return super(LotsResource, self).get()
+        return ListingStream(self, batch_size).response()
+
     @json_view(content_type="application/json", permission='create_lot',
                validators=(validate_lot_data, ))
     def post(self):
@@ -46,7 +58,13 @@ class LotsResource(APIResourceListing):
         lot = self.request.validated['lot']
         lot.id = lot_id
         if not lot.get('lotID'):
-            lot.lotID = generate_lot_id(get_now(), self.db, self.server_id)
+            try:
+                lot.lotID = generate_lot_id(get_now(), self.db, self.server_id,
+                                            self.request.registry.lot_id_sequence)
+            except LotIDGenerationError, e:
+                self.request.errors.add('body', 'lotID', e.message)
+                self.request.errors.status = 503
+                return
         self.request.registry.notify(LotInitializeEvent(lot))
 
         default_status = type(lot).fields['status'].default
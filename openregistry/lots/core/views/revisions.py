@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+
+from cornice.resource import resource
+
+from openprocurement.api.utils import json_view, APIResource, error_handler
+
+from openregistry.lots.core.history import lot_revisions, lot_snapshot
+from openregistry.lots.core.traversal import revisions_factory
+from openregistry.lots.core.utils import get_lot_docs
+
+
+lotrevisionsresource = partial(resource,
+                               error_handler=error_handler,
+                               factory=revisions_factory)
+
+REVISIONS_LIMIT = 100
+
+
+class LotRevisionsMixin(object):
+
+    def lot_doc(self):
+        """Raw lot document, the lot model is not needed for revisions."""
+        lot_id = self.request.validated['lot_id']
+        doc = get_lot_docs(self.request, [lot_id]).get(lot_id)
+        if doc is None:
+            self.request.errors.add('url', 'lot_id', 'Not Found')
+            self.request.errors.status = 404
+            raise error_handler(self.request)
+        return doc
+
+
+@lotrevisionsresource(name='LotRevisions',
+                      path='/lots/{lot_id}/revisions',
+                      description="Lot revisions history")
+class LotRevisionsResource(LotRevisionsMixin, APIResource):
+
+    @json_view(permission='view_lot_revisions')
+    def get(self):
+        """Slice of lot revisions selected with offset and limit."""
+        offset = self.request.params.get('offset', '')
+        offset = int(offset) if offset.isdigit() else 0
+        limit = self.request.params.get('limit', '')
+        limit = int(limit) if limit.isdigit() and REVISIONS_LIMIT >= int(limit) > 0 else REVISIONS_LIMIT
+        revisions = lot_revisions(self.db, self.lot_doc(), self.request.registry.lot_history,
+                                  skip=offset, limit=limit)
+        data = {'data': [dict(revision, index=index) for index, revision in revisions]}
+        if len(revisions) == limit:
+            params = {'offset': offset + limit, 'limit': limit}
+            data['next_page'] = {
+                'offset': params['offset'],
+                'path': self.request.route_path('LotRevisions', lot_id=self.request.validated['lot_id'],
+                                                _query=params),
+                'uri': self.request.route_url('LotRevisions', lot_id=self.request.validated['lot_id'],
+                                              _query=params),
+            }
+        return data
+
+
+@lotrevisionsresource(name='LotRevisionSnapshot',
+                      path='/lots/{lot_id}/revisions/{revision_index}/snapshot',
+                      description="Lot state as of revision")
+class LotRevisionSnapshotResource(LotRevisionsMixin, APIResource):
+
+    @json_view(permission='view_lot_revisions')
+    def get(self):
+        """Lot as of revision with the index, rebuilt from the revisions patches.
+
+        The rebuilt document holds the lot tokens, it is served with the lot
+        ``view`` role.
+        """
+        index = self.request.matchdict['revision_index']
+        snapshot = index.isdigit() and lot_snapshot(self.db, self.lot_doc(), int(index),
+                                                    self.request.registry.lot_history)
+        lot = self.request.lot_from_data(snapshot, raise_error=False) if snapshot else None
+        if lot is None:
+            self.request.errors.add('url', 'revision_index', 'Not Found')
+            self.request.errors.status = 404
+            return
+        lot.__parent__ = self.context
+        return {'data': lot.serialize('view')}
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from threading import Event, Thread
+from time import sleep
+
+LOGGER = getLogger(__name__)
+
+
+def seq_number(seq):
+    """ Numeric part of CouchDB update sequence (``123`` or ``'123-g1AAA...'``) """
+    return int(str(seq).split('-')[0])
+
+
+class ViewWarmer(object):
+    """ Keeps lots feed view indexes warm
+
+    Views are queried with ``stale=update_after`` and ``limit=0`` so the
+    index update runs in CouchDB background. Views lagging more than
+    ``max_lag`` updates behind the database are read with ``stale=ok`` by
+    the listings until they catch up.
+
+    The lag of every view is exported by ``lots_view_index_lag`` gauges of
+    ``metrics`` and failed warmups are counted by
+    ``lots_views_warm_failures_total``.
+    """
+
+    def __init__(self, feed, interval=5, debounce=1, max_lag=1000, metrics=None):
+        self.feed_views = [i for view_map in feed.values() for i in view_map.values()]
+        self.interval = interval
+        self.debounce = debounce
+        self.max_lag = max_lag
+        self.lag = {}
+        self.written = Event()
+        self.db = None
+        self.metrics = metrics
+
+    @property
+    def views(self):
+        return set(i.view for i in self.feed_views)
+
+    def touch(self):
+        """ Notify about stored lot """
+        self.written.set()
+
+    def warm(self):
+        db_seq = seq_number(self.db.info()['update_seq'])
+        for view in self.views:
+            results = view(self.db, limit=0, stale='update_after', update_seq=True)
+            self.lag[view.name] = max(db_seq - seq_number(results.update_seq), 0)
+            if self.metrics is not None:
+                self.metrics.gauge('lots_view_index_lag', view=view.name).set(self.lag[view.name])
+        for feed_view in self.feed_views:
+            lagging = self.lag.get(feed_view.view.name, 0) > self.max_lag
+            feed_view.stale = 'ok' if lagging else None
+        return self.lag
+
+    def run(self):
+        self.warm_safely()
+        while True:
+            if self.written.wait(self.interval if self.lagging else None):
+                # wait for the burst of writes to end
+                sleep(self.debounce)
+                self.written.clear()
+            self.warm_safely()
+
+    @property
+    def lagging(self):
+        return any(i.stale for i in self.feed_views)
+
+    def warm_safely(self):
+        try:
+            lag = self.warm()
+        except Exception, e:
+            if self.metrics is not None:
+                self.metrics.counter('lots_views_warm_failures_total', error=type(e).__name__).inc()
+            LOGGER.warning('Failed to warm lots views: {!r}'.format(e),
+                           extra={'MESSAGE_ID': 'lots_views_warm_error'})
+        else:
+            LOGGER.info('Warmed lots views, index lag: {}'.format(lag),
+                        extra={'MESSAGE_ID': 'lots_views_warm'})
+
+
+def view_warmer_factory(settings, metrics=None):
+    """ Build view warmer from ``view_warmer`` plugin settings """
+    if not settings:
+        return
+    from openregistry.lots.core.design import FEED
+    return ViewWarmer(FEED,
+                      interval=float(settings.get('interval', 5)),
+                      debounce=float(settings.get('debounce', 1)),
+                      max_lag=int(settings.get('max_lag', 1000)),
+                      metrics=metrics)
+
+
+def start_view_warmer(event):
+    """ ApplicationCreated subscriber starting the view warmer """
+    warmer = event.app.registry.view_warmer
+    warmer.db = event.app.registry.db
+    thread = Thread(target=warmer.run)
+    thread.daemon = True
+    thread.start()